@@ -1,12 +1,14 @@
 import logging
 from http import HTTPStatus
-from typing import List, Literal
+from typing import AsyncIterator, List, Literal, Optional
 from uuid import UUID
 
-from core.config import ErrorMessage
-from fastapi import APIRouter, Depends, HTTPException, Query
-from models.film import FilmApi, FilmBriefApi, FilmGenreApi, FilmPeopleApi
+from core.config import BATCH_MAX_SIZE, PAGE_DEFAULT_SIZE, PAGE_MAX_SIZE, ErrorMessage
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from models.film import Film, FilmApi, FilmBriefApi, FilmGenreApi, FilmPeopleApi, FilmSearchApi
 from services.film import FilmService, get_film_service
+from utils.cursor import next_cursor_header, page_cursor
 
 # Объект router, в котором регистрируем обработчики
 router = APIRouter()
@@ -31,20 +33,87 @@ router = APIRouter()
 #     film = await film_service.get_by_id(film_id)
 
 
+# Маршрут объявлен до /{film_id}, иначе "search" был бы принят за UUID фильма
+@router.get('/search', response_model=List[FilmSearchApi])
+async def film_search(query: str = Query(..., min_length=1),
+                      page_size: int = Query(PAGE_DEFAULT_SIZE, alias="page[size]", ge=1, le=PAGE_MAX_SIZE),
+                      page_number: int = Query(1, alias="page[number]", ge=1),
+                      cursor: Optional[str] = Depends(page_cursor),
+                      film_service: FilmService = Depends(get_film_service)
+                      ) -> Response:
+    """
+        Полнотекстовый поиск фильмов по названию, описанию и именам
+        актеров и сценаристов
+        #GET /api/v1/film/search?query=star&page[size]=50&page[number]=1
+    """
+    query = query.strip()
+    next_cursor = None
+
+    async def build() -> List[FilmSearchApi]:
+        nonlocal next_cursor
+        page = await film_service.search(query, page_size, page_number, cursor)
+        if not page.items:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.FILM_NOT_FOUND)
+        next_cursor = page.next_cursor
+        return [
+            FilmSearchApi(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating, highlight=film.highlight)
+            for film in page.items
+        ]
+
+    key = await film_service.get_search_key(query, page_size, page_number, cursor)
+    return await film_service.cached_response(key, build, lambda: next_cursor_header(next_cursor))
+
+
+@router.get('/export')
+async def film_export(film_service: FilmService = Depends(get_film_service)) -> StreamingResponse:
+    """
+        Выгрузка всего каталога фильмов в формате NDJSON: по одному фильму
+        в строке. Ответ передается по мере чтения индекса
+        #GET /api/v1/film/export
+    """
+
+    async def lines() -> AsyncIterator[str]:
+        async for film in film_service.export():
+            yield FilmBriefApi(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating).json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
 @router.get('/{film_id}', response_model=FilmApi)
-async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> FilmApi:
+async def film_details(film_id: str, film_service: FilmService = Depends(get_film_service)) -> Response:
     """
         Пример обращений, которые должны обрабатываться API
         #GET /api/v1/film/bf3bd131-b844-4585-9974-6c374cff2371
     """
 
-    film = await film_service.get_by_id(film_id)
-    if not film:
-        # Если фильм не найден, отдаём 404 статус
-        # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
-        # Такой код будет более поддерживаемым
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.FILM_NOT_FOUND)
+    async def build() -> FilmApi:
+        film = await film_service.get_by_id(film_id)
+        if not film:
+            # Если фильм не найден, отдаём 404 статус
+            # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
+            # Такой код будет более поддерживаемым
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.FILM_NOT_FOUND)
+        return film_to_api(film)
+
+    # Готовое тело ответа берется из кеша без повторной валидации и сериализации
+    return await film_service.cached_response(film_id, build)
+
+
+@router.post('/batch', response_model=List[FilmApi])
+async def film_batch(film_ids: List[UUID] = Body(...),
+                     film_service: FilmService = Depends(get_film_service)) -> List[FilmApi]:
+    """
+        Получить несколько фильмов одним запросом. Фильмы, которых нет в базе,
+        в ответ не попадают
+        #POST /api/v1/film/batch ["bf3bd131-b844-4585-9974-6c374cff2371", ...]
+    """
+    if len(film_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=ErrorMessage.BATCH_TOO_LARGE)
+    films = await film_service.get_by_ids([str(film_id) for film_id in film_ids])
+    return [film_to_api(film) for film in films]
 
+
+def film_to_api(film: Film) -> FilmApi:
     # Перекладываем данные из models.Film в Film
     # Обратите внимание, что у модели бизнес-логики есть поле description
     # Которое отсутствует в модели ответа API.
@@ -53,8 +122,8 @@ async def film_details(film_id: str, film_service: FilmService = Depends(get_fil
     # и, возможно, данные, которые опасно возвращать
 
     genre_list = [FilmGenreApi(uuid=genres.get("id"), name=genres.get("name")) for genres in film.genres or []]
-    actors_list = [FilmPeopleApi(uuid=actor.get("id"), name=actor.get("name")) for actor in film.actors or []]
-    writers_list = [FilmPeopleApi(uuid=writer.get("id"), name=writer.get("name")) for writer in film.writers or []]
+    actors_list = [FilmPeopleApi(uuid=actor.get("id"), full_name=actor.get("name")) for actor in film.actors or []]
+    writers_list = [FilmPeopleApi(uuid=writer.get("id"), full_name=writer.get("name")) for writer in film.writers or []]
 
     return FilmApi(uuid=film.uuid, title=film.title, imdb_rating=film.imdb_rating, description=film.description,
                    genre=genre_list, actors=actors_list, writers=writers_list, director=film.director)
@@ -63,26 +132,38 @@ async def film_details(film_id: str, film_service: FilmService = Depends(get_fil
 @router.get('/')
 async def film_list_by_genre(sort: Literal["-imdb_rating", "+imdb_rating"] = "-imdb_rating",
                              filter_genre: UUID = Query(None, alias="filter[genre]"),
-                             page_size: int = Query(None, alias="page[size]"),
-                             page_number: int = Query(None, alias="page[number]"),
+                             page_size: int = Query(PAGE_DEFAULT_SIZE, alias="page[size]", ge=1, le=PAGE_MAX_SIZE),
+                             page_number: int = Query(1, alias="page[number]", ge=1),
+                             cursor: Optional[str] = Depends(page_cursor),
                              film_service: FilmService = Depends(get_film_service)
-                             ) -> List[FilmBriefApi]:
+                             ) -> Response:
     """
         Примеры обращений, которые должны обрабатываться API
         #GET /api/v1/film?sort=-imdb_rating&page[size]=50&page[number]=1
         #GET /api/v1/film?filter[genre]=<uuid:UUID>&sort=-imdb_rating&page[size]=50&page[number]=1
+        Без page[size] страница содержит PAGE_DEFAULT_SIZE фильмов.
+        Курсор следующей страницы возвращается в заголовке X-Next-Cursor:
+        #GET /api/v1/film?sort=-imdb_rating&page[size]=50&page[cursor]=<cursor>
     """
 
     logging.debug(f"Получили параметры {sort=}-{type(sort)}, {filter_genre=}-{type(filter_genre)},"
-                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}")
-    # Получаем список фильмов
-    # Доработать сортировку ort=-imdb_rating
-    films = await film_service.get_by_genre_id(filter_genre, sort, page_size, page_number)
-    if not films:
-        # Если выборка пустая, отдаём 404 статус
-        # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
-        # Такой код будет более поддерживаемым
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.FILM_NOT_FOUND)
-    # Перекладываем данные из models.Film в Film
-    films_api = [FilmBriefApi(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating) for film in films]
-    return films_api
+                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}, {cursor=}")
+
+    next_cursor = None
+
+    async def build() -> List[FilmBriefApi]:
+        nonlocal next_cursor
+        # Получаем список фильмов
+        # Доработать сортировку ort=-imdb_rating
+        page = await film_service.get_by_genre_id(filter_genre, sort, page_size, page_number, cursor)
+        if not page.items:
+            # Если выборка пустая, отдаём 404 статус
+            # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
+            # Такой код будет более поддерживаемым
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.FILM_NOT_FOUND)
+        next_cursor = page.next_cursor
+        # Перекладываем данные из models.Film в Film
+        return [FilmBriefApi(uuid=film.id, title=film.title, imdb_rating=film.imdb_rating) for film in page.items]
+
+    key = await film_service.get_list_key(filter_genre, sort, page_size, page_number, cursor)
+    return await film_service.cached_response(key, build, lambda: next_cursor_header(next_cursor))
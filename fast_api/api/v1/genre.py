@@ -1,24 +1,62 @@
 import logging
 from http import HTTPStatus
-from typing import List, Literal, Optional
+from typing import AsyncIterator, List, Literal, Optional
 from uuid import UUID
 
-from core.config import ErrorMessage
-from fastapi import APIRouter, Depends, HTTPException, Query
-from models.genre import Genre_API, GenreBrief_API
+from core.config import BATCH_MAX_SIZE, PAGE_MAX_SIZE, ErrorMessage
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from models.genre import Genre, Genre_API, GenreBrief_API
 from services.genre import GenreService, get_genre_service
+from utils.cursor import next_cursor_header, page_cursor
 
 router = APIRouter()
 
 
+@router.get('/export')
+async def genre_export(genre_service: GenreService = Depends(get_genre_service)) -> StreamingResponse:
+    """
+        Выгрузка всех жанров в формате NDJSON: по одному жанру в строке
+        #GET /api/v1/genre/export
+    """
+
+    async def lines() -> AsyncIterator[str]:
+        async for genre in genre_service.export():
+            yield GenreBrief_API(uuid=genre.id, name=genre.name, description=genre.description).json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
 @router.get('/{genre_id}', response_model=Genre_API)
 async def genre_details(
     genre_id: str,
     genre_service: GenreService = Depends(get_genre_service)
-) -> Genre_API:
-    genre = await genre_service.get_by_id(genre_id)
-    if not genre:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.GENRE_NOT_FOUND)
+) -> Response:
+    async def build() -> Genre_API:
+        genre = await genre_service.get_by_id(genre_id)
+        if not genre:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.GENRE_NOT_FOUND)
+        return genre_to_api(genre)
+
+    return await genre_service.cached_response(genre_id, build)
+
+
+@router.post('/batch', response_model=List[Genre_API])
+async def genre_batch(
+    genre_ids: List[UUID] = Body(...),
+    genre_service: GenreService = Depends(get_genre_service)
+) -> List[Genre_API]:
+    """
+        Получить несколько жанров одним запросом
+        #POST /api/v1/genre/batch ["<uuid:UUID>", ...]
+    """
+    if len(genre_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=ErrorMessage.BATCH_TOO_LARGE)
+    genres = await genre_service.get_by_ids([str(genre_id) for genre_id in genre_ids])
+    return [genre_to_api(genre) for genre in genres]
+
+
+def genre_to_api(genre: Genre) -> Genre_API:
     return Genre_API(
         uuid=genre.uuid,
         name=genre.name,
@@ -30,26 +68,34 @@ async def genre_details(
 @router.get('/')
 async def genre_list(sort: Literal["name.raw"] = "name.raw",
                      filter_film: Optional[UUID] = Query(None, alias="filter[film]"),
-                     page_size: int = Query(10, alias="page[size]"),
-                     page_number: int = Query(1, alias="page[number]"),
+                     page_size: int = Query(10, alias="page[size]", ge=1, le=PAGE_MAX_SIZE),
+                     page_number: int = Query(1, alias="page[number]", ge=1),
+                     cursor: Optional[str] = Depends(page_cursor),
                      genre_service: GenreService = Depends(get_genre_service)
-                     ) -> List[GenreBrief_API]:
+                     ) -> Response:
     """
         Примеры обращений, которые должны обрабатываться API
         #GET /api/v1/genre?sort=name&page[size]=50&page[number]=1
         #GET /api/v1/genre?filter[film]=<uuid:UUID>&sort=name&page[size]=50&page[number]=1
     """
     logging.debug(f"Получили параметры {sort=}-{type(sort)}, {filter_film=}-{type(filter_film)},"
-                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}")
-    genres = await genre_service.get_by_film_id(
-        filter_film, sort, page_size, page_number
-    )
-    if not genres:
-        # Если выборка пустая, отдаём 404 статус
-        # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
-        # Такой код будет более поддерживаемым
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.GENRE_NOT_FOUND)
-    return [
-        GenreBrief_API(uuid=genre.id, name=genre.name, description=genre.description)
-        for genre in genres
-    ]
+                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}, {cursor=}")
+
+    next_cursor = None
+
+    async def build() -> List[GenreBrief_API]:
+        nonlocal next_cursor
+        page = await genre_service.get_by_film_id(filter_film, sort, page_size, page_number, cursor)
+        if not page.items:
+            # Если выборка пустая, отдаём 404 статус
+            # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
+            # Такой код будет более поддерживаемым
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.GENRE_NOT_FOUND)
+        next_cursor = page.next_cursor
+        return [
+            GenreBrief_API(uuid=genre.id, name=genre.name, description=genre.description)
+            for genre in page.items
+        ]
+
+    key = await genre_service.get_list_key(filter_film, sort, page_size, page_number, cursor)
+    return await genre_service.cached_response(key, build, lambda: next_cursor_header(next_cursor))
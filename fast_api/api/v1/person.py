@@ -1,24 +1,63 @@
 import logging
 from http import HTTPStatus
-from typing import List, Literal, Optional
+from typing import AsyncIterator, List, Literal, Optional
 from uuid import UUID
 
-from core.config import ErrorMessage
-from fastapi import APIRouter, Depends, HTTPException, Query
-from models.person import Person_API, PersonBrief_API
+from core.config import BATCH_MAX_SIZE, PAGE_MAX_SIZE, ErrorMessage
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import Response, StreamingResponse
+from models.person import Person, Person_API, PersonBrief_API
 from services.person import PersonService, get_person_service
+from utils.cursor import next_cursor_header, page_cursor
 
 router = APIRouter()
 
 
+@router.get('/export')
+async def person_export(person_service: PersonService = Depends(get_person_service)) -> StreamingResponse:
+    """
+        Выгрузка всех людей в формате NDJSON: по одному человеку в строке
+        #GET /api/v1/person/export
+    """
+
+    async def lines() -> AsyncIterator[str]:
+        async for person in person_service.export():
+            person_api = PersonBrief_API(uuid=person.id, full_name=person.full_name, birth_date=person.birth_date)
+            yield person_api.json() + '\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
 @router.get('/{person_id}', response_model=Person_API)
 async def person_details(
     person_id: str,
     person_service: PersonService = Depends(get_person_service)
-) -> Person_API:
-    person = await person_service.get_by_id(person_id)
-    if not person:
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.PERSON_NOT_FOUND)
+) -> Response:
+    async def build() -> Person_API:
+        person = await person_service.get_by_id(person_id)
+        if not person:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail=ErrorMessage.PERSON_NOT_FOUND)
+        return person_to_api(person)
+
+    return await person_service.cached_response(person_id, build)
+
+
+@router.post('/batch', response_model=List[Person_API])
+async def person_batch(
+    person_ids: List[UUID] = Body(...),
+    person_service: PersonService = Depends(get_person_service)
+) -> List[Person_API]:
+    """
+        Получить информацию о нескольких людях одним запросом
+        #POST /api/v1/person/batch ["<uuid:UUID>", ...]
+    """
+    if len(person_ids) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=ErrorMessage.BATCH_TOO_LARGE)
+    persons = await person_service.get_by_ids([str(person_id) for person_id in person_ids])
+    return [person_to_api(person) for person in persons]
+
+
+def person_to_api(person: Person) -> Person_API:
     return Person_API(
         uuid=person.uuid,
         full_name=person.full_name,
@@ -31,26 +70,40 @@ async def person_details(
 async def person_list(sort: Literal["full_name.raw"] = "full_name.raw",
                       filter_film: Optional[UUID] = Query(None, alias="filter[film]"),
                       filter_name: Optional[str] = Query(None, alias="search[name]"),
-                      page_size: int = Query(10, alias="page[size]"),
-                      page_number: int = Query(1, alias="page[number]"),
+                      page_size: int = Query(10, alias="page[size]", ge=1, le=PAGE_MAX_SIZE),
+                      page_number: int = Query(1, alias="page[number]", ge=1),
+                      cursor: Optional[str] = Depends(page_cursor),
                       person_service: PersonService = Depends(get_person_service)
-                      ) -> List[PersonBrief_API]:
+                      ) -> Response:
     """
         Примеры обращений, которые должны обрабатываться API
         #GET /api/v1/person?sort=full_name.raw&page[size]=50&page[number]=1
         #GET /api/v1/person?filter[film]=<uuid:UUID>&sort=name&page[size]=50&page[number]=1
     """
     logging.debug(f"Получили параметры {sort=}-{type(sort)}, {filter_film=}-{type(filter_film)},"
-                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}")
-    persons = await person_service.get_by_film_id(
-        filter_film, filter_name, sort, page_size, page_number
-    )
-    if not persons:
-        # Если выборка пустая, отдаём 404 статус
-        # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
-        # Такой код будет более поддерживаемым
-        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='persons not found')
-    return [
-        PersonBrief_API(uuid=person.id, full_name=person.full_name, birth_date=person.birth_date)
-        for person in persons
-    ]
+                  f" {page_size=}-{type(page_size)}, {page_number=}-{type(page_number)}, {cursor=}")
+
+    next_cursor = None
+
+    async def build() -> List[PersonBrief_API]:
+        nonlocal next_cursor
+        page = await person_service.get_by_film_id(filter_film, filter_name, sort, page_size, page_number, cursor)
+        if not page.items:
+            # Если выборка пустая, отдаём 404 статус
+            # Желательно пользоваться уже определёнными HTTP-статусами, которые содержат enum
+            # Такой код будет более поддерживаемым
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail='persons not found')
+        next_cursor = page.next_cursor
+        return [
+            PersonBrief_API(uuid=person.id, full_name=person.full_name, birth_date=person.birth_date)
+            for person in page.items
+        ]
+
+    if filter_name:
+        # Поиск по имени кеширует только id найденных людей, а записи о людях
+        # берутся из их общего кеша. Готовое тело ответа не кешируется:
+        # иначе в Redis снова хранились бы полные результаты поиска
+        items = await build()
+        return person_service.json_response(items, next_cursor_header(next_cursor))
+    key = await person_service.get_list_key(filter_film, sort, page_size, page_number, cursor)
+    return await person_service.cached_response(key, build, lambda: next_cursor_header(next_cursor))
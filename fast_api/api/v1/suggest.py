@@ -0,0 +1,37 @@
+from http import HTTPStatus
+
+from core.config import SUGGEST_MAX_SIZE, ErrorMessage
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import Response
+from models.suggest import SuggestionApi, SuggestionsApi
+from services.suggest import SuggestService, get_suggest_service
+from utils.query import normalize_prefix
+
+router = APIRouter()
+
+
+@router.get('/', response_model=SuggestionsApi)
+async def suggest(prefix: str = Query(..., min_length=1),
+                  size: int = Query(SUGGEST_MAX_SIZE, ge=1, le=SUGGEST_MAX_SIZE),
+                  suggest_service: SuggestService = Depends(get_suggest_service)
+                  ) -> Response:
+    """
+        Подсказки названий фильмов и имен людей по началу строки
+        #GET /api/v1/suggest?prefix=star&size=5
+    """
+    # Пустой после нормализации префикс подошел бы к любому названию
+    prefix = normalize_prefix(prefix)
+    if not prefix:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=ErrorMessage.EMPTY_PREFIX)
+
+    async def build() -> SuggestionsApi:
+        suggestions = await suggest_service.suggest(prefix, size)
+        if suggestions is None:
+            raise HTTPException(status_code=HTTPStatus.GATEWAY_TIMEOUT, detail=ErrorMessage.SUGGEST_TIMEOUT)
+        return SuggestionsApi(
+            films=[SuggestionApi(uuid=film.id, text=film.text) for film in suggestions.films],
+            persons=[SuggestionApi(uuid=person.id, text=person.text) for person in suggestions.persons]
+        )
+
+    key = await suggest_service.get_suggest_key(prefix, size)
+    return await suggest_service.cached_response(key, build)
@@ -14,11 +14,41 @@ REDIS_HOST = os.getenv('REDIS_HOST', '127.0.0.1')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
 REDIS_AUTH = os.getenv('REDIS_AUTH', "password")
 
+# Настройки локального (в памяти процесса) уровня кеша
+LOCAL_CACHE_MAX_SIZE = int(os.getenv('LOCAL_CACHE_MAX_SIZE', 1024))
+LOCAL_CACHE_TTL_SECONDS = int(os.getenv('LOCAL_CACHE_TTL_SECONDS', 30))
+
+# Как часто (в секундах) писать в лог попадания и промахи уровней кеша, 0 - не писать
+CACHE_STATS_INTERVAL_SECONDS = int(os.getenv('CACHE_STATS_INTERVAL_SECONDS', 60))
+
+# Записи кеша больше этого размера (в байтах) сжимаются перед записью в Redis, 0 - не сжимать
+CACHE_COMPRESS_MIN_SIZE = int(os.getenv('CACHE_COMPRESS_MIN_SIZE', 1024))
+
+# Сколько секунд после мягкого срока годности запись кеша еще можно отдавать,
+# пока она обновляется в фоне
+CACHE_STALE_SECONDS = int(os.getenv('CACHE_STALE_SECONDS', 60))
+# Коэффициент вероятностного досрочного обновления кеша (XFetch), 0 - отключено
+CACHE_EARLY_REFRESH_BETA = float(os.getenv('CACHE_EARLY_REFRESH_BETA', 0))
+
 
 # Настройки Elasticsearch
 ELASTIC_HOST = os.getenv('ELASTIC_HOST', '127.0.0.1')
 ELASTIC_PORT = int(os.getenv('ELASTIC_PORT', 9200))
 
+# Максимальное количество идентификаторов в одном пакетном запросе
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 100))
+
+# Размер страницы списков: по умолчанию (если page[size] не передан) и наибольший допустимый
+PAGE_DEFAULT_SIZE = int(os.getenv('PAGE_DEFAULT_SIZE', 50))
+PAGE_MAX_SIZE = int(os.getenv('PAGE_MAX_SIZE', 100))
+
+# Размер страницы, которыми выгрузка каталога читает индекс Elasticsearch
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', 1000))
+
+# Подсказки при наборе: наибольшее число подсказок и допустимое время ответа Elasticsearch
+SUGGEST_MAX_SIZE = int(os.getenv('SUGGEST_MAX_SIZE', 10))
+SUGGEST_TIMEOUT_SECONDS = float(os.getenv('SUGGEST_TIMEOUT_SECONDS', 0.3))
+
 # Корень проекта
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -28,3 +58,7 @@ class ErrorMessage:
     FILM_NOT_FOUND = 'Film(s) not found'
     GENRE_NOT_FOUND = 'Genre(s) not found'
     PERSON_NOT_FOUND = 'Person(s) not found'
+    BATCH_TOO_LARGE = 'Too many ids in batch request'
+    BAD_CURSOR = 'Invalid page cursor'
+    SUGGEST_TIMEOUT = 'Suggestions are not ready in time'
+    EMPTY_PREFIX = 'Prefix must contain letters or digits'
@@ -1,32 +1,315 @@
+import asyncio
+import logging
+import math
+import random
+import time
+import zlib
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
 from aioredis import Redis
-from typing import Optional
 
 redis: Optional[Redis] = None
+cache: Optional['MemoryCache'] = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheEntry:
+    """
+        Конверт записи кеша. Кроме самих данных хранит мягкий срок годности
+        (после него запись еще отдается, но уже обновляется в фоне) и время,
+        которое потребовалось на получение данных из Elasticsearch.
+    """
+    __slots__ = ('data', 'soft_expire', 'delta')
+
+    def __init__(self, data: Any, soft_expire: float, delta: float = 0.0):
+        self.data = data
+        self.soft_expire = soft_expire
+        self.delta = delta
+
+    @classmethod
+    def create(cls, data: Any, expire: int, delta: float = 0.0) -> 'CacheEntry':
+        return cls(data, time.time() + expire, delta)
+
+    def dump(self, data_obj: Any) -> dict:
+        """
+            Представить конверт в виде, пригодном для сериализатора кеша.
+            Данные передаются уже приведенными к простым типам
+        """
+        return {"soft_expire": self.soft_expire, "delta": self.delta, "data": data_obj}
+
+    @classmethod
+    def load(cls, obj: Any, loads_data: Callable[[Any], Any]) -> 'CacheEntry':
+        """
+            Разобрать конверт. Записи, сохраненные без конверта, считаются
+            устаревшими: они будут отданы и сразу обновлены в фоне
+        """
+        if isinstance(obj, dict) and 'soft_expire' in obj and 'data' in obj:
+            return cls(loads_data(obj['data']), obj['soft_expire'], obj.get('delta', 0.0))
+        return cls(loads_data(obj), 0.0)
+
+    def should_refresh(self, beta: float = 0.0) -> bool:
+        """
+            Нужно ли обновить запись. При beta > 0 используется вероятностное
+            досрочное обновление (XFetch): чем ближе мягкий срок годности и
+            чем дольше пересчет, тем выше вероятность обновить запись заранее
+        """
+        now = time.time()
+        if beta > 0 and self.delta > 0:
+            now -= self.delta * beta * math.log(1.0 - random.random())
+        return now >= self.soft_expire
+
+
+class Serializer(ABC):
+    @abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, raw: bytes) -> Any:
+        pass
+
+
+class OrjsonSerializer(Serializer):
+    """
+        Сериализация в компактные байты orjson. Готовые байты (например,
+        тело ответа API) сохраняются как есть. Записи больше
+        compress_min_size байт сжимаются zlib. Первый байт записи - маркер
+        формата; записи без маркера (JSON-строки, сохраненные прежними
+        версиями, и счетчики INCR) читаются как обычный JSON.
+    """
+    ORJSON = b'\x01'
+    ORJSON_ZLIB = b'\x02'
+    RAW = b'\x03'
+    RAW_ZLIB = b'\x04'
+
+    def __init__(self, compress_min_size: int = 0, compress_level: int = 1):
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+
+    def dumps(self, obj: Any) -> bytes:
+        if isinstance(obj, bytes):
+            raw, marker, zlib_marker = obj, self.RAW, self.RAW_ZLIB
+        else:
+            raw, marker, zlib_marker = orjson.dumps(obj), self.ORJSON, self.ORJSON_ZLIB
+        if 0 < self.compress_min_size <= len(raw):
+            return zlib_marker + zlib.compress(raw, self.compress_level)
+        return marker + raw
+
+    def loads(self, raw: bytes) -> Any:
+        marker = raw[:1]
+        if marker == self.ORJSON:
+            return orjson.loads(raw[1:])
+        if marker == self.ORJSON_ZLIB:
+            return orjson.loads(zlib.decompress(raw[1:]))
+        if marker == self.RAW:
+            return raw[1:]
+        if marker == self.RAW_ZLIB:
+            return zlib.decompress(raw[1:])
+        return orjson.loads(raw)
 
 
 class MemoryCache(ABC):
     @abstractmethod
-    def set(self, key, data, expire):
+    def set(self, key, data, expire, value=None):
+        pass
+
+    @abstractmethod
+    def get(self, key, loads: Optional[Callable] = None):
+        pass
+
+    @abstractmethod
+    def set_many(self, items: Dict[str, Any], expire, values: Optional[Dict[str, Any]] = None):
+        pass
+
+    @abstractmethod
+    def get_many(self, keys: List[str], loads: Optional[Callable] = None) -> List[Optional[Any]]:
         pass
 
     @abstractmethod
-    def get(self, key):
+    def delete(self, *keys):
         pass
 
 
 class RedisCache(MemoryCache):
+    """
+        Кеш в Redis. Данные сериализуются в байты переданным сериализатором,
+        а функция loads получает уже разобранный объект.
+    """
     __con = None
 
-    def __init__(self, redis_instance: Redis):
+    def __init__(self, redis_instance: Redis, serializer: Optional[Serializer] = None):
         self.__con = redis_instance
+        self.serializer = serializer or OrjsonSerializer()
 
-    async def set(self, key, data, expire):
-        await self.__con.set(key, data, expire=expire)
+    async def set(self, key, data, expire, value=None):
+        await self.__con.set(key, self.serializer.dumps(data), expire=expire)
 
-    async def get(self, key):
+    async def get(self, key, loads: Optional[Callable] = None):
         data = await self.__con.get(key)
-        return data
+        return self.__loads(data, loads)
+
+    async def set_many(self, items: Dict[str, Any], expire, values: Optional[Dict[str, Any]] = None):
+        # Все записи отправляются в Redis одним пакетом команд
+        pipe = self.__con.pipeline()
+        for key, data in items.items():
+            pipe.set(key, self.serializer.dumps(data), expire=expire)
+        await pipe.execute()
+
+    async def get_many(self, keys: List[str], loads: Optional[Callable] = None) -> List[Optional[Any]]:
+        if not keys:
+            return []
+        return [self.__loads(data, loads) for data in await self.__con.mget(*keys)]
+
+    def __loads(self, data: Optional[bytes], loads: Optional[Callable]):
+        if not data:
+            return None
+        obj = self.serializer.loads(data)
+        return loads(obj) if loads else obj
+
+    async def delete(self, *keys):
+        if keys:
+            await self.__con.delete(*keys)
+
+
+class LRUCache(MemoryCache):
+    """
+        Ограниченный по размеру кеш в памяти процесса с вытеснением давно
+        не использованных ключей. Хранит уже разобранные объекты, поэтому
+        при попадании не нужно ни обращаться к Redis, ни повторно
+        валидировать данные pydantic-моделью.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.__data = OrderedDict()
+
+    async def set(self, key, data, expire, value=None):
+        if self.max_size <= 0:
+            return
+        # Локальная копия не должна жить дольше записи в Redis
+        expire_at = time.monotonic() + min(expire or self.ttl, self.ttl)
+        self.__data[key] = (expire_at, value if value is not None else data)
+        self.__data.move_to_end(key)
+        while len(self.__data) > self.max_size:
+            self.__data.popitem(last=False)
+
+    async def get(self, key, loads: Optional[Callable] = None):
+        item = self.__data.get(key)
+        if item is None:
+            return None
+        expire_at, value = item
+        if expire_at < time.monotonic():
+            del self.__data[key]
+            return None
+        self.__data.move_to_end(key)
+        return value
+
+    async def set_many(self, items: Dict[str, Any], expire, values: Optional[Dict[str, Any]] = None):
+        values = values or {}
+        for key, data in items.items():
+            await self.set(key, data, expire, value=values.get(key))
+
+    async def get_many(self, keys: List[str], loads: Optional[Callable] = None) -> List[Optional[Any]]:
+        return [await self.get(key) for key in keys]
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.__data.pop(key, None)
+
+    def clear(self):
+        self.__data.clear()
+
+    def __len__(self):
+        return len(self.__data)
+
+
+class TwoTierCache(MemoryCache):
+    """
+        Двухуровневый кеш: локальный LRU в памяти процесса перед Redis.
+        Ведет счетчики попаданий и промахов для каждого уровня.
+    """
+
+    def __init__(self, local: LRUCache, remote: MemoryCache):
+        self.local = local
+        self.remote = remote
+        self.hits = {'local': 0, 'redis': 0}
+        self.misses = {'local': 0, 'redis': 0}
+
+    async def set(self, key, data, expire, value=None):
+        await self.remote.set(key, data, expire)
+        await self.local.set(key, data, expire, value=value)
+
+    async def get(self, key, loads: Optional[Callable] = None):
+        value = await self.local.get(key)
+        if value is not None:
+            self.hits['local'] += 1
+            return value
+        self.misses['local'] += 1
+
+        value = await self.remote.get(key, loads=loads)
+        if not value:
+            self.misses['redis'] += 1
+            return None
+        self.hits['redis'] += 1
+        await self.local.set(key, value, self.local.ttl)
+        return value
+
+    async def set_many(self, items: Dict[str, Any], expire, values: Optional[Dict[str, Any]] = None):
+        await self.remote.set_many(items, expire)
+        await self.local.set_many(items, expire, values=values)
+
+    async def get_many(self, keys: List[str], loads: Optional[Callable] = None) -> List[Optional[Any]]:
+        """
+            Получить несколько ключей: сначала из локального уровня, а все
+            недостающие - одним запросом MGET к Redis
+        """
+        result = dict(zip(keys, await self.local.get_many(keys)))
+        missing = [key for key, value in result.items() if value is None]
+        self.hits['local'] += len(result) - len(missing)
+        self.misses['local'] += len(missing)
+
+        for key, value in zip(missing, await self.remote.get_many(missing, loads=loads)):
+            if not value:
+                self.misses['redis'] += 1
+                continue
+            self.hits['redis'] += 1
+            result[key] = value
+            await self.local.set(key, value, self.local.ttl)
+        return [result[key] for key in keys]
+
+    async def delete(self, *keys):
+        await self.remote.delete(*keys)
+        await self.local.delete(*keys)
+
+    def stats(self) -> dict:
+        """
+            Счетчики попаданий и промахов уровней с момента запуска, доля
+            попаданий каждого уровня и число записей в локальном уровне
+        """
+        return {
+            'hits': dict(self.hits),
+            'misses': dict(self.misses),
+            'hit_ratio': {
+                tier: round(self.hits[tier] / (self.hits[tier] + self.misses[tier]), 3)
+                if self.hits[tier] + self.misses[tier] else 0.0
+                for tier in self.hits
+            },
+            'local_size': len(self.local),
+        }
+
+
+async def log_stats(two_tier: TwoTierCache, interval: int):
+    """
+        Раз в interval секунд писать в лог статистику двухуровневого кеша
+    """
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(f"Статистика кеша: {two_tier.stats()}")
 
 
 async def get_redis() -> Redis:
@@ -34,5 +317,12 @@ async def get_redis() -> Redis:
 
 
 async def get_cache() -> MemoryCache:
-    redis_instance = await get_redis()
-    return RedisCache(redis_instance)
+    return cache
+
+
+def create_cache(redis_instance: Redis, local_max_size: int, local_ttl: int, compress_min_size: int) -> MemoryCache:
+    """
+        Собрать кеш приложения: локальный LRU поверх RedisCache
+    """
+    serializer = OrjsonSerializer(compress_min_size)
+    return TwoTierCache(LRUCache(local_max_size, local_ttl), RedisCache(redis_instance, serializer))
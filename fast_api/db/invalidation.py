@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+import aioredis
+from db.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Канал, в который ETL публикует идентификаторы переиндексированных документов
+INVALIDATION_CHANNEL = 'cache_invalidation'
+# Пауза перед повторным подключением к Redis после обрыва соединения
+RECONNECT_DELAY_SECONDS = 1
+
+
+def generation_key(tag: str) -> str:
+    """
+        Ключ счетчика поколения тега. Тегом служит имя индекса (все списки
+        индекса) или, например, movies:genre:<uuid> (списки фильмов жанра).
+        ETL увеличивает счетчик при переиндексации связанных документов,
+        а ключи кеша списков включают его текущее значение
+    """
+    return f'generation:{tag}'
+
+
+def response_key(key: str) -> str:
+    """
+        Ключ готового тела ответа API для записи кеша key
+    """
+    return f'response:{key}'
+
+
+async def listen_invalidations(address: tuple, password: str, local_cache: LRUCache):
+    """
+        Слушать канал сброса кеша и удалять из локального уровня кеша
+        обновленные документы, готовые ответы API по ним и поколения
+        затронутых тегов. Записи в Redis ETL
+        удаляет сам, поэтому здесь достаточно сбросить локальные копии.
+    """
+    while True:
+        try:
+            connection = await aioredis.create_redis(address, password=password)
+            try:
+                channel, = await connection.subscribe(INVALIDATION_CHANNEL)
+                # Пока подписки не было, сообщения могли быть пропущены
+                local_cache.clear()
+                while await channel.wait_message():
+                    message = await channel.get_json()
+                    tags = message.get('tags') or [message['index']]
+                    await local_cache.delete(
+                        *(generation_key(tag) for tag in tags),
+                        *message['ids'],
+                        *(response_key(doc_id) for doc_id in message['ids'])
+                    )
+            finally:
+                connection.close()
+                await connection.wait_closed()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка подписки на сброс кеша: {e}")
+        await asyncio.sleep(RECONNECT_DELAY_SECONDS)
@@ -1,11 +1,13 @@
+import asyncio
 import logging
 
 import aioredis
 import uvicorn
-from api.v1 import film, genre, person
+from api.v1 import film, genre, person, suggest
 from core import config
 from core.logger import LOGGING
 from db import elastic, cache
+from db.invalidation import listen_invalidations
 from elasticsearch import AsyncElasticsearch
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
@@ -30,22 +32,38 @@ async def startup():
     # Поэтому логика подключения происходит в асинхронной функции
     cache.redis = await aioredis.create_redis_pool((config.REDIS_HOST, config.REDIS_PORT), minsize=10,
                                                    maxsize=20, password=config.REDIS_AUTH)
+    cache.cache = cache.create_cache(cache.redis, config.LOCAL_CACHE_MAX_SIZE, config.LOCAL_CACHE_TTL_SECONDS,
+                                     config.CACHE_COMPRESS_MIN_SIZE)
     elastic.es = AsyncElasticsearch(hosts=[f'{config.ELASTIC_HOST}:{config.ELASTIC_PORT}'])
+    # Слушаем сообщения ETL об обновленных документах и сбрасываем их локальные копии
+    app.state.invalidation = asyncio.ensure_future(
+        listen_invalidations((config.REDIS_HOST, config.REDIS_PORT), config.REDIS_AUTH, cache.cache.local)
+    )
+    # Периодически пишем в лог попадания и промахи уровней кеша
+    app.state.cache_stats = None
+    if config.CACHE_STATS_INTERVAL_SECONDS:
+        app.state.cache_stats = asyncio.ensure_future(
+            cache.log_stats(cache.cache, config.CACHE_STATS_INTERVAL_SECONDS)
+        )
 
 
 @app.on_event('shutdown')
 async def shutdown():
     # Отключаемся от баз при выключении сервера
+    app.state.invalidation.cancel()
+    if app.state.cache_stats:
+        app.state.cache_stats.cancel()
     await cache.redis.close()
     await elastic.es.close()
 
 
 # Подключаем роутеры к серверу, указав префиксы /v1/film,
-# v1/genre и v1/person
+# v1/genre, v1/person и v1/suggest
 # Теги указываем для удобства навигации по документации
 app.include_router(film.router, prefix='/api/v1/film', tags=['film'])
 app.include_router(genre.router, prefix='/api/v1/genre', tags=['genre'])
 app.include_router(person.router, prefix='/api/v1/person', tags=['person'])
+app.include_router(suggest.router, prefix='/api/v1/suggest', tags=['suggest'])
 
 if __name__ == '__main__':
     # Приложение может запускаться командой
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from uuid import UUID
 
 from models._base import OrjsonModel
@@ -40,6 +40,14 @@ class FilmBriefApi(OrjsonModel):
     imdb_rating: Optional[float]
 
 
+class FilmSearchApi(FilmBriefApi):
+    """
+        Найденный фильм - краткая информация и фрагменты полей, в которых
+        найден запрос. Совпадения в фрагментах выделены тегом <em>.
+    """
+    highlight: Dict[str, List[str]] = {}
+
+
 class Film(OrjsonModel):
     """
         Подробная инфомарция о фильме - возвращается при запросе детальной инфомарции по UUID фильма.
@@ -64,3 +72,26 @@ class FilmBrief(OrjsonModel):
     id: UUID
     title: str
     imdb_rating: Optional[float]
+
+
+class FilmBriefPage(OrjsonModel):
+    """
+        Страница списка фильмов и курсор следующей страницы
+    """
+    items: List[FilmBrief]
+    next_cursor: Optional[str]
+
+
+class FilmSearchHit(FilmBrief):
+    """
+        Найденный фильм и фрагменты полей с выделенными совпадениями
+    """
+    highlight: Dict[str, List[str]] = {}
+
+
+class FilmSearchPage(OrjsonModel):
+    """
+        Страница результатов поиска фильмов и курсор следующей страницы
+    """
+    items: List[FilmSearchHit]
+    next_cursor: Optional[str]
@@ -35,3 +35,11 @@ class GenreBrief(OrjsonModel):
     id: UUID
     name: str
     description: Optional[str]
+
+
+class GenreBriefPage(OrjsonModel):
+    """
+        Страница списка жанров и курсор следующей страницы
+    """
+    items: List[GenreBrief]
+    next_cursor: Optional[str]
@@ -12,7 +12,7 @@ class Person_API(OrjsonModel):
     """
     uuid: UUID
     full_name: str
-    birth_date: Optional[str]
+    birth_date: Optional[datetime.date]
     film_ids: List[str]
 
 
@@ -23,7 +23,7 @@ class PersonBrief_API(OrjsonModel):
     """
     uuid: UUID
     full_name: str
-    birth_date: Optional[str]
+    birth_date: Optional[datetime.date]
 
 
 class Person(OrjsonModel):
@@ -43,3 +43,21 @@ class PersonBrief(OrjsonModel):
     id: UUID
     full_name: str
     birth_date: Optional[datetime.date]
+
+
+class PersonBriefPage(OrjsonModel):
+    """
+        Страница списка людей и курсор следующей страницы
+    """
+    items: List[PersonBrief]
+    next_cursor: Optional[str]
+
+
+class PersonIdsPage(OrjsonModel):
+    """
+        Страница результатов поиска людей: только идентификаторы в порядке
+        выдачи и курсор следующей страницы. Сами документы берутся из кеша
+        информации о людях
+    """
+    ids: List[str]
+    next_cursor: Optional[str]
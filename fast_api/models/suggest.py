@@ -0,0 +1,33 @@
+from typing import List
+from uuid import UUID
+
+from models._base import OrjsonModel
+
+
+class SuggestionApi(OrjsonModel):
+    """
+        Подсказка при наборе: идентификатор и название фильма или имя человека
+    """
+    uuid: UUID
+    text: str
+
+
+class SuggestionsApi(OrjsonModel):
+    """
+        Подсказки по началу названия фильма или имени человека
+    """
+    films: List[SuggestionApi]
+    persons: List[SuggestionApi]
+
+
+class Suggestion(OrjsonModel):
+    id: UUID
+    text: str
+
+
+class Suggestions(OrjsonModel):
+    """
+        Подсказки по началу строки, отдельно для фильмов и людей
+    """
+    films: List[Suggestion]
+    persons: List[Suggestion]
@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import orjson
+from core.config import CACHE_EARLY_REFRESH_BETA, CACHE_STALE_SECONDS, EXPORT_PAGE_SIZE
+from db.cache import CacheEntry, MemoryCache
+from db.invalidation import generation_key, response_key
+from elasticsearch import AsyncElasticsearch
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+from models._base import OrjsonModel
+from utils.cursor import decode_cursor, encode_cursor
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(OrjsonModel):
+    """
+        Готовое тело ответа API и его заголовки в кеше
+    """
+    body: str
+    headers: Dict[str, str] = {}
+
+
+class BaseService:
+    """
+        Общая часть сервисов: доступ к кешу и Elasticsearch, объединение
+        конкурентных промахов кеша и фоновое обновление устаревших записей.
+    """
+
+    # Время жизни записей кеша сервиса, переопределяется в наследниках
+    cache_expire: int = 60 * 5
+
+    def __init__(self, cache: MemoryCache, elastic: AsyncElasticsearch):
+        self.cache = cache
+        self.elastic = elastic
+        self.flight = SingleFlight()
+
+    async def cached_response(self,
+                              key: str,
+                              build: Callable[[], Awaitable[Any]],
+                              headers: Optional[Callable[[], Dict[str, str]]] = None) -> Response:
+        """
+            Вернуть ответ API из кеша готовых тел ответа. Такой ответ не
+            разбирается и не валидируется повторно: тело из кеша сразу
+            отдается клиенту. При промахе модель ответа строится функцией
+            build, сериализуется и сохраняется в кеш вместе с заголовками,
+            которые после build возвращает функция headers. Тела хранятся в
+            том же конверте, что и данные сервисов, поэтому промахи по одному
+            ключу объединяются, а устаревшее тело обновляется в фоне.
+            Это единственный уровень кеша для таких ответов: build должна
+            читать данные из Elasticsearch, а не из кеша сервиса, иначе
+            фоновое обновление сохранило бы устаревшие данные со свежим
+            сроком годности.
+        """
+        cache_key = response_key(key)
+
+        async def from_elastic() -> CachedResponse:
+            data = await build()
+            body = orjson.dumps(jsonable_encoder(data)).decode()
+            return CachedResponse(body=body, headers=headers() if headers else {})
+
+        async def to_cache(cached: CachedResponse, delta: float):
+            await self._put_entry_to_cache(cache_key, cached, self.cache_expire, delta)
+
+        cached = await self._get_or_load(
+            cache_key,
+            lambda: self._entry_from_cache(cache_key, self._load_response),
+            from_elastic,
+            to_cache
+        )
+        return Response(content=cached.body, media_type='application/json', headers=cached.headers)
+
+    @staticmethod
+    def json_response(data: Any, headers: Optional[Dict[str, str]] = None) -> Response:
+        """
+            Ответ API без кеширования тела
+        """
+        return Response(content=orjson.dumps(jsonable_encoder(data)), media_type='application/json', headers=headers)
+
+    @staticmethod
+    def _load_response(obj: Any) -> CachedResponse:
+        # Записи прежнего формата без конверта: байты тела или тело с заголовками
+        if isinstance(obj, bytes):
+            return CachedResponse(body=obj.decode(), headers={})
+        return CachedResponse.parse_obj(obj)
+
+    async def _get_or_load(self,
+                           key: str,
+                           from_cache: Callable[[], Awaitable[Optional[CacheEntry]]],
+                           from_elastic: Callable[[], Awaitable[Any]],
+                           to_cache: Callable[[Any, float], Awaitable[None]]) -> Any:
+        """
+            Получить данные из кеша, а при промахе - из Elasticsearch.
+            Устаревшая запись отдается сразу, а обновляется в фоне.
+        """
+        entry = await from_cache()
+        if entry is None:
+            return await self._load_once(key, from_elastic, to_cache)
+        if entry.should_refresh(CACHE_EARLY_REFRESH_BETA):
+            self._refresh_in_background(key, from_elastic, to_cache)
+        return entry.data
+
+    async def _load_once(self,
+                         key: str,
+                         from_elastic: Callable[[], Awaitable[Any]],
+                         to_cache: Callable[[Any, float], Awaitable[None]]) -> Any:
+        """
+            Загрузить данные из Elasticsearch и сохранить их в кеш. Все
+            конкурентные промахи по одному ключу ждут одну загрузку и одну
+            запись в кеш.
+        """
+        async def load():
+            started = time.monotonic()
+            data = await from_elastic()
+            if data:
+                await to_cache(data, time.monotonic() - started)
+            return data
+
+        return await self.flight.do(key, load)
+
+    async def _get_many_or_load(self,
+                                keys: List[str],
+                                loads_data: Callable[[Any], Any],
+                                from_elastic: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+                                to_cache: Callable[[Dict[str, Any], float], Awaitable[None]]) -> Dict[str, Any]:
+        """
+            Пакетный вариант _get_or_load: найденные в кеше записи читаются
+            одним запросом к кешу, недостающие - одним запросом к Elasticsearch
+            и одной пакетной записью в кеш. Возвращает словарь ключ -> данные,
+            ключей, которых нет в Elasticsearch, в словаре нет.
+        """
+        keys = list(dict.fromkeys(keys))
+        entries = await self.cache.get_many(keys, loads=lambda obj: CacheEntry.load(obj, loads_data))
+        result = {}
+        missing, stale = [], []
+        for key, entry in zip(keys, entries):
+            if entry is None:
+                missing.append(key)
+                continue
+            result[key] = entry.data
+            if entry.should_refresh(CACHE_EARLY_REFRESH_BETA):
+                stale.append(key)
+        if missing:
+            result.update(await self._load_many_once(missing, from_elastic, to_cache))
+        if stale:
+            task = asyncio.ensure_future(self._load_many_once(stale, from_elastic, to_cache))
+            task.add_done_callback(self._log_refresh_error)
+        return result
+
+    async def _load_many_once(self,
+                              keys: List[str],
+                              from_elastic: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+                              to_cache: Callable[[Dict[str, Any], float], Awaitable[None]]) -> Dict[str, Any]:
+        async def load():
+            started = time.monotonic()
+            data = await from_elastic(keys)
+            if data:
+                await to_cache(data, time.monotonic() - started)
+            return data
+
+        return await self.flight.do('mget:{}'.format(','.join(sorted(keys))), load)
+
+    async def _generation(self, tag: str) -> str:
+        """
+            Текущее поколение тега (индекса целиком или, например, списка
+            фильмов одного жанра). ETL увеличивает его после переиндексации
+            связанных документов, поэтому ключи списков, включающие
+            поколение, перестают совпадать со старыми записями кеша - сброс
+            всех страниц списка стоит одного INCR. Поколение тега внутри
+            индекса включает и поколение тега {index}:all, которое ETL
+            увеличивает, когда индекс заменяется новой версией целиком
+        """
+        index = tag.split(':', 1)[0]
+        tags = [tag] if tag == index else [tag, f'{index}:all']
+        generations = await self.cache.get_many([generation_key(item) for item in tags], loads=int)
+        return '.'.join(str(generation or 0) for generation in generations)
+
+    async def _entry_from_cache(self, key: str, loads_data: Callable[[Any], Any]) -> Optional[CacheEntry]:
+        return await self.cache.get(key, loads=lambda obj: CacheEntry.load(obj, loads_data))
+
+    async def _put_entry_to_cache(self, key: str, data: Any, expire: int, delta: float):
+        """
+            Сохранить данные в кеш в конверте с мягким сроком годности expire.
+            В Redis запись живет дольше на CACHE_STALE_SECONDS, чтобы ее можно
+            было отдавать, пока идет обновление
+        """
+        entry = CacheEntry.create(data, expire, delta)
+        await self.cache.set(key, entry.dump(self._to_primitive(data)), expire + CACHE_STALE_SECONDS, value=entry)
+
+    async def _put_entries_to_cache(self, items: Dict[str, Any], expire: int, delta: float):
+        """
+            Пакетный вариант _put_entry_to_cache: items - словарь ключ -> данные
+        """
+        entries = {key: CacheEntry.create(data, expire, delta) for key, data in items.items()}
+        await self.cache.set_many(
+            {key: entries[key].dump(self._to_primitive(data)) for key, data in items.items()},
+            expire + CACHE_STALE_SECONDS,
+            values=entries
+        )
+
+    @staticmethod
+    def _paginate(search_query: dict, page_size: int, page_number: int, cursor: Optional[str]) -> dict:
+        """
+            Добавить в запрос к Elasticsearch пагинацию. С курсором страница
+            выбирается через search_after и ее стоимость не зависит от глубины,
+            без курсора - по номеру страницы через from/size. Сортировка
+            запроса должна заканчиваться уникальным полем id.
+        """
+        if cursor:
+            search_query["search_after"] = decode_cursor(cursor)
+        else:
+            search_query["from"] = (page_number - 1) * page_size
+        search_query["size"] = page_size
+        return search_query
+
+    @staticmethod
+    def _next_cursor(hits: List[dict], page_size: int) -> Optional[str]:
+        """
+            Курсор следующей страницы или None, если страница последняя
+        """
+        if hits and len(hits) == page_size:
+            return encode_cursor(hits[-1]["sort"])
+        return None
+
+    async def _scan(self, index: str, source_includes: List[str]) -> AsyncIterator[dict]:
+        """
+            Обойти весь индекс страницами по EXPORT_PAGE_SIZE документов в
+            порядке id через search_after. В памяти одновременно находится
+            только одна страница, независимо от размера индекса.
+        """
+        search_query = {
+            "query": {"match_all": {}},
+            "sort": [{"id": {"order": "asc"}}],
+            "size": EXPORT_PAGE_SIZE
+        }
+        while True:
+            doc = await self.elastic.search(index=index, body=search_query, _source_includes=source_includes)
+            hits = doc.get("hits").get("hits")
+            for hit in hits:
+                yield hit.get("_source")
+            if len(hits) < EXPORT_PAGE_SIZE:
+                return
+            search_query["search_after"] = hits[-1]["sort"]
+
+    @staticmethod
+    def _to_primitive(data: Any) -> Any:
+        """
+            Привести модель или список моделей к простым типам для сериализатора
+        """
+        if isinstance(data, list):
+            return [item.dict() for item in data]
+        return data.dict()
+
+    def _refresh_in_background(self,
+                               key: str,
+                               from_elastic: Callable[[], Awaitable[Any]],
+                               to_cache: Callable[[Any, float], Awaitable[None]]):
+        task = asyncio.ensure_future(self._load_once(key, from_elastic, to_cache))
+        task.add_done_callback(self._log_refresh_error)
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Future):
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Ошибка фонового обновления кеша: {task.exception()}")
@@ -1,87 +1,101 @@
-import orjson
 from functools import lru_cache
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import UUID
 
+from core.config import PAGE_DEFAULT_SIZE
 from db.elastic import get_elastic
 from db.cache import MemoryCache, get_cache
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
-from models.film import Film, FilmBrief
+from models.film import Film, FilmBrief, FilmBriefPage, FilmSearchHit, FilmSearchPage
+from services.base import BaseService
 
 FILM_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
 
 
-class FilmService:
+class FilmService(BaseService):
     """
         FilmService содержит бизнес-логику по работе с фильмами.
     """
-
-    def __init__(self, cache: MemoryCache, elastic: AsyncElasticsearch):
-        self.cache = cache
-        self.elastic = elastic
+    cache_expire = FILM_CACHE_EXPIRE_IN_SECONDS
+    FILM_FIELDS = ["id", "title", "imdb_rating", "description", "genres", "actors", "writers"]
+    FILM_BRIEF_FIELDS = ["id", "title", "imdb_rating"]
+    # Поля полнотекстового поиска и их веса
+    SEARCH_FIELDS = ["title^3", "description", "actors_names^2", "writers_names"]
 
     async def get_by_id(self, film_id: str) -> Optional[Film]:
 
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        film = await self._film_from_cache(film_id)
-        if not film:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            film = await self._get_film_from_elastic(film_id)
-            if not film:
-                # Если он отсутствует в Elasticsearch, значит, фильма вообще нет в базе
-                return None
-            # Сохраняем фильм в кеш
-            await self._put_film_to_cache(film)
-
-        return film
+        # Данные читаются из Elasticsearch: в кеш попадает готовое тело
+        # ответа API (cached_response), второй копии фильма в кеше нет
+        return await self._get_film_from_elastic(film_id)
+
+    async def get_by_ids(self, film_ids: List[str]) -> List[Film]:
+        """
+            Получить несколько фильмов по списку UUID. Фильмы, которых нет
+            в базе, в результат не попадают
+        """
+        films = await self._get_many_or_load(
+            film_ids,
+            Film.parse_obj,
+            self._get_films_from_elastic,
+            self._put_many_films_to_cache
+        )
+        return [films[film_id] for film_id in dict.fromkeys(film_ids) if film_id in films]
 
     async def _get_film_from_elastic(self, film_id: str) -> Optional[Film]:
 
-        es_fields = ["id", "title", "imdb_rating", "description", "genres", "actors", "writers"]
-        doc = await self.elastic.get('movies', film_id, _source_includes=es_fields)
-        film_info = doc.get("_source")
+        doc = await self.elastic.get('movies', film_id, _source_includes=self.FILM_FIELDS)
+        return self._film_from_source(doc.get("_source"))
+
+    async def _get_films_from_elastic(self, film_ids: List[str]) -> Dict[str, Film]:
+        docs = await self.elastic.mget(body={"ids": film_ids}, index='movies', _source_includes=self.FILM_FIELDS)
+        return {doc["_id"]: self._film_from_source(doc["_source"]) for doc in docs["docs"] if doc.get("found")}
+
+    @staticmethod
+    def _film_from_source(film_info: dict) -> Film:
         film_info["uuid"] = film_info["id"]
         film_info.pop("id")
         return Film(**film_info)
 
-    async def _film_from_cache(self, film_id: str) -> Optional[Film]:
-        data = await self.cache.get(film_id)
-        if not data:
-            return None
-        return Film.parse_raw(data)
+    async def _put_many_films_to_cache(self, films: Dict[str, Film], delta: float = 0.0):
+        items = {str(film.uuid): film for film in films.values()}
+        await self._put_entries_to_cache(items, FILM_CACHE_EXPIRE_IN_SECONDS, delta)
 
-    async def _put_film_to_cache(self, film: Film):
-        await self.cache.set(str(film.uuid), film.json(), expire=FILM_CACHE_EXPIRE_IN_SECONDS)
+    async def export(self) -> AsyncIterator[FilmBrief]:
+        """
+            Все фильмы каталога по одному, в порядке id, без кеширования
+        """
+        async for film_info in self._scan('movies', self.FILM_BRIEF_FIELDS):
+            yield FilmBrief(**film_info)
 
     async def get_by_genre_id(self,
                               filter_genre: Optional[UUID],
                               sort: Optional[str],
                               page_size: Optional[int],
-                              page_number: Optional[int]
-                              ) -> List[FilmBrief]:
-        films = await self._get_films_from_cache(filter_genre, sort, page_size, page_number)
-        if not films:
-            films = await self._get_films_by_genre_from_elastic(filter_genre, sort, page_size, page_number)
-            if not films:
-                return []
-            await self._put_films_to_cache(films, filter_genre, sort, page_size, page_number)
-        return films
+                              page_number: Optional[int],
+                              cursor: Optional[str] = None
+                              ) -> FilmBriefPage:
+        """
+            Страница списка фильмов. Если передан курсор, страница выбирается
+            после курсора, а номер страницы не учитывается. Страница не
+            кешируется: в кеш попадает готовое тело ответа API
+        """
+        films = await self._get_films_by_genre_from_elastic(filter_genre, sort, page_size, page_number, cursor)
+        return films or FilmBriefPage(items=[])
 
     async def _get_films_by_genre_from_elastic(self,
                                                filter_genre: Optional[UUID],
                                                sort: Optional[str],
                                                page_size: Optional[int],
-                                               page_number: Optional[int]
-                                               ) -> List[FilmBrief]:
+                                               page_number: Optional[int],
+                                               cursor: Optional[str] = None
+                                               ) -> Optional[FilmBriefPage]:
 
         sort_order, sort_column = sort[0], sort[1:]
         sort_order = "desc" if sort_order == "-" else "asc"
         page_number = page_number if page_number is not None else 1
-        page_size = page_size if page_size is not None else 9999
+        page_size = page_size if page_size is not None else PAGE_DEFAULT_SIZE
         search_query = {
-            "from": (page_number - 1) * page_size,
-            "size": page_size,
             "query": {
                 "nested": {
                     "path": "genres",
@@ -99,41 +113,84 @@ class FilmService:
             "sort": [
                 {
                     sort_column: {"order": sort_order}
-                }
+                },
+                # Уникальное поле для однозначного порядка при search_after
+                {"id": {"order": "asc"}}
             ]
         }
-        es_fields = ["id", "title", "imdb_rating"]
-        doc = await self.elastic.search(index='movies', body=search_query, _source_includes=es_fields)
+        self._paginate(search_query, page_size, page_number, cursor)
+        doc = await self.elastic.search(index='movies', body=search_query, _source_includes=self.FILM_BRIEF_FIELDS)
         films_info = doc.get("hits").get("hits")
+        if not films_info:
+            return None
         film_list = [FilmBrief(**film.get("_source")) for film in films_info]
-        return film_list
-
-    async def _get_films_from_cache(self,
-                                    filter_genre: Optional[UUID],
-                                    sort: Optional[str],
-                                    page_size: Optional[int],
-                                    page_number: Optional[int]
-                                    ) -> List[FilmBrief]:
-        key = self._get_films_key(filter_genre, sort, page_size, page_number)
-        data = await self.cache.get(key)
-        if not data:
-            return []
-        films = [FilmBrief(**film) for film in orjson.loads(data)]
-        return films
-
-    async def _put_films_to_cache(self,
-                                  films: List[FilmBrief],
-                                  filter_genre: Optional[UUID],
-                                  sort: Optional[str],
-                                  page_size: Optional[int],
-                                  page_number: Optional[int]
-                                  ):
-        key = self._get_films_key(filter_genre, sort, page_size, page_number)
-        json = "[{}]".format(','.join(film.json() for film in films))
-        await self.cache.set(key, json, FILM_CACHE_EXPIRE_IN_SECONDS)
-
-    def _get_films_key(self, *args):
-        key = ("films", args)
+        return FilmBriefPage(items=film_list, next_cursor=self._next_cursor(films_info, page_size))
+
+    async def search(self,
+                     query: str,
+                     page_size: int,
+                     page_number: int,
+                     cursor: Optional[str] = None
+                     ) -> FilmSearchPage:
+        """
+            Полнотекстовый поиск фильмов по названию, описанию и именам
+            актеров и сценаристов. Результаты упорядочены по релевантности.
+            Страница не кешируется: в кеш попадает готовое тело ответа API
+        """
+        films = await self._search_in_elastic(query, page_size, page_number, cursor)
+        return films or FilmSearchPage(items=[])
+
+    async def _search_in_elastic(self,
+                                 query: str,
+                                 page_size: int,
+                                 page_number: int,
+                                 cursor: Optional[str] = None
+                                 ) -> Optional[FilmSearchPage]:
+        search_query = {
+            "query": {
+                "multi_match": {
+                    "query": query,
+                    "fields": self.SEARCH_FIELDS,
+                    "fuzziness": "AUTO"
+                }
+            },
+            "sort": [
+                {"_score": {"order": "desc"}},
+                {"id": {"order": "asc"}}
+            ],
+            # Фрагменты с совпадениями строит Elasticsearch, исходные
+            # документы целиком при этом не запрашиваются
+            "highlight": {
+                "fields": {field.split("^")[0]: {} for field in self.SEARCH_FIELDS}
+            }
+        }
+        self._paginate(search_query, page_size, page_number, cursor)
+        doc = await self.elastic.search(index='movies', body=search_query, _source_includes=self.FILM_BRIEF_FIELDS)
+        films_info = doc.get("hits").get("hits")
+        if not films_info:
+            return None
+        film_list = [FilmSearchHit(**film.get("_source"), highlight=film.get("highlight", {})) for film in films_info]
+        return FilmSearchPage(items=film_list, next_cursor=self._next_cursor(films_info, page_size))
+
+    async def get_search_key(self, query: str, *args) -> str:
+        """
+            Ключ кеша страницы результатов поиска
+        """
+        key = ("films:search", await self._generation('movies'), (query, *args))
+        return str(key)
+
+    async def get_list_key(self, *args) -> str:
+        """
+            Ключ кеша страницы списка с теми же параметрами, что и у get_by_genre_id
+        """
+        return await self._get_films_key(*args)
+
+    async def _get_films_key(self, filter_genre: Optional[UUID], *args):
+        # Поколение меняется при переиндексации, и старые страницы списка
+        # перестают находиться по новому ключу. Список фильмов жанра зависит
+        # только от фильмов этого жанра
+        tag = f'movies:genre:{filter_genre}' if filter_genre else 'movies'
+        key = ("films", await self._generation(tag), (filter_genre, *args))
         return str(key)
 
 
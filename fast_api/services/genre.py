@@ -1,91 +1,98 @@
-import orjson
 from functools import lru_cache
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import UUID
 
 from db.elastic import get_elastic
 from db.cache import MemoryCache, get_cache
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
-from models.genre import Genre, GenreBrief
+from models.genre import Genre, GenreBrief, GenreBriefPage
+from services.base import BaseService
 
 GENRE_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
 
 
-class GenreService:
+class GenreService(BaseService):
     """
         Сервис для получения жанра по идентификатору, или всех жанров фильма
     """
-
-    def __init__(self, cache: MemoryCache, elastic: AsyncElasticsearch):
-        self.cache = cache
-        self.elastic = elastic
+    cache_expire = GENRE_CACHE_EXPIRE_IN_SECONDS
+    GENRE_FIELDS = ["id", "name", "description", "films"]
+    GENRE_BRIEF_FIELDS = ["id", "name", "description"]
 
     async def get_by_id(self, genre_id: str) -> Optional[Genre]:
 
-        # Пытаемся получить данные из кеша, потому что оно работает быстрее
-        genre = await self._genre_from_cache(genre_id)
-        if not genre:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            genre = await self._get_genre_from_elastic(genre_id)
-            if not genre:
-                # Если он отсутствует в Elasticsearch, значит, жанра вообще нет в базе
-                return None
-            # Сохраняем фильм в кеш
-            await self._put_genre_to_cache(genre)
+        # Данные читаются из Elasticsearch: в кеш попадает готовое тело
+        # ответа API (cached_response), второй копии жанра в кеше нет
+        return await self._get_genre_from_elastic(genre_id)
 
-        return genre
+    async def get_by_ids(self, genre_ids: List[str]) -> List[Genre]:
+        """
+            Получить несколько жанров по списку UUID
+        """
+        genres = await self._get_many_or_load(
+            genre_ids,
+            Genre.parse_obj,
+            self._get_genres_from_elastic,
+            self._put_many_genres_to_cache
+        )
+        return [genres[genre_id] for genre_id in dict.fromkeys(genre_ids) if genre_id in genres]
 
     async def _get_genre_from_elastic(self, genre_id: str) -> Optional[Genre]:
 
-        es_fields = ["id", "name", "description", "films"]
-        doc = await self.elastic.get('genres', genre_id, _source_includes=es_fields)
-        genre_info = doc.get("_source")
+        doc = await self.elastic.get('genres', genre_id, _source_includes=self.GENRE_FIELDS)
+        return self._genre_from_source(doc.get("_source"))
+
+    async def _get_genres_from_elastic(self, genre_ids: List[str]) -> Dict[str, Genre]:
+        docs = await self.elastic.mget(body={"ids": genre_ids}, index='genres', _source_includes=self.GENRE_FIELDS)
+        return {doc["_id"]: self._genre_from_source(doc["_source"]) for doc in docs["docs"] if doc.get("found")}
+
+    @staticmethod
+    def _genre_from_source(genre_info: dict) -> Genre:
         # Спецификация API требует, чтобы поле идентификатора называлось UUID
         genre_info["uuid"] = genre_info["id"]
         genre_info.pop("id")
 
         return Genre(**genre_info)
 
-    async def _genre_from_cache(self, genre_id: str) -> Optional[Genre]:
-        data = await self.cache.get(genre_id)
-        if not data:
-            return None
-        return Genre.parse_raw(data)
+    async def _put_many_genres_to_cache(self, genres: Dict[str, Genre], delta: float = 0.0):
+        items = {str(genre.uuid): genre for genre in genres.values()}
+        await self._put_entries_to_cache(items, GENRE_CACHE_EXPIRE_IN_SECONDS, delta)
 
-    async def _put_genre_to_cache(self, genre: Genre):
-        await self.cache.set(str(genre.uuid), genre.json(), GENRE_CACHE_EXPIRE_IN_SECONDS)
+    async def export(self) -> AsyncIterator[GenreBrief]:
+        """
+            Все жанры по одному, в порядке id, без кеширования
+        """
+        async for genre_info in self._scan('genres', self.GENRE_BRIEF_FIELDS):
+            yield GenreBrief(**genre_info)
 
     async def get_by_film_id(self,
                              film_uuid: Optional[UUID],
                              sort: str,
                              page_size: int,
-                             page_number: int
-                             ) -> List[GenreBrief]:
+                             page_number: int,
+                             cursor: Optional[str] = None
+                             ) -> GenreBriefPage:
         """
             Получить список жанров, относящихся к определенному
             фильму (если фильм задан, иначе всех жанров).
+            Если передан курсор, страница выбирается после курсора.
+            Страница не кешируется: в кеш попадает готовое тело ответа API
         """
-        genres = await self._get_genres_from_cache(film_uuid, sort, page_size, page_number)
-        if not genres:
-            genres = await self._get_by_film_id_from_elastic(film_uuid, sort, page_size, page_number)
-            if not genres:
-                return []
-            await self._put_genres_to_cache(genres, film_uuid, sort, page_size, page_number)
-        return genres
+        genres = await self._get_by_film_id_from_elastic(film_uuid, sort, page_size, page_number, cursor)
+        return genres or GenreBriefPage(items=[])
 
     async def _get_by_film_id_from_elastic(self,
                                            film_uuid: Optional[UUID],
                                            sort: str,
                                            page_size: int,
-                                           page_number: int
-                                           ) -> List[GenreBrief]:
+                                           page_number: int,
+                                           cursor: Optional[str] = None
+                                           ) -> Optional[GenreBriefPage]:
         """
             Получить список жанров из ElasticSearch
         """
         search_query = {
-            "from": (page_number - 1) * page_size,
-            "size": page_size,
             "query": {
                 "nested": {
                     "path": "films",
@@ -99,47 +106,33 @@ class GenreService:
                 }
             } if film_uuid else {"match_all": {}},
             "sort": [
-                {sort or "name": {"order": "asc"}}
+                {sort or "name": {"order": "asc"}},
+                {"id": {"order": "asc"}}
             ]
         }
-        es_fields = ["id", "name", "description"]
+        self._paginate(search_query, page_size, page_number, cursor)
         doc = await self.elastic.search(
             index='genres',
             body=search_query,
-            _source_includes=es_fields
+            _source_includes=self.GENRE_BRIEF_FIELDS
         )
         genres_info = doc.get("hits").get("hits")
+        if not genres_info:
+            return None
         genre_list = [
             GenreBrief(**genre.get("_source")) for genre in genres_info
         ]
-        return genre_list
-
-    async def _get_genres_from_cache(self,
-                                     film_uuid: Optional[UUID],
-                                     sort: str,
-                                     page_size: int,
-                                     page_number: int
-                                     ) -> List[GenreBrief]:
-        key = self._get_genre_key(film_uuid, sort, page_size, page_number)
-        data = await self.cache.get(key)
-        if not data:
-            return []
-        genres = [GenreBrief(**genre) for genre in orjson.loads(data)]
-        return genres
-
-    async def _put_genres_to_cache(self,
-                                   genres: List[GenreBrief],
-                                   film_uuid: Optional[UUID],
-                                   sort: str,
-                                   page_size: int,
-                                   page_number: int
-                                   ):
-        key = self._get_genre_key(film_uuid, sort, page_size, page_number)
-        json = "[{}]".format(','.join(genre.json() for genre in genres))
-        await self.cache.set(key, json, GENRE_CACHE_EXPIRE_IN_SECONDS)
-
-    def _get_genre_key(self, *args):
-        key = ("genres", args)
+        return GenreBriefPage(items=genre_list, next_cursor=self._next_cursor(genres_info, page_size))
+
+    async def get_list_key(self, *args) -> str:
+        """
+            Ключ кеша страницы списка с теми же параметрами, что и у get_by_film_id
+        """
+        return await self._get_genre_key(*args)
+
+    async def _get_genre_key(self, film_uuid: Optional[UUID], *args):
+        tag = f'genres:film:{film_uuid}' if film_uuid else 'genres'
+        key = ("genres", await self._generation(tag), (film_uuid, *args))
         return str(key)
 
 
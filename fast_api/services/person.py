@@ -1,162 +1,216 @@
-import orjson
 from functools import lru_cache
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional
 from uuid import UUID
 
+from core.config import PAGE_DEFAULT_SIZE
 from db.elastic import get_elastic
 from db.cache import MemoryCache, get_cache
 from elasticsearch import AsyncElasticsearch
 from fastapi import Depends
-from models.person import Person, PersonBrief
+from models.person import Person, PersonBrief, PersonBriefPage, PersonIdsPage
+from services.base import BaseService
+from utils.query import normalize_query, query_hash
 
 PERSON_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
 
 
-class PersonService:
+class PersonService(BaseService):
     """
         Сервис для получения информации о человеке по идентификатору
     """
-
-    def __init__(self, cache: MemoryCache, elastic: AsyncElasticsearch):
-        self.cache = cache
-        self.elastic = elastic
+    cache_expire = PERSON_CACHE_EXPIRE_IN_SECONDS
+    PERSON_FIELDS = ["id", "full_name", "birth_date", "films"]
+    PERSON_BRIEF_FIELDS = ["id", "full_name", "birth_date"]
 
     async def get_by_id(self, person_id: str) -> Optional[Person]:
         """
-            Возвращает информацию о человеке по его строке UUID
+            Возвращает информацию о человеке по его строке UUID. Данные
+            читаются из Elasticsearch: в кеш попадает готовое тело ответа API
         """
-        person = await self._person_from_cache(person_id)
-        if not person:
-            # Если фильма нет в кеше, то ищем его в Elasticsearch
-            person = await self._get_person_from_elastic(person_id)
-            if not person:
-                # Если он отсутствует в Elasticsearch, значит, жанра вообще нет в базе
-                return None
-            # Сохраняем фильм  в кеш
-            await self._put_person_to_cache(person)
+        return await self._get_person_from_elastic(person_id)
 
-        return person
+    async def get_by_ids(self, person_ids: List[str]) -> List[Person]:
+        """
+            Возвращает информацию о нескольких людях по списку строк UUID
+        """
+        persons = await self._get_many_or_load(
+            person_ids,
+            Person.parse_obj,
+            self._get_persons_from_elastic,
+            self._put_many_persons_to_cache
+        )
+        return [persons[person_id] for person_id in dict.fromkeys(person_ids) if person_id in persons]
 
     async def _get_person_from_elastic(self, person_id: str) -> Optional[Person]:
         """
             Извлечь информацию о человеке из ElasticSearch по его строке
             идентификатору
         """
-        es_fields = ["id", "full_name", "birth_date", "films"]
-        doc = await self.elastic.get('persons', person_id, _source_includes=es_fields)
-        person_info = doc.get("_source")
+        doc = await self.elastic.get('persons', person_id, _source_includes=self.PERSON_FIELDS)
+        return self._person_from_source(doc.get("_source"))
+
+    async def _get_persons_from_elastic(self, person_ids: List[str]) -> Dict[str, Person]:
+        """
+            Извлечь информацию о нескольких людях одним запросом mget
+        """
+        docs = await self.elastic.mget(body={"ids": person_ids}, index='persons', _source_includes=self.PERSON_FIELDS)
+        return {doc["_id"]: self._person_from_source(doc["_source"]) for doc in docs["docs"] if doc.get("found")}
+
+    @staticmethod
+    def _person_from_source(person_info: dict) -> Person:
         # Спецификация API требует, чтобы поле идентификатора называлось UUID
         person_info["uuid"] = person_info["id"]
         person_info.pop("id")
+        # В документе индекса дата рождения хранится в поле birth_date
+        person_info["birthdate"] = person_info.pop("birth_date", None)
 
         return Person(**person_info)
 
-    async def _person_from_cache(self, person_id: str) -> Optional[Person]:
+    async def _put_many_persons_to_cache(self, persons: Dict[str, Person], delta: float = 0.0):
         """
-            Чтение данных о человеке из кэша
+            Пакетная запись данных о людях в кэш
         """
-        data = await self.cache.get(person_id)
-        if not data:
-            return None
+        items = {str(person.uuid): person for person in persons.values()}
+        await self._put_entries_to_cache(items, PERSON_CACHE_EXPIRE_IN_SECONDS, delta)
 
-        return Person.parse_raw(data)
-
-    async def _put_person_to_cache(self, person: Person):
+    async def export(self) -> AsyncIterator[PersonBrief]:
         """
-            Запись данных о человеке в кэш
+            Все люди по одному, в порядке id, без кеширования
         """
-        await self.cache.set(str(person.uuid), person.json(), PERSON_CACHE_EXPIRE_IN_SECONDS)
+        async for person_info in self._scan('persons', self.PERSON_BRIEF_FIELDS):
+            yield PersonBrief(**person_info)
 
     async def get_by_film_id(self,
                              film_uuid: Optional[UUID],
                              filter_name: Optional[str],
                              sort: Optional[str],
                              page_size: Optional[int],
-                             page_number: Optional[int]) -> List[PersonBrief]:
+                             page_number: Optional[int],
+                             cursor: Optional[str] = None) -> PersonBriefPage:
         """
             Получить список людей, участвовавших в работе над определенным
-            фильмом.
+            фильмом. Если передан курсор, страница выбирается после курсора.
+            Если задано имя, выполняется поиск по имени среди всех людей.
         """
-        persons = await self._get_by_film_id_from_cache(film_uuid, filter_name, sort, page_size, page_number)
-        if not persons:
-            persons = await self._get_by_film_id_from_elastic(film_uuid, filter_name, sort, page_size, page_number)
-            if not persons:
-                return []
-            await self._put_films_to_cache(persons, film_uuid, filter_name, sort, page_size, page_number)
-        return persons
+        if filter_name:
+            return await self._search_by_name(filter_name, sort, page_size, page_number, cursor)
+        # Страница не кешируется: в кеш попадает готовое тело ответа API
+        persons = await self._get_by_film_id_from_elastic(film_uuid, sort, page_size, page_number, cursor)
+        return persons or PersonBriefPage(items=[])
 
     async def _get_by_film_id_from_elastic(self,
                                            film_uuid: Optional[UUID],
-                                           filter_name: Optional[str],
                                            sort: Optional[str],
                                            page_size: Optional[int],
-                                           page_number: Optional[int]) -> List[PersonBrief]:
+                                           page_number: Optional[int],
+                                           cursor: Optional[str] = None) -> Optional[PersonBriefPage]:
         """
             Получить список людей из ElasticSearch
         """
         page_number = page_number if page_number is not None else 1
-        page_size = page_size if page_size is not None else 9999
+        page_size = page_size if page_size is not None else PAGE_DEFAULT_SIZE
         search_query = {
-            "from": (page_number - 1) * page_size,
-            "size": page_size,
             "query": {"match_all": {}},
             "sort": [
-                {sort or "full_name.raw": {"order": "asc"}}
+                {sort or "full_name.raw": {"order": "asc"}},
+                {"id": {"order": "asc"}}
             ]
         }
+        self._paginate(search_query, page_size, page_number, cursor)
         if film_uuid:
             search_query['query'] = {
                 "match": {
                     "films.id": str(film_uuid)
                 }
             }
-        if filter_name:
-            search_query['query'] = {
-                "match": {
-                    "full_name": filter_name
-                }
-            }
-        es_fields = ["id", "full_name", "birth_date"]
         doc = await self.elastic.search(
             index='persons',
             body=search_query,
-            _source_includes=es_fields
+            _source_includes=self.PERSON_BRIEF_FIELDS
         )
         persons_info = doc.get("hits").get("hits")
+        if not persons_info:
+            return None
         person_list = [
             PersonBrief(**person.get("_source")) for person in persons_info
         ]
-        return person_list
-
-    async def _get_by_film_id_from_cache(self,
-                                         film_uuid: Optional[UUID],
-                                         filter_name: Optional[str],
-                                         sort: Optional[str],
-                                         page_size: Optional[int],
-                                         page_number: Optional[int]) -> List[PersonBrief]:
-
-        key = self._get_persons_key(film_uuid, filter_name, sort, page_size, page_number)
-        data = await self.cache.get(key)
-        if not data:
-            return []
-        films = [PersonBrief(**film) for film in orjson.loads(data)]
-        return films
-
-    async def _put_films_to_cache(self,
-                                  persons: List[PersonBrief],
-                                  film_uuid: Optional[UUID],
-                                  filter_name: Optional[str],
-                                  sort: Optional[str],
-                                  page_size: Optional[int],
-                                  page_number: Optional[int]
-                                  ):
-        key = self._get_persons_key(film_uuid, filter_name, sort, page_size, page_number)
-        json = "[{}]".format(','.join(film.json() for film in persons))
-        await self.cache.set(key, json, PERSON_CACHE_EXPIRE_IN_SECONDS)
-
-    def _get_persons_key(self,
-                         *args):
-        key = ("persons", args)
+        return PersonBriefPage(items=person_list, next_cursor=self._next_cursor(persons_info, page_size))
+
+    async def _search_by_name(self,
+                              filter_name: str,
+                              sort: Optional[str],
+                              page_size: Optional[int],
+                              page_number: Optional[int],
+                              cursor: Optional[str] = None) -> PersonBriefPage:
+        """
+            Поиск людей по имени. Запрос нормализуется, и в кеше результатов
+            хранятся только идентификаторы найденных людей в порядке выдачи.
+            Сами записи берутся из кеша информации о людях, поэтому
+            популярные запросы почти не занимают памяти в Redis.
+        """
+        query = normalize_query(filter_name)
+        if not query:
+            return PersonBriefPage(items=[])
+        key = await self._get_search_key(query, sort, page_size, page_number, cursor)
+        ids_page = await self._get_or_load(
+            key,
+            lambda: self._entry_from_cache(key, PersonIdsPage.parse_obj),
+            lambda: self._search_ids_in_elastic(query, sort, page_size, page_number, cursor),
+            lambda data, delta: self._put_entry_to_cache(key, data, PERSON_CACHE_EXPIRE_IN_SECONDS, delta)
+        )
+        if not ids_page:
+            return PersonBriefPage(items=[])
+        persons = await self.get_by_ids(ids_page.ids)
+        return PersonBriefPage(
+            items=[
+                PersonBrief(id=person.uuid, full_name=person.full_name, birth_date=person.birthdate)
+                for person in persons
+            ],
+            next_cursor=ids_page.next_cursor
+        )
+
+    async def _search_ids_in_elastic(self,
+                                     query: str,
+                                     sort: Optional[str],
+                                     page_size: Optional[int],
+                                     page_number: Optional[int],
+                                     cursor: Optional[str] = None) -> Optional[PersonIdsPage]:
+        """
+            Найти идентификаторы людей по имени, без исходных документов
+        """
+        page_number = page_number if page_number is not None else 1
+        page_size = page_size if page_size is not None else PAGE_DEFAULT_SIZE
+        search_query = {
+            "query": {"match": {"full_name": query}},
+            "sort": [
+                {sort or "full_name.raw": {"order": "asc"}},
+                {"id": {"order": "asc"}}
+            ],
+            "_source": False
+        }
+        self._paginate(search_query, page_size, page_number, cursor)
+        doc = await self.elastic.search(index='persons', body=search_query)
+        persons_info = doc.get("hits").get("hits")
+        if not persons_info:
+            return None
+        return PersonIdsPage(
+            ids=[person["_id"] for person in persons_info],
+            next_cursor=self._next_cursor(persons_info, page_size)
+        )
+
+    async def _get_search_key(self, query: str, *args) -> str:
+        # Поиск по имени затрагивает весь индекс, поэтому зависит от его поколения
+        key = ("persons:search", await self._generation('persons'), (query_hash(query), *args))
+        return str(key)
+
+    async def get_list_key(self, film_uuid: Optional[UUID], *args) -> str:
+        """
+            Ключ кеша страницы списка людей фильма с теми же параметрами, что
+            и у get_by_film_id, кроме имени: результаты поиска по имени
+            кешируются только как id (_search_by_name)
+        """
+        tag = f'persons:film:{film_uuid}' if film_uuid else 'persons'
+        key = ("persons", await self._generation(tag), (film_uuid, *args))
         return str(key)
 
 
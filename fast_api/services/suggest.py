@@ -0,0 +1,87 @@
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from core.config import SUGGEST_TIMEOUT_SECONDS
+from db.elastic import get_elastic
+from db.cache import MemoryCache, get_cache
+from elasticsearch import AsyncElasticsearch, ConnectionTimeout
+from fastapi import Depends
+from models.suggest import Suggestion, Suggestions
+from services.base import BaseService
+from utils.query import normalize_prefix
+
+SUGGEST_CACHE_EXPIRE_IN_SECONDS = 60 * 5  # 5 минут
+
+
+class SuggestService(BaseService):
+    """
+        Подсказки при наборе названий фильмов и имен людей. Использует
+        completion-поля индексов, которые заполняет ETL: такой запрос
+        обслуживается структурой в памяти Elasticsearch и не требует
+        полнотекстового поиска на каждое нажатие клавиши.
+    """
+    cache_expire = SUGGEST_CACHE_EXPIRE_IN_SECONDS
+    # Для каждого индекса: имя подсказок в ответе, completion-поле и поле с текстом
+    SUGGESTERS = [
+        ("movies", "films", "title_suggest", "title"),
+        ("persons", "persons", "full_name_suggest", "full_name"),
+    ]
+
+    async def suggest(self, prefix: str, size: int) -> Optional[Suggestions]:
+        """
+            Подсказки по началу строки. Возвращает None, если Elasticsearch
+            не успел ответить за SUGGEST_TIMEOUT_SECONDS. Подсказки не
+            кешируются здесь: в кеш попадает готовое тело ответа API
+        """
+        return await self._suggest_from_elastic(normalize_prefix(prefix), size)
+
+    async def _suggest_from_elastic(self, prefix: str, size: int) -> Optional[Suggestions]:
+        # Подсказки по фильмам и людям запрашиваются одним msearch
+        body = []
+        for index, name, field, text_field in self.SUGGESTERS:
+            body.append({"index": index})
+            body.append({
+                "_source": ["id", text_field],
+                "suggest": {
+                    name: {
+                        "prefix": prefix,
+                        "completion": {"field": field, "size": size, "skip_duplicates": True}
+                    }
+                }
+            })
+        try:
+            doc = await self.elastic.msearch(body=body, request_timeout=SUGGEST_TIMEOUT_SECONDS)
+        except ConnectionTimeout:
+            return None
+        result = {}
+        for (index, name, field, text_field), response in zip(self.SUGGESTERS, doc["responses"]):
+            # Ошибка одного индекса (например, он еще не создан) не мешает подсказкам по другому
+            options = response.get("suggest", {}).get(name, [{}])[0].get("options", [])
+            result[name] = self._unique(
+                Suggestion(id=option["_id"], text=option["_source"][text_field]) for option in options
+            )
+        return Suggestions(**result)
+
+    @staticmethod
+    def _unique(suggestions: Iterable[Suggestion]) -> List[Suggestion]:
+        # Документ может попасть в подсказки несколько раз по разным окончаниям названия
+        unique = {}
+        for suggestion in suggestions:
+            unique.setdefault(suggestion.id, suggestion)
+        return list(unique.values())
+
+    async def get_suggest_key(self, prefix: str, size: int) -> str:
+        """
+            Ключ кеша подсказок. Зависит от поколений обоих индексов
+        """
+        prefix = normalize_prefix(prefix)
+        key = ("suggest", await self._generation('movies'), await self._generation('persons'), (prefix, size))
+        return str(key)
+
+
+@lru_cache()
+def get_suggest_service(
+        cache: MemoryCache = Depends(get_cache),
+        elastic: AsyncElasticsearch = Depends(get_elastic),
+) -> SuggestService:
+    return SuggestService(cache, elastic)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули FastAPI импортируются так же, как при запуске из каталога fast_api
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
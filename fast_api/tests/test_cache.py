@@ -0,0 +1,189 @@
+"""
+Тесты сериализатора и уровней кеша: локального LRU и двухуровневого кеша
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+import pytest
+
+from db import cache as cache_module
+from db.cache import LRUCache, MemoryCache, OrjsonSerializer, TwoTierCache
+
+
+class DictCache(MemoryCache):
+    """Удаленный уровень в памяти: хранит сериализованные байты, как Redis"""
+
+    def __init__(self):
+        self.serializer = OrjsonSerializer()
+        self.data: Dict[str, bytes] = {}
+        self.reads = 0
+
+    async def set(self, key, data, expire, value=None):
+        self.data[key] = self.serializer.dumps(data)
+
+    async def get(self, key, loads: Optional[Callable] = None):
+        self.reads += 1
+        raw = self.data.get(key)
+        if raw is None:
+            return None
+        obj = self.serializer.loads(raw)
+        return loads(obj) if loads else obj
+
+    async def set_many(self, items: Dict[str, Any], expire, values: Optional[Dict[str, Any]] = None):
+        for key, data in items.items():
+            await self.set(key, data, expire)
+
+    async def get_many(self, keys: List[str], loads: Optional[Callable] = None) -> List[Optional[Any]]:
+        return [await self.get(key, loads) for key in keys]
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    """Управляемые часы для сроков жизни локального кеша"""
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.mark.parametrize("compress_min_size", [0, 1, 10 ** 6])
+@pytest.mark.parametrize("obj", [
+    {"id": "bb74a838-584e-11ec-9885-c13c488d29c0", "title": "Some film", "imdb_rating": 5.5},
+    [{"id": 1}, {"id": 2}],
+    b'{"already": "serialized"}',
+])
+def test_serializer_round_trip(obj, compress_min_size):
+    serializer = OrjsonSerializer(compress_min_size)
+    assert serializer.loads(serializer.dumps(obj)) == obj
+
+
+def test_serializer_compresses_large_values():
+    serializer = OrjsonSerializer(compress_min_size=100)
+    obj = {"description": "word " * 1000}
+    raw = serializer.dumps(obj)
+    assert raw[:1] == OrjsonSerializer.ORJSON_ZLIB
+    assert len(raw) < len(orjson.dumps(obj))
+    assert serializer.dumps({"id": 1})[:1] == OrjsonSerializer.ORJSON
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (b'{"id": "1", "title": "Old film"}', {"id": "1", "title": "Old film"}),
+    (b'[1, 2]', [1, 2]),
+    # Счетчики поколений, увеличенные INCR
+    (b'42', 42),
+])
+def test_serializer_reads_unmarked_legacy_values(raw, expected):
+    """Записи прежних версий без маркера формата читаются как обычный JSON"""
+    assert OrjsonSerializer().loads(raw) == expected
+
+
+def test_lru_evicts_least_recently_used():
+    async def main():
+        lru = LRUCache(max_size=2, ttl=60)
+        await lru.set('a', 1, 60)
+        await lru.set('b', 2, 60)
+        # Чтение делает ключ a недавно использованным, поэтому вытесняется b
+        assert await lru.get('a') == 1
+        await lru.set('c', 3, 60)
+        return await lru.get_many(['a', 'b', 'c']), len(lru)
+
+    assert asyncio.run(main()) == ([1, None, 3], 2)
+
+
+def test_lru_expires_by_ttl(clock):
+    async def main():
+        lru = LRUCache(max_size=10, ttl=30)
+        await lru.set('short', 1, 5)
+        await lru.set('long', 2, 600)
+        clock[0] += 10
+        # Срок жизни записи ограничен ttl локального кеша
+        short_after_10, long_after_10 = await lru.get('short'), await lru.get('long')
+        clock[0] += 25
+        return short_after_10, long_after_10, await lru.get('long'), len(lru)
+
+    assert asyncio.run(main()) == (None, 2, None, 0)
+
+
+def test_lru_keeps_parsed_value():
+    """Локальный уровень хранит разобранный объект, если он передан"""
+    async def main():
+        lru = LRUCache(max_size=10, ttl=30)
+        parsed = object()
+        await lru.set('key', {"raw": True}, 30, value=parsed)
+        return await lru.get('key') is parsed
+
+    assert asyncio.run(main())
+
+
+def test_lru_disabled_with_zero_size():
+    async def main():
+        lru = LRUCache(max_size=0, ttl=30)
+        await lru.set('key', 1, 30)
+        return await lru.get('key')
+
+    assert asyncio.run(main()) is None
+
+
+def test_two_tier_reads_through_to_remote(clock):
+    """Промах локального уровня читается из удаленного и сохраняется локально"""
+    async def main():
+        remote = DictCache()
+        two_tier = TwoTierCache(LRUCache(max_size=10, ttl=30), remote)
+        await remote.set('key', {"id": 1}, 60)
+
+        first = await two_tier.get('key', loads=lambda obj: obj['id'])
+        second = await two_tier.get('key', loads=lambda obj: obj['id'])
+        missing = await two_tier.get('missing')
+        return first, second, missing, remote.reads, two_tier.stats()
+
+    first, second, missing, remote_reads, stats = asyncio.run(main())
+    assert (first, second, missing) == (1, 1, None)
+    # Второе чтение key обслужено локальным уровнем
+    assert remote_reads == 2
+    assert stats['hits'] == {'local': 1, 'redis': 1}
+    assert stats['misses'] == {'local': 2, 'redis': 1}
+    assert stats['hit_ratio'] == {'local': 0.333, 'redis': 0.5}
+    assert stats['local_size'] == 1
+
+
+def test_two_tier_get_many_reads_only_missing(clock):
+    async def main():
+        remote = DictCache()
+        two_tier = TwoTierCache(LRUCache(max_size=10, ttl=30), remote)
+        await two_tier.set('a', 1, 60)
+        await remote.set('b', 2, 60)
+        values = await two_tier.get_many(['a', 'b', 'c'])
+        return values, remote.reads
+
+    assert asyncio.run(main()) == ([1, 2, None], 2)
+
+
+def test_two_tier_write_and_delete_both_tiers(clock):
+    async def main():
+        remote = DictCache()
+        two_tier = TwoTierCache(LRUCache(max_size=10, ttl=30), remote)
+        await two_tier.set_many({'a': 1, 'b': 2}, 60)
+        stored = set(remote.data), len(two_tier.local)
+        await two_tier.delete('a')
+        return stored, set(remote.data), await two_tier.local.get('a')
+
+    assert asyncio.run(main()) == (({'a', 'b'}, 2), {'b'}, None)
+
+
+def test_two_tier_local_copy_expires_before_remote(clock):
+    """После ttl локальной копии значение снова читается из удаленного уровня"""
+    async def main():
+        remote = DictCache()
+        two_tier = TwoTierCache(LRUCache(max_size=10, ttl=30), remote)
+        await two_tier.set('key', 1, 600)
+        await remote.set('key', 2, 600)
+        before = await two_tier.get('key')
+        clock[0] += 31
+        return before, await two_tier.get('key')
+
+    assert asyncio.run(main()) == (1, 2)
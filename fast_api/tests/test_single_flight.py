@@ -0,0 +1,98 @@
+"""
+Тесты объединения конкурентных вызовов с одинаковым ключом
+"""
+
+import asyncio
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_load():
+    """Конкурентные вызовы с одним ключом ждут одну загрузку"""
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do('key', load) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['value'] * 5
+    assert len(calls) == 1
+
+
+def test_different_keys_load_separately():
+    calls = []
+
+    async def main():
+        flight = SingleFlight()
+
+        def load(key):
+            async def inner():
+                calls.append(key)
+                return key
+            return inner
+
+        return await asyncio.gather(flight.do('a', load('a')), flight.do('b', load('b')))
+
+    assert asyncio.run(main()) == ['a', 'b']
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_next_call_after_completion_loads_again():
+    """Результат не запоминается: после завершения загрузки ключ загружается заново"""
+    calls = []
+
+    async def load():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        flight = SingleFlight()
+        return [await flight.do('key', load), await flight.do('key', load)]
+
+    assert asyncio.run(main()) == [1, 2]
+
+
+def test_exception_shared_by_all_waiters():
+    """Ошибку загрузки получают все ожидающие, а следующий вызов пробует снова"""
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("load failed")
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do('key', failing) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flight.do('key', failing)
+        return results
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert len({id(result) for result in results}) == 1
+    assert len(calls) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_load():
+    """Отмена одного ожидающего не прерывает загрузку для остальных"""
+    async def load():
+        await asyncio.sleep(0.02)
+        return 'value'
+
+    async def main():
+        flight = SingleFlight()
+        first = asyncio.ensure_future(flight.do('key', load))
+        second = asyncio.ensure_future(flight.do('key', load))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == 'value'
@@ -0,0 +1,46 @@
+import base64
+from http import HTTPStatus
+from typing import Any, Dict, List, Optional
+
+import orjson
+from core.config import ErrorMessage
+from fastapi import HTTPException, Query
+
+
+def encode_cursor(sort_values: List[Any]) -> str:
+    """
+        Упаковать значения сортировки последнего документа страницы
+        в непрозрачный для клиента курсор
+    """
+    return base64.urlsafe_b64encode(orjson.dumps(sort_values)).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """
+        Распаковать курсор в значения для search_after.
+        При некорректном курсоре выбрасывается ValueError
+    """
+    sort_values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(sort_values, list):
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return sort_values
+
+
+def page_cursor(cursor: Optional[str] = Query(None, alias="page[cursor]")) -> Optional[str]:
+    """
+        Параметр запроса page[cursor]. Курсор разбирается до обращения к
+        сервису, и только ошибка его разбора превращается в ответ 400
+    """
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail=ErrorMessage.BAD_CURSOR)
+    return cursor
+
+
+def next_cursor_header(next_cursor: Optional[str]) -> Dict[str, str]:
+    """
+        Заголовок ответа с курсором следующей страницы
+    """
+    return {'X-Next-Cursor': next_cursor} if next_cursor else {}
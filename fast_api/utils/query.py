@@ -0,0 +1,38 @@
+import hashlib
+import re
+
+# Приблизительно как стандартный токенизатор Elasticsearch: слова из букв и цифр
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize_query(text: str) -> str:
+    """
+        Привести текст поискового запроса к каноническому виду: регистр
+        выравнивается (casefold), пунктуация и лишние пробелы отбрасываются,
+        а слова сортируются. Запрос match с оператором OR находит одни и те
+        же документы при любом порядке и регистре слов, поэтому "Tom Hanks",
+        "tom hanks" и "Hanks,  Tom " дают одинаковую строку
+    """
+    # Повторы слов отбрасываются: запрос match с OR находит документ, если
+    # совпало хотя бы одно слово, и повтор меняет только релевантность.
+    # Поиск людей сортирует выдачу по имени и id, а не по релевантности,
+    # поэтому ни набор, ни порядок результатов от этого не меняются
+    return ' '.join(sorted(set(WORD_RE.findall(text.casefold()))))
+
+
+def normalize_prefix(text: str) -> str:
+    """
+        Привести начало строки для подсказок к каноническому виду: регистр
+        выравнивается, пунктуация и лишние пробелы убираются (анализатор
+        completion-полей их тоже отбрасывает). Порядок слов сохраняется,
+        так как подсказки ищутся по началу названия. Строка без букв и
+        цифр дает пустую строку
+    """
+    return ' '.join(WORD_RE.findall(text.casefold()))
+
+
+def query_hash(normalized: str) -> str:
+    """
+        Короткий ключ нормализованного запроса для ключей кеша
+    """
+    return hashlib.sha1(normalized.encode()).hexdigest()
@@ -0,0 +1,22 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+        Объединяет конкурентные вызовы с одинаковым ключом: пока первый
+        вызов выполняется, остальные ждут его результат, а не запускают
+        собственный.
+    """
+
+    def __init__(self):
+        self.__calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.__calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.__calls[key] = task
+            task.add_done_callback(lambda _: self.__calls.pop(key, None))
+        # Отмена одного из ожидающих запросов не должна прерывать общую загрузку
+        return await asyncio.shield(task)
@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Триггеры отправляют id измененных строк в канал content_changes, на
+# который подписывается ETL в режиме listen (postgres_to_es)
+CHANNEL = 'content_changes'
+TABLES = ('film_work', 'person', 'genre', 'person_film_work', 'genre_film_work')
+
+CREATE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION content.notify_content_change() RETURNS trigger AS $$
+DECLARE
+    changed jsonb := to_jsonb(COALESCE(NEW, OLD));
+BEGIN
+    PERFORM pg_notify('{CHANNEL}', jsonb_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'id', changed->>'id',
+        'film_work_id', changed->>'film_work_id',
+        'person_id', changed->>'person_id',
+        'genre_id', changed->>'genre_id'
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+CREATE_TRIGGER = """
+CREATE TRIGGER {table}_notify_change
+AFTER INSERT OR UPDATE OR DELETE ON content.{table}
+FOR EACH ROW EXECUTE PROCEDURE content.notify_content_change();
+"""
+
+DROP_TRIGGER = "DROP TRIGGER IF EXISTS {table}_notify_change ON content.{table};"
+DROP_FUNCTION = "DROP FUNCTION IF EXISTS content.notify_content_change();"
+
+
+def create_triggers(apps, schema_editor):
+    # Уведомления есть только в PostgreSQL; на SQLite миграция ничего не делает
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(CREATE_FUNCTION)
+    for table in TABLES:
+        schema_editor.execute(DROP_TRIGGER.format(table=table))
+        schema_editor.execute(CREATE_TRIGGER.format(table=table))
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table in TABLES:
+        schema_editor.execute(DROP_TRIGGER.format(table=table))
+    schema_editor.execute(DROP_FUNCTION)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
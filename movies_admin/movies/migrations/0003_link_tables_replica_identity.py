@@ -0,0 +1,26 @@
+from django.db import migrations
+
+# При удалении строки связи журнал по умолчанию содержит только ее
+# первичный ключ. ETL в режиме cdc (postgres_to_es) нужны film_work_id,
+# person_id и genre_id удаленной связи, поэтому журнал хранит строку целиком
+TABLES = ('person_film_work', 'genre_film_work')
+
+
+def set_replica_identity(identity):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for table in TABLES:
+            schema_editor.execute(f"ALTER TABLE content.{table} REPLICA IDENTITY {identity};")
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_content_change_notify'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_replica_identity('FULL'), set_replica_identity('DEFAULT')),
+    ]
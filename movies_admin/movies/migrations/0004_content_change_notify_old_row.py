@@ -0,0 +1,54 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# При изменении строки триггер отправлял только ее новые значения. Если у
+# связи поменялся film_work_id, person_id или genre_id, прежний документ
+# не обновлялся. Теперь при UPDATE отправляются и прежние, и новые id - так
+# же, как ETL в режиме cdc получает строку из columns и identity
+previous = import_module('movies.migrations.0002_content_change_notify')
+
+CREATE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION content.notify_content_change() RETURNS trigger AS $$
+DECLARE
+    changed jsonb;
+BEGIN
+    FOREACH changed IN ARRAY (CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY[to_jsonb(NEW)]
+        WHEN 'DELETE' THEN ARRAY[to_jsonb(OLD)]
+        ELSE ARRAY[to_jsonb(NEW), to_jsonb(OLD)]
+    END) LOOP
+        -- Одинаковые уведомления одной транзакции PostgreSQL отправляет
+        -- один раз, поэтому UPDATE без смены id дает одно уведомление
+        PERFORM pg_notify('{previous.CHANNEL}', jsonb_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', changed->>'id',
+            'film_work_id', changed->>'film_work_id',
+            'person_id', changed->>'person_id',
+            'genre_id', changed->>'genre_id'
+        )::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def replace_function(sql):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_link_tables_replica_identity'),
+    ]
+
+    operations = [
+        migrations.RunPython(replace_function(CREATE_FUNCTION), replace_function(previous.CREATE_FUNCTION)),
+    ]
@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+from uuid import UUID
+
+import asyncpg
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.helpers import async_streaming_bulk
+
+from db.cache_notifier import CacheNotifier
+from db.es_saver import ESSaver
+from pg_to_es import PGtoES
+from resources import async_backoff
+from state import State, JsonFileStorage
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPGtoES(ESSaver, CacheNotifier):
+    """
+    Асинхронный вариант PGtoES для режима опроса по updated_at. Изменения и
+    документы фильмов, персон и жанров обрабатываются тремя одновременными
+    задачами: Postgres читается через asyncpg подготовленными запросами,
+    документы пишутся в Elasticsearch через async_streaming_bulk. Запросы,
+    файл состояния и его ключи те же, что у PGtoES, поэтому один ETL можно
+    заменить другим без перезагрузки индексов. Редкие служебные операции
+    (создание индексов, сброс кеша FastAPI, поиск удаленных строк)
+    выполняются синхронным кодом в отдельных потоках
+    """
+
+    # Запросы изменений по таблицам: запрос и псевдоним таблицы в нем
+    CHANGES = {
+        "film_work": (PGtoES.FILM_WORK_CHANGES_SQL, 'fw'),
+        "person": (PGtoES.PERSON_CHANGES_SQL, 'p'),
+        "genre": (PGtoES.GENRE_CHANGES_SQL, 'g'),
+    }
+    # Запросы документов индексов с параметрами asyncpg
+    INDEX_SQL = {
+        "movies": PGtoES.FILM_SQL.replace('%s', '$1'),
+        "persons": PGtoES.PERSON_SQL.replace('%s', '$1'),
+        "genres": PGtoES.GENRE_SQL.replace('%s', '$1'),
+    }
+
+    def __init__(self, batch_size: Optional[int] = None, state_file: Optional[str] = None):
+        self.state = State(JsonFileStorage(state_file))
+        self.batch_size = batch_size or self.get_settings().etl.batch_size
+        # Удаленные строки ищет синхронный ETL с тем же файлом состояния
+        self.purger = PGtoES(self.batch_size, state_file)
+        self.pool: Optional[asyncpg.Pool] = None
+        self.es: Optional[AsyncElasticsearch] = None
+
+    async def run(self):
+        """
+        Синхронизировать изменения каждые etl.poll_interval секунд. Раунд,
+        прерванный ошибкой, продолжается в следующий раз с сохраненной порции
+        """
+        await self.connect()
+        await asyncio.to_thread(self.update_mappings)
+        try:
+            while True:
+                try:
+                    await self.sync()
+                except Exception as e:
+                    logger.exception(f"Раунд синхронизации прерван: {e}")
+                await asyncio.sleep(self.get_settings().etl.poll_interval)
+        finally:
+            await self.close()
+
+    async def connect(self):
+        settings = self.get_settings()
+        pg_params = dict(settings.film_work_pg)
+        pg_params['database'] = pg_params.pop('dbname')
+        # Соединение на каждую из одновременных задач
+        self.pool = await asyncpg.create_pool(**pg_params, min_size=1, max_size=len(self.CHANGES),
+                                              init=self.__init_connection)
+        self.es = AsyncElasticsearch(f"http://{settings.film_work_es.host}:{settings.film_work_es.port}")
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+        if self.es:
+            await self.es.close()
+
+    async def sync(self):
+        logger.debug("Start async synchronization round")
+        await self.__purge_if_due()
+        changes = await asyncio.gather(*(self.__get_changes(table) for table in self.CHANGES))
+
+        # Документы, которые не удалось записать в прошлых раундах, повторяются
+        failed = self.failed_ids()
+        ids = {index: failed.get(index, set()) for index in self.INDEX_SQL}
+        for film_ids, person_ids, genre_ids, _ in changes:
+            ids['movies'] |= film_ids
+            ids['persons'] |= person_ids
+            ids['genres'] |= genre_ids
+        if not any(ids.values()):
+            return
+
+        # Прогресс раунда тот же, что у PGtoES
+        round_marks = [str(updated_at) for *_, updated_at in changes]
+        progress = self.state.get_state('sync_progress') or {}
+        if progress.get('round') != round_marks:
+            progress = {'round': round_marks}
+
+        # Индексы создаются по очереди: одновременная запись файла состояния
+        # из нескольких потоков могла бы потерять ключи
+        for index, index_ids in ids.items():
+            if index_ids:
+                await asyncio.to_thread(self.ensure_index, index)
+        await asyncio.gather(*(self.__sync_index(index, index_ids, progress) for index, index_ids in ids.items()))
+
+        for table, (*_, updated_at) in zip(self.CHANGES, changes):
+            self.state.set_state(table + '_last_update', updated_at)
+        self.state.set_state('sync_progress', None)
+        # Во время массовой загрузки кеш по порциям не сбрасывался
+        for index in await asyncio.to_thread(self.finish_bulk_loads):
+            await asyncio.to_thread(self.notify, index, [])
+
+    async def __get_changes(self, table: str) -> Tuple[Set[str], Set[str], Set[str], str]:
+        sql, alias = self.CHANGES[table]
+        # Отметка времени передается строкой, как в PGtoES
+        sql = sql.format(f"{alias}.updated_at > $1::text::timestamptz")
+        last_updated = self.state.get_state(table + '_last_update') or str(datetime.min)
+        film_ids, person_ids, genre_ids = set(), set(), set()
+        max_updated_at = None
+        async with self.pool.acquire() as con:
+            # Курсор asyncpg работает только внутри транзакции
+            async with con.transaction():
+                async for r in con.cursor(sql, str(last_updated), prefetch=self.get_settings().etl.itersize):
+                    if r['film_work_id']:
+                        film_ids.add(str(r['film_work_id']))
+                    if r['person_id']:
+                        person_ids.add(str(r['person_id']))
+                    if r['genre_id']:
+                        genre_ids.add(str(r['genre_id']))
+                    if max_updated_at is None or r['updated_at'] > max_updated_at:
+                        max_updated_at = r['updated_at']
+        update_at = max_updated_at.strftime('%Y-%m-%d %H:%M:%S.%f') if max_updated_at else last_updated
+        return film_ids, person_ids, genre_ids, update_at
+
+    async def __sync_index(self, index: str, ids: Set[str], progress: dict):
+        """
+        Синхронизировать документы индекса порциями по batch_size id.
+        Чтение следующих порций идет, пока пишутся предыдущие; очередь
+        между ними ограничена etl.pipeline_queue_size порциями
+        """
+        last_id = progress.get(index)
+        pending = sorted(i for i in ids if last_id is None or i > last_id)
+        if not pending:
+            return
+        chunks = asyncio.Queue(max(self.get_settings().etl.pipeline_queue_size, 1))
+        reader = asyncio.create_task(self.__extract(index, pending, chunks))
+        try:
+            while (item := await chunks.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                chunk, records = item
+                await self.__load(index, chunk, records, progress)
+        finally:
+            reader.cancel()
+
+    async def __extract(self, index: str, pending: List[str], chunks: asyncio.Queue):
+        try:
+            async with self.pool.acquire() as con:
+                # Запрос разбирается сервером один раз на все порции
+                statement = await con.prepare(self.INDEX_SQL[index])
+                for start in range(0, len(pending), self.batch_size):
+                    chunk = pending[start:start + self.batch_size]
+                    records = [self.__to_doc(record) for record in await statement.fetch(chunk)]
+                    await chunks.put((chunk, records))
+        except Exception as e:
+            await chunks.put(e)
+            return
+        await chunks.put(None)
+
+    async def __load(self, index: str, chunk: List[str], records: List[dict], progress: dict):
+        if records:
+            logger.debug("Syncing batch with {} {}, for example: {}".format(len(records), index, records[0]['id']))
+            bulk_loading = self.bulk_loading(index)
+            if not bulk_loading:
+                # Теги берутся и из прежних версий документов, как в PGtoES
+                previous = await asyncio.to_thread(self.get_many, [r['id'] for r in records], index,
+                                                   ['id', self.TAGS[index][0]])
+            # Кеш сбрасывается, когда новые документы уже видны поиску
+            errors = await self.__save_actions(self.build_actions(records, index), index, not bulk_loading)
+            failed = self.track_failed(index, chunk, errors)
+            if not bulk_loading:
+                await asyncio.to_thread(self.notify, index, [r['id'] for r in records if r['id'] not in failed],
+                                        self.get_tags(index, previous + records))
+        else:
+            # Строк порции больше нет в Postgres - повторять их запись незачем
+            self.track_failed(index, chunk, [])
+        progress[index] = chunk[-1]
+        self.state.set_state('sync_progress', progress)
+
+    async def __save_actions(self, actions: List[dict], index: str, refresh: bool) -> List[dict]:
+        """То же, что ESSaver.save_actions: отклоненные с временной ошибкой документы пишутся повторно"""
+        errors = await self.__bulk(actions, index, refresh)
+        for attempt in range(self.get_settings().etl.index_retries):
+            retry, errors = self.split_bulk_errors(actions, errors)
+            if not retry:
+                break
+            logger.warning(f"Retrying {len(retry)} {index} rejected by Elasticsearch")
+            await asyncio.sleep(self.BULK_RETRY_SLEEP * 2 ** attempt)
+            errors += await self.__bulk(retry, index, refresh)
+        return errors
+
+    @async_backoff()
+    async def __bulk(self, actions: List[dict], index: str, refresh: bool) -> List[dict]:
+        etl_settings = self.get_settings().etl
+        started = time.monotonic()
+        done, errors = 0, []
+        options = dict(
+            chunk_size=etl_settings.index_chunk_size,
+            max_chunk_bytes=etl_settings.index_max_chunk_bytes,
+            raise_on_error=False,
+        )
+        if refresh:
+            options['refresh'] = 'wait_for'
+        async for ok, item in async_streaming_bulk(self.es, actions, **options):
+            if ok:
+                done += 1
+            else:
+                errors.append(item)
+        self.log_bulk(index, "Indexed", done, errors, started)
+        return errors
+
+    async def __purge_if_due(self):
+        interval = self.get_settings().etl.purge_interval
+        if interval and time.time() - (self.state.get_state('last_purge') or 0) >= interval:
+            await asyncio.to_thread(self.purger.purge_deleted)
+            self.state.set_state('last_purge', time.time())
+
+    @staticmethod
+    def __to_doc(record: asyncpg.Record) -> dict:
+        # asyncpg отдает uuid объектами, а документы хранят id строками
+        return {key: str(value) if isinstance(value, UUID) else value for key, value in record.items()}
+
+    @staticmethod
+    async def __init_connection(con: asyncpg.Connection):
+        # По умолчанию asyncpg отдает jsonb строками, а документам нужны объекты
+        await con.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
@@ -0,0 +1,139 @@
+"""
+Сравнение запросов ETL с прежними запросами с общими JOIN связей.
+
+Для выборки из batch_size фильмов, персон и жанров каждый запрос
+выполняется под EXPLAIN (ANALYZE, BUFFERS): печатаются число строк
+результата, сумма строк, прошедших через все узлы плана, число
+прочитанных блоков и время. Запуск из каталога postgres_to_es:
+
+    python benchmark.py --repeat 5
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+from db.pg_loader import PGLoader
+from pg_to_es import PGtoES
+
+LEGACY_FILM_WORK_CHANGES_SQL = """
+    SELECT DISTINCT
+        fw.id AS film_work_id,
+        pfw.person_id AS person_id,
+        gfw.genre_id AS genre_id,
+        fw.updated_at
+    FROM content.film_work fw
+    LEFT JOIN content.person_film_work pfw ON fw.id = pfw.film_work_id
+    LEFT JOIN content.genre_film_work gfw ON fw.id = gfw.film_work_id
+    WHERE {}
+    ;"""
+LEGACY_PERSON_CHANGES_SQL = """
+    SELECT DISTINCT
+        pfw.film_work_id AS film_work_id,
+        p.id AS person_id,
+        gfw.genre_id AS genre_id,
+        p.updated_at
+    FROM content.person p
+    LEFT JOIN content.person_film_work pfw ON p.id = pfw.person_id
+    LEFT JOIN content.film_work fw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.genre_film_work gfw ON fw.id = gfw.film_work_id
+    WHERE {}
+    ;"""
+LEGACY_GENRE_CHANGES_SQL = """
+    SELECT DISTINCT
+        gfw.film_work_id AS film_work_id,
+        pfw.person_id AS person_id,
+        g.id AS genre_id,
+        g.updated_at
+    FROM content.genre g
+    LEFT JOIN content.genre_film_work gfw ON g.id = gfw.genre_id
+    LEFT JOIN content.film_work fw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.person_film_work pfw ON fw.id = pfw.film_work_id
+    WHERE {}
+    ;"""
+LEGACY_FILM_SQL = """
+    SELECT
+        fw.id,
+        fw.rating as imdb_rating,
+        STRING_AGG(DISTINCT g.name, ' ') as genre,
+        ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genres,
+        fw.title,
+        fw.description,
+        ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director') AS director,
+        ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
+        ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names,
+        ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'actor') AS actors,
+        ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+            FILTER (WHERE pfw.role = 'writer') AS writers
+    FROM content.film_work fw
+    LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
+    LEFT JOIN content.genre g ON g.id = gfw.genre_id
+    LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
+    LEFT JOIN content.person p ON p.id = pfw.person_id
+    WHERE fw.id = ANY(%s::uuid[])
+    GROUP BY fw.id;
+    """
+
+
+def plan_stats(plan: dict) -> Tuple[int, int]:
+    """Сумма строк всех узлов плана (с учетом повторов) и число прочитанных блоков"""
+    rows = plan['Actual Rows'] * plan['Actual Loops']
+    for child in plan.get('Plans', []):
+        rows += plan_stats(child)[0]
+    return rows, plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+
+
+def measure(loader: PGLoader, sql: str, ids: List[str], repeat: int) -> dict:
+    explain = loader.do_query("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, (ids,))
+    plan = explain[0]['QUERY PLAN'][0]
+    rows, blocks = plan_stats(plan['Plan'])
+    # Время с передачей результата клиенту, лучшее из repeat запусков
+    wall = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        loader.do_query(sql, (ids,))
+        wall.append(time.perf_counter() - started)
+    return {
+        'result': plan['Plan']['Actual Rows'],
+        'rows': rows,
+        'blocks': blocks,
+        'execution_ms': plan['Execution Time'],
+        'wall_ms': min(wall) * 1000,
+    }
+
+
+def sample_ids(loader: PGLoader, table: str, size: int) -> List[str]:
+    return [r['id'] for r in loader.do_query(f"SELECT id FROM content.{table} ORDER BY random() LIMIT %s;", (size,))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение запросов ETL с прежними запросами")
+    parser.add_argument('--size', type=int, help="размер выборки, по умолчанию etl.batch_size")
+    parser.add_argument('--repeat', type=int, default=3, help="сколько раз выполнять каждый запрос")
+    args = parser.parse_args()
+
+    loader = PGLoader()
+    size = args.size or loader.get_settings().etl.batch_size
+    film_ids = sample_ids(loader, 'film_work', size)
+    person_ids = sample_ids(loader, 'person', size)
+    genre_ids = sample_ids(loader, 'genre', size)
+
+    cases = (
+        ('film documents', LEGACY_FILM_SQL, PGtoES.FILM_SQL, film_ids),
+        ('film changes', LEGACY_FILM_WORK_CHANGES_SQL.format("fw.id = ANY(%s::uuid[])"),
+         PGtoES.FILM_WORK_CHANGES_SQL.format("fw.id = ANY(%s::uuid[])"), film_ids),
+        ('person changes', LEGACY_PERSON_CHANGES_SQL.format("p.id = ANY(%s::uuid[])"),
+         PGtoES.PERSON_CHANGES_SQL.format("p.id = ANY(%s::uuid[])"), person_ids),
+        ('genre changes', LEGACY_GENRE_CHANGES_SQL.format("g.id = ANY(%s::uuid[])"),
+         PGtoES.GENRE_CHANGES_SQL.format("g.id = ANY(%s::uuid[])"), genre_ids),
+    )
+    print(f"{'query':<16}{'version':<8}{'result':>8}{'rows':>12}{'blocks':>10}{'exec, ms':>12}{'wall, ms':>12}")
+    for name, legacy_sql, sql, ids in cases:
+        for version, query in (('old', legacy_sql), ('new', sql)):
+            stats = measure(loader, query, ids, args.repeat)
+            print(f"{name:<16}{version:<8}{stats['result']:>8}{stats['rows']:>12}{stats['blocks']:>10}"
+                  f"{stats['execution_ms']:>12.1f}{stats['wall_ms']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import json
+import logging
+from typing import Iterable, List, Set
+
+import redis
+
+from settings.settings import Settings
+from resources import backoff
+
+logger = logging.getLogger(__name__)
+
+# Канал, на который подписывается FastAPI для сброса локального кеша
+INVALIDATION_CHANNEL = 'cache_invalidation'
+
+
+class CacheNotifier(Settings):
+    """
+    Сообщает FastAPI об обновленных в Elasticsearch документах: удаляет их
+    и готовые ответы API по ним из Redis, увеличивает поколения индекса и
+    связанных тегов (от них зависят ключи списков) и публикует
+    идентификаторы в канал INVALIDATION_CHANNEL.
+    """
+
+    __redis_con = None
+
+    # Для каждого индекса: поле документа со списком связанных объектов и
+    # имя тега. Например, фильм жанра X сбрасывает списки фильмов жанра X
+    # (тег movies:genre:X), не трогая списки других жанров.
+    TAGS = {
+        "movies": ('genres', 'genre'),
+        "persons": ('films', 'film'),
+        "genres": ('films', 'film'),
+    }
+
+    def get_tags(self, index: str, docs: List[dict]) -> Set[str]:
+        """Теги списков, которые затрагивает обновление документов"""
+        field, tag = self.TAGS[index]
+        return {
+            f'{index}:{tag}:{item["id"]}'
+            for doc in docs for item in doc.get(field) or [] if item and item.get('id')
+        }
+
+    def notify_replaced(self, index: str):
+        """
+        Сбросить все списки индекса, в том числе списки по тегам (их ключи
+        FastAPI включают поколение тега {index}:all): индекс заменен новой
+        версией, и измениться мог любой документ
+        """
+        self.notify(index, [], [f'{index}:all'])
+
+    # Сколько попыток сбросить кеш делается, пока Redis недоступен
+    NOTIFY_TRIES = 3
+
+    def notify(self, index: str, ids: Iterable[str], tags: Iterable[str] = ()):
+        """
+        Сбросить кеш FastAPI по документам ids. Если Redis недоступен и
+        после NOTIFY_TRIES попыток, ошибка пишется в лог, а синхронизация
+        продолжается: кеш FastAPI обновится по истечении срока годности
+        """
+        try:
+            self.__notify(index, ids, tags)
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось сбросить кеш индекса {index}: {e}")
+
+    @backoff(max_tries=NOTIFY_TRIES)
+    def __notify(self, index: str, ids: Iterable[str], tags: Iterable[str]):
+        con = self.__get_connection()
+        if con is None:
+            return
+        ids = [str(doc_id) for doc_id in ids]
+        tags = [index, *tags]
+        pipe = con.pipeline()
+        if ids:
+            pipe.delete(*ids, *(f'response:{doc_id}' for doc_id in ids))
+        for tag in tags:
+            pipe.incr(f'generation:{tag}')
+        pipe.publish(INVALIDATION_CHANNEL, json.dumps({'index': index, 'ids': ids, 'tags': tags}))
+        pipe.execute()
+        logger.debug(f"Сброшен кеш {len(ids)} документов и {len(tags)} тегов индекса {index}")
+
+    def __get_connection(self):
+        redis_params = self.get_settings().film_work_redis
+        if redis_params is None:
+            # Redis не настроен - кеш FastAPI обновится только по TTL
+            return None
+        if not self.__redis_con:
+            self.__redis_con = redis.Redis(**dict(redis_params))
+        return self.__redis_con
@@ -1,7 +1,9 @@
+import copy
 import logging
+import time
 import requests
-from elasticsearch import Elasticsearch, helpers
-from typing import List
+from elasticsearch import ConnectionTimeout, Elasticsearch, RequestError, helpers
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from settings.settings import Settings
 from settings.schemes import Schemes
@@ -14,19 +16,206 @@ class ESSaver(Settings, Schemes):
 
     __es_con = None
 
+    # Индексы, в которые идет запись, по логическим именам. Логическое имя
+    # (movies) - это псевдоним текущей версии индекса (movies_v{N}); без
+    # записи в словаре документы пишутся через псевдоним
+    index_names: Dict[str, str] = {}
+
     SCHEMES = {
         "movies": 'film_scheme',
         "persons": 'person_scheme',
         "genres": 'genre_scheme',
     }
 
+    # Настройки индекса на время массовой загрузки
+    BULK_LOAD_SETTINGS = {
+        "refresh_interval": "-1",
+        "number_of_replicas": 0,
+    }
+
+    # Для каждого индекса: поле с названием и поле подсказок (completion),
+    # по которому FastAPI подсказывает названия при наборе
+    SUGGEST_FIELDS = {
+        "movies": ('title', 'title_suggest'),
+        "persons": ('full_name', 'full_name_suggest'),
+    }
+
     @backoff()
     def save_one(self, doc: dict, index: str):
-        self.__get_connection().index(index=index, id=doc['id'], document=doc)
+        self.__get_connection().index(index=self.index_names.get(index, index), id=doc['id'],
+                                      document=self.__with_suggest(doc, index))
+
+    # Пауза перед повторной записью отклоненных документов, с каждой
+    # попыткой удваивается
+    BULK_RETRY_SLEEP = 0.5
+
+    def save_many(self, docs: List[dict], index: str) -> List[dict]:
+        """
+        Записать документы bulk-запросами. Ошибки отдельных документов не
+        прерывают запись остальных: они собираются, пишутся в лог и
+        возвращаются
+        """
+        return self.save_actions(self.build_actions(docs, index), index)
+
+    def build_actions(self, docs: List[dict], index: str) -> List[dict]:
+        """Действия bulk-запроса для записи документов в текущую версию индекса"""
+        name = self.index_names.get(index, index)
+        return [{'_index': name, '_id': doc['id'], **self.__with_suggest(doc, index)} for doc in docs]
+
+    def save_actions(self, actions: List[dict], index: str, refresh: bool = False) -> List[dict]:
+        """
+        Выполнить действия bulk-запросами. Документы, отклоненные с
+        временной ошибкой, отправляются повторно с растущей паузой, не
+        больше etl.index_retries раз. Возвращает ошибки документов, которые
+        записать не удалось. При ошибке соединения с Elasticsearch запрос
+        повторяется через backoff. С refresh запрос завершается только
+        после того, как записанные документы станут видны поиску
+        """
+        errors = self.__save_actions(actions, index, refresh)
+        for attempt in range(self.get_settings().etl.index_retries):
+            retry, errors = self.split_bulk_errors(actions, errors)
+            if not retry:
+                break
+            logger.warning(f"Retrying {len(retry)} {index} rejected by Elasticsearch")
+            time.sleep(self.BULK_RETRY_SLEEP * 2 ** attempt)
+            errors += self.__save_actions(retry, index, refresh)
+        return errors
+
+    @backoff()
+    def __save_actions(self, actions: List[dict], index: str, refresh: bool) -> List[dict]:
+        return self.__run_bulk(iter(actions), index, "Indexed", refresh)
+
+    @classmethod
+    def split_bulk_errors(cls, actions: List[dict], errors: List[dict]) -> Tuple[List[dict], List[dict]]:
+        """
+        Разделить ошибки bulk-запроса: вернуть действия, которые стоит
+        повторить (Elasticsearch перегружен - 429 или сбой узла - 5xx), и
+        остальные ошибки, которые повтор не исправит
+        """
+        retry_ids, permanent = set(), []
+        for error in errors:
+            status = next(iter(error.values())).get('status', 0)
+            if status == 429 or status >= 500:
+                retry_ids.add(cls.bulk_error_id(error))
+            else:
+                permanent.append(error)
+        return [action for action in actions if str(action['_id']) in retry_ids], permanent
+
+    @staticmethod
+    def bulk_error_id(error: dict) -> str:
+        # Ошибка bulk-запроса: {'index': {'_id': ..., 'status': ..., 'error': ...}}
+        return str(next(iter(error.values())).get('_id'))
+
+    def failed_ids(self) -> Dict[str, Set[str]]:
+        """Id документов, которые не удалось записать, по индексам"""
+        failed = self.state.get_state('failed_ids') or {}
+        return {index: set(ids) for index, ids in failed.items()}
+
+    def track_failed(self, index: str, chunk: List[str], errors: List[dict]) -> Set[str]:
+        """
+        Запомнить в состоянии id документов порции chunk, которые не удалось
+        записать, и забыть те, что записались. Отметки раунда после него
+        сдвигаются, поэтому такие документы добавляются в следующие раунды,
+        пока не запишутся. Возвращает id незаписанных документов порции
+        """
+        failed = {self.bulk_error_id(error) for error in errors}
+        all_failed = self.failed_ids()
+        known = all_failed.get(index, set())
+        updated = (known - set(chunk)) | failed
+        if updated != known:
+            all_failed[index] = updated
+            self.state.set_state('failed_ids', {name: sorted(ids) for name, ids in all_failed.items() if ids})
+        return failed
+
+    @backoff()
+    def delete_many(self, ids: List[str], index: str) -> List[dict]:
+        """
+        Удалить документы bulk-запросами. Уже отсутствующие документы
+        ошибкой не считаются
+        """
+        name = self.index_names.get(index, index)
+        actions = ({'_op_type': 'delete', '_index': name, '_id': doc_id} for doc_id in ids)
+        return self.__run_bulk(actions, index, "Deleted")
 
     @backoff()
-    def save_many(self, docs: List[dict], index: str):
-        helpers.bulk(self.__get_connection(), [{'_index': index, '_id': doc['id'], **doc} for doc in docs])
+    def get_many(self, ids: List[str], index: str, fields: List[str]) -> List[dict]:
+        docs = self.__get_connection().mget(index=self.index_names.get(index, index), body={"ids": ids},
+                                            _source_includes=fields)
+        return [doc["_source"] for doc in docs["docs"] if doc.get("found")]
+
+    def iter_ids(self, index: str) -> Iterator[str]:
+        """
+        Все id документов индекса в порядке возрастания, страницами по
+        etl.itersize через search_after
+        """
+        page_size = self.get_settings().etl.itersize
+        body = {"query": {"match_all": {}}, "sort": [{"id": {"order": "asc"}}], "_source": False, "size": page_size}
+        while True:
+            hits = self.__search(self.index_names.get(index, index), body)["hits"]["hits"]
+            for hit in hits:
+                yield hit["_id"]
+            if len(hits) < page_size:
+                return
+            body["search_after"] = hits[-1]["sort"]
+
+    @backoff()
+    def __search(self, name: str, body: dict) -> dict:
+        return self.__get_connection().search(index=name, body=body)
+
+    def __run_bulk(self, actions: Iterator[dict], index: str, verb: str, refresh: bool = False) -> List[dict]:
+        started = time.monotonic()
+        done, errors = 0, []
+        for ok, item in self.__bulk(actions, refresh):
+            if ok or item.get('delete', {}).get('status') == 404:
+                done += 1
+            else:
+                errors.append(item)
+        self.log_bulk(index, verb, done, errors, started)
+        return errors
+
+    @staticmethod
+    def log_bulk(index: str, verb: str, done: int, errors: List[dict], started: float):
+        elapsed = time.monotonic() - started
+        logger.info(f"{verb} {done} {index} in {elapsed:.2f}s "
+                    f"({done / elapsed if elapsed else 0:.0f} docs/s), errors: {len(errors)}")
+        for error in errors:
+            logger.error(f"Ошибка записи документа в индекс {index}: {error}")
+
+    def __bulk(self, actions: Iterator[dict], refresh: bool = False) -> Iterator[Tuple[bool, dict]]:
+        etl_settings = self.get_settings().etl
+        options = dict(
+            chunk_size=etl_settings.index_chunk_size,
+            max_chunk_bytes=etl_settings.index_max_chunk_bytes,
+            raise_on_error=False,
+        )
+        if refresh:
+            # Дождаться ближайшего обновления поиска, не создавая лишних сегментов
+            options['refresh'] = 'wait_for'
+        if etl_settings.index_mode == 'parallel':
+            return helpers.parallel_bulk(self.__get_connection(), actions, thread_count=etl_settings.index_threads,
+                                         **options)
+        return helpers.streaming_bulk(self.__get_connection(), actions, **options)
+
+    def __with_suggest(self, doc: dict, index: str) -> dict:
+        """
+        Добавить в документ поле подсказок. Completion-поле ищет только по
+        началу строки, поэтому кроме полного названия в подсказки попадают
+        и все его окончания с границы слова: "Tom Hanks" находится и по "han".
+        Вес поднимает в подсказках фильмы с высоким рейтингом и людей
+        с большим числом фильмов
+        """
+        if index not in self.SUGGEST_FIELDS:
+            return doc
+        field, suggest_field = self.SUGGEST_FIELDS[index]
+        words = (doc.get(field) or '').split()
+        if not words:
+            return doc
+        if index == 'movies':
+            weight = int((doc.get('imdb_rating') or 0) * 10)
+        else:
+            weight = len(doc.get('films') or [])
+        suggest = {"input": [' '.join(words[i:]) for i in range(len(words))], "weight": weight}
+        return {**doc, suggest_field: suggest}
 
     def __get_connection(self):
         if not self.__es_con:
@@ -38,8 +227,174 @@ class ESSaver(Settings, Schemes):
         return f"http://{es_params['host']}:{es_params['port']}"
 
     @backoff()
-    def create_index(self, index: str):
-        scheme = self.get_schemes()[self.SCHEMES[index]]
-        resp = requests.put("{}/{}".format(self.__get_es_link(), index), json=scheme)
+    def create_index(self, index: str, bulk_load: bool = False) -> str:
+        """
+        Создать новую версию индекса index_v{N} по схеме и вернуть ее имя.
+        Псевдоним index на нее переводит swap_alias. В режиме массовой
+        загрузки индекс создается без обновления поиска (refresh_interval -1)
+        и без реплик, а после загрузки нужно вызвать finish_bulk_load
+        """
+        name = f"{index}_v{self.__last_version(index) + 1}"
+        scheme = copy.deepcopy(self.get_schemes()[self.SCHEMES[index]])
+        if bulk_load:
+            scheme.setdefault("settings", {}).update(self.BULK_LOAD_SETTINGS)
+        resp = requests.put("{}/{}".format(self.__get_es_link(), name), json=scheme)
         if resp.status_code != 200:
-            logger.warning(f"Ошибка создания поискового индекса: {index}")
+            logger.warning(f"Ошибка создания поискового индекса: {name}")
+        return name
+
+    @backoff()
+    def update_mappings(self):
+        """
+        Добавить в существующие индексы поля, которые появились в схеме
+        после их создания (например, поля подсказок title_suggest и
+        full_name_suggest). Уже проиндексированные документы получат
+        значения новых полей при следующем обновлении или перестройке.
+        Изменить тип существующего поля так нельзя: тогда в лог пишется
+        ошибка, и индекс нужно перестроить (etl.py --rebuild)
+        """
+        es = self.__get_connection()
+        for index, scheme in self.SCHEMES.items():
+            if not es.indices.exists(index=index):
+                continue
+            try:
+                es.indices.put_mapping(index=index, body=self.get_schemes()[scheme]["mappings"])
+            except RequestError as e:
+                logger.error(f"Схема индекса {index} несовместима с текущей, нужна перестройка: {e}")
+
+    def index_exists(self, index: str) -> bool:
+        return self.__get_connection().indices.exists(index=index)
+
+    @backoff()
+    def swap_alias(self, index: str, name: str):
+        """
+        Атомарно перевести псевдоним index на версию name, так что читатели
+        видят либо старый, либо новый индекс. Версия, на которую псевдоним
+        указывал до этого, остается для отката (rollback_alias) и удаляется
+        при следующем переводе. Более старые версии и индекс, созданный под
+        именем index без версии, удаляются в том же запросе
+        """
+        es = self.__get_connection()
+        current = self.__alias_targets(index)
+        if current == [name]:
+            return
+        actions = [{"remove": {"index": old_name, "alias": index}} for old_name in current]
+        actions += [
+            {"remove_index": {"index": old_name}}
+            for old_name in self.__versions(index).values() if old_name != name and old_name not in current
+        ]
+        if not current and es.indices.exists(index=index):
+            actions.append({"remove_index": {"index": index}})
+        actions.append({"add": {"index": name, "alias": index}})
+        es.indices.update_aliases(body={"actions": actions})
+        logger.info(f"Псевдоним {index} переведен на индекс {name}")
+
+    @backoff()
+    def rollback_alias(self, index: str) -> Optional[str]:
+        """
+        Вернуть псевдоним index на предыдущую версию и вернуть ее имя (None,
+        если предыдущей версии нет). Текущая версия удалится при следующем
+        переводе псевдонима. Изменения, записанные после перевода, в
+        предыдущей версии отсутствуют
+        """
+        current = self.__alias_targets(index)
+        versions = self.__versions(index)
+        current_versions = [number for number, name in versions.items() if name in current]
+        older = [number for number in versions if current_versions and number < min(current_versions)]
+        if not older:
+            logger.warning(f"Нет предыдущей версии индекса {index}")
+            return None
+        name = versions[max(older)]
+        actions = [{"remove": {"index": old_name, "alias": index}} for old_name in current]
+        actions.append({"add": {"index": name, "alias": index}})
+        self.__get_connection().indices.update_aliases(body={"actions": actions})
+        logger.info(f"Псевдоним {index} возвращен на индекс {name}")
+        return name
+
+    def __alias_targets(self, index: str) -> List[str]:
+        es = self.__get_connection()
+        if not es.indices.exists_alias(name=index):
+            return []
+        return list(es.indices.get_alias(name=index))
+
+    def __versions(self, index: str) -> Dict[int, str]:
+        return {
+            int(name.rsplit("_v", 1)[1]): name
+            for name in self.__get_connection().indices.get(index=f"{index}_v*")
+            if name.rsplit("_v", 1)[1].isdigit()
+        }
+
+    def __last_version(self, index: str) -> int:
+        return max(self.__versions(index), default=0)
+
+    # Таймаут ожидания слияния сегментов (в секундах): для большого индекса
+    # оно идет минутами, намного дольше таймаута клиента по умолчанию
+    FORCEMERGE_TIMEOUT = 60 * 60
+
+    def finish_bulk_load(self, name: str, index: str):
+        """
+        Завершить массовую загрузку версии name индекса index: вернуть
+        настройки обновления и реплик из схемы, слить сегменты и сделать
+        загруженные документы доступными для поиска
+        """
+        self.__restore_settings(name, index)
+        # Индекс только что построен заново, поэтому его можно слить в один
+        # сегмент. Слияние не повторяется через backoff: после таймаута
+        # клиента Elasticsearch продолжает его, а повторный запрос только
+        # встал бы в очередь за ним
+        try:
+            self.__get_connection().indices.forcemerge(index=name, max_num_segments=1,
+                                                       request_timeout=self.FORCEMERGE_TIMEOUT)
+        except ConnectionTimeout:
+            logger.warning(f"Слияние сегментов индекса {name} не закончилось за {self.FORCEMERGE_TIMEOUT} с, "
+                           f"оно продолжится в Elasticsearch")
+        self.__refresh(name)
+        logger.info(f"Массовая загрузка индекса {name} завершена")
+
+    @backoff()
+    def __restore_settings(self, name: str, index: str):
+        scheme_settings = self.get_schemes()[self.SCHEMES[index]].get("settings", {})
+        self.__get_connection().indices.put_settings(index=name, body={"index": {
+            "refresh_interval": scheme_settings.get("refresh_interval", "1s"),
+            "number_of_replicas": scheme_settings.get("number_of_replicas", 1),
+        }})
+
+    @backoff()
+    def __refresh(self, name: str):
+        self.__get_connection().indices.refresh(index=name)
+
+    def bulk_loading(self, index: str) -> bool:
+        """
+        Идет ли массовая загрузка индекса: поиск по нему не обновляется до
+        finish_bulk_loads, поэтому ждать обновления после записи нельзя
+        """
+        return bool(self.state.get_state(f'bulk_load_{index}'))
+
+    def ensure_index(self, index: str):
+        """
+        Создать индекс index, если его еще нет: первая версия создается в
+        режиме массовой загрузки, и ее имя запоминается в состоянии до
+        finish_bulk_loads. Использует состояние self.state класса-наследника
+        """
+        if not self.state.get_state(f'index_created_{index}'):
+            if not self.index_exists(index):
+                name = self.create_index(index, bulk_load=True)
+                self.swap_alias(index, name)
+                self.state.set_state(f'bulk_load_{index}', name)
+            self.state.set_state(f'index_created_{index}', True)
+
+    def finish_bulk_loads(self) -> List[str]:
+        """
+        Завершить массовую загрузку всех индексов, для которых она начата,
+        и вернуть эти индексы. Имя версии хранится в состоянии, поэтому
+        после сбоя загрузка будет завершена в конце следующего успешного
+        раунда
+        """
+        finished = []
+        for index in self.SCHEMES:
+            name = self.state.get_state(f'bulk_load_{index}')
+            if name:
+                self.finish_bulk_load(name, index)
+                self.state.set_state(f'bulk_load_{index}', None)
+                finished.append(index)
+        return finished
@@ -1,6 +1,12 @@
+import json
+import select
+import time
+import uuid
+from typing import Iterator, List, Optional
+
 import psycopg2
 import psycopg2.extras
-from psycopg2 import DatabaseError
+from psycopg2 import DatabaseError, sql
 
 from settings.settings import Settings
 from resources import backoff
@@ -10,21 +16,113 @@ class PGLoader(Settings):
 
     __pg_con = None
     __cursor = None
+    __listen_con = None
 
-    def do_query(self, sql: str):
+    def do_query(self, sql: str, params: Optional[tuple] = None):
         try:
-            self.__get_cursor().execute(sql)
+            self.__get_cursor().execute(sql, params)
             return self.__cursor.fetchall()
         except DatabaseError:
-            self.__pg_con.close()
-            self.__cursor = None
+            self.__reset()
+
+    def iter_query(self, sql: str, params: Optional[tuple] = None) -> Iterator[List[dict]]:
+        """
+        Выполнить запрос и отдавать результат порциями строк. В потоковом
+        режиме (etl.stream) строки читаются именованным серверным курсором
+        по etl.itersize штук, и в памяти находится только текущая порция.
+        Иначе весь результат читается сразу и отдается одной порцией. В
+        отличие от do_query ошибка Postgres не скрывается, а выбрасывается
+        после сброса соединения: вызывающий не должен принять сбой за
+        пустой результат
+        """
+        etl_settings = self.get_settings().etl
+        if not etl_settings.stream:
+            try:
+                cursor = self.__get_cursor()
+                cursor.execute(sql, params)
+                records = cursor.fetchall()
+            except DatabaseError:
+                self.__reset()
+                raise
+            if records:
+                yield records
+            return
+
+        connection = self.__get_connection()
+        try:
+            # Именованный курсор создается на сервере и живет до конца транзакции
+            with connection.cursor(name=f'etl_{uuid.uuid4().hex}',
+                                   cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                cursor.itersize = etl_settings.itersize
+                cursor.execute(sql, params)
+                while True:
+                    records = cursor.fetchmany(etl_settings.itersize)
+                    if not records:
+                        break
+                    yield records
+            connection.commit()
+        except DatabaseError:
+            self.__reset()
+            raise
 
     @backoff()
+    def subscribe(self, channel: str):
+        """
+        Подписаться на уведомления канала channel (LISTEN). Для подписки
+        используется отдельное соединение в режиме autocommit: уведомления
+        доставляются только вне транзакции
+        """
+        self.unsubscribe()
+        self.__listen_con = psycopg2.connect(**self.__get_db_params())
+        self.__listen_con.autocommit = True
+        with self.__listen_con.cursor() as cursor:
+            cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+
+    def unsubscribe(self):
+        if self.__listen_con and not self.__listen_con.closed:
+            self.__listen_con.close()
+        self.__listen_con = None
+
+    def wait_notifications(self, timeout: float, coalesce: float, limit: int) -> List[dict]:
+        """
+        Дождаться уведомлений и вернуть их разобранные JSON-сообщения.
+        Ждет первое уведомление не дольше timeout секунд, затем еще
+        coalesce секунд собирает следующие, чтобы обработать их одной
+        порцией, но не больше limit штук
+        """
+        payloads = []
+        deadline = time.monotonic() + timeout
+        coalescing = False
+        while True:
+            self.__listen_con.poll()
+            while self.__listen_con.notifies:
+                payloads.append(json.loads(self.__listen_con.notifies.pop(0).payload))
+            if len(payloads) >= limit:
+                break
+            if payloads and not coalescing:
+                coalescing = True
+                deadline = time.monotonic() + coalesce
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                break
+            select.select([self.__listen_con], [], [], wait)
+        return payloads
+
     def __get_cursor(self):
         if not self.__cursor:
-            self.__pg_con = psycopg2.connect(**self.__get_db_params())
-            self.__cursor = self.__pg_con.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            self.__cursor = self.__get_connection().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         return self.__cursor
 
+    @backoff()
+    def __get_connection(self):
+        if not self.__pg_con or self.__pg_con.closed:
+            self.__pg_con = psycopg2.connect(**self.__get_db_params())
+        return self.__pg_con
+
+    def __reset(self):
+        if self.__pg_con:
+            self.__pg_con.close()
+        self.__cursor = None
+
     def __get_db_params(self):
         return dict(self.get_settings().film_work_pg)
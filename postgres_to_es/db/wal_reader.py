@@ -0,0 +1,140 @@
+import json
+import logging
+import select
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+
+from settings.settings import Settings
+from resources import backoff
+
+logger = logging.getLogger(__name__)
+
+
+class WalReader(Settings):
+    """
+    Чтение изменений строк из слота логической репликации Postgres
+    (плагин wal2json, format-version 2). Изменения отдаются в том же виде,
+    что и уведомления триггеров: имя таблицы, id строки и колонки связей.
+    Позиция в журнале подтверждается только после обработки порции, поэтому
+    после сбоя необработанные изменения будут прочитаны повторно.
+    """
+
+    __repl_con = None
+    __repl_cursor = None
+    __last_feedback = 0.0
+
+    # Колонки, по которым изменение сопоставляется с документами индексов
+    KEY_COLUMNS = ('id', 'film_work_id', 'person_id', 'genre_id')
+    # Операции wal2json под теми же именами, что TG_OP в уведомлениях триггеров
+    OPERATIONS = {'I': 'INSERT', 'U': 'UPDATE', 'D': 'DELETE'}
+
+    @backoff()
+    def create_slot(self, slot: str):
+        """
+        Создать слот slot, если его еще нет. С этого момента сервер хранит
+        для слота журнал, и изменения не теряются, пока чтение не начато
+        """
+        con = psycopg2.connect(
+            **dict(self.get_settings().film_work_pg),
+            connection_factory=psycopg2.extras.LogicalReplicationConnection
+        )
+        try:
+            con.cursor().create_replication_slot(slot, output_plugin='wal2json')
+            logger.info(f"Создан слот логической репликации {slot}")
+        except psycopg2.errors.DuplicateObject:
+            pass
+        finally:
+            con.close()
+
+    @backoff()
+    def start_replication(self, slot: str, tables: Iterable[str]):
+        """
+        Подключиться к слоту slot, созданному create_slot, и начать чтение
+        изменений только по таблицам tables
+        """
+        self.stop_replication()
+        self.__repl_con = psycopg2.connect(
+            **dict(self.get_settings().film_work_pg),
+            connection_factory=psycopg2.extras.LogicalReplicationConnection
+        )
+        self.__repl_cursor = self.__repl_con.cursor()
+        self.__repl_cursor.start_replication(slot_name=slot, decode=True, options={
+            'format-version': '2',
+            'add-tables': ','.join(tables),
+        })
+        self.__last_feedback = time.monotonic()
+
+    def stop_replication(self):
+        if self.__repl_con and not self.__repl_con.closed:
+            self.__repl_con.close()
+        self.__repl_con = None
+        self.__repl_cursor = None
+
+    def read_changes(self, timeout: float, coalesce: float, limit: int) -> Tuple[List[dict], Optional[int]]:
+        """
+        Прочитать порцию изменений: ждать первое не дольше timeout секунд,
+        затем еще coalesce секунд собирать следующие, но не больше limit.
+        Возвращает изменения и позицию журнала, которую нужно подтвердить
+        после их обработки
+        """
+        changes, lsn = [], None
+        deadline = time.monotonic() + timeout
+        coalescing = False
+        while len(changes) < limit:
+            message = self.__repl_cursor.read_message()
+            if message is not None:
+                changes.extend(self.__to_changes(json.loads(message.payload)))
+                lsn = message.data_start
+                if not coalescing:
+                    coalescing = True
+                    deadline = time.monotonic() + coalesce
+                continue
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                break
+            select.select([self.__repl_cursor], [], [], wait)
+        return changes, lsn
+
+    def confirm(self, lsn: Optional[int] = None):
+        """
+        Подтвердить обработку журнала до позиции lsn. Без позиции только
+        сообщает серверу, что соединение живо
+        """
+        if lsn:
+            self.__repl_cursor.send_feedback(flush_lsn=lsn)
+        else:
+            self.__repl_cursor.send_feedback()
+        self.__last_feedback = time.monotonic()
+
+    def keepalive(self):
+        """
+        Во время долгой обработки порции сообщать серверу, что соединение
+        живо, не реже раза в etl.cdc_keepalive секунд, иначе оно будет
+        разорвано по wal_sender_timeout. Позиция при этом не подтверждается.
+        Если чтение изменений не начато, ничего не делает
+        """
+        if self.__repl_cursor is None:
+            return
+        if time.monotonic() - self.__last_feedback >= self.get_settings().etl.cdc_keepalive:
+            self.confirm()
+
+    def __to_changes(self, message: dict) -> List[dict]:
+        op = self.OPERATIONS.get(message.get('action'))
+        if op is None:
+            return []
+        # В columns новые значения строки, в identity - прежние значения
+        # ключа (для изменения и удаления). Если изменилась колонка связи,
+        # затронуты и прежний, и новый документ
+        changes = []
+        for values in (message.get('columns'), message.get('identity')):
+            if values:
+                row = {column['name']: column['value'] for column in values}
+                change = {column: row.get(column) for column in self.KEY_COLUMNS}
+                change['table'] = message.get('table')
+                change['op'] = op
+                changes.append(change)
+        return changes
@@ -1,6 +1,10 @@
+import argparse
+import asyncio
 import logging
 import time
 
+from psycopg2 import DatabaseError
+
 from pg_to_es import PGtoES
 
 logging_level = logging.DEBUG
@@ -14,15 +18,67 @@ stream_handler.setFormatter(formatter)
 
 main_logger.addHandler(stream_handler)
 
+# Перестройка индексов ведет собственное состояние и может работать
+# одновременно с основным процессом ETL
+REBUILD_STATE_FILE = "rebuild_state.json"
+
 
 def do_etl():
     main_logger.debug("Start loading from PostgreSQL to Elasticsearch")
 
     pte = PGtoES()
+    pte.update_mappings()
+    etl_settings = pte.get_settings().etl
+    if etl_settings.mode == 'listen':
+        pte.listen()
+    if etl_settings.mode == 'cdc':
+        pte.replicate()
     while True:
-        pte.sync()
-        time.sleep(5)
+        try:
+            pte.sync()
+        except DatabaseError as e:
+            # Отметки синхронизации не сдвинулись: раунд продолжится в следующий раз
+            main_logger.exception(f"Раунд синхронизации прерван ошибкой Postgres: {e}")
+        time.sleep(etl_settings.poll_interval)
+
+
+def do_async_etl():
+    main_logger.debug("Start async loading from PostgreSQL to Elasticsearch")
+    # Импорт здесь: asyncpg нужен только асинхронному ETL
+    from async_pg_to_es import AsyncPGtoES
+    asyncio.run(AsyncPGtoES().run())
+
+
+def do_rebuild(workers: int = 1):
+    main_logger.debug("Start rebuilding Elasticsearch indices from PostgreSQL")
+    if workers > 1:
+        from sharded_rebuild import ShardedRebuild
+        ShardedRebuild(workers, REBUILD_STATE_FILE).run()
+    else:
+        PGtoES(state_file=REBUILD_STATE_FILE).rebuild()
+
+
+def do_rollback():
+    main_logger.debug("Rolling back Elasticsearch indices to their previous versions")
+    PGtoES(state_file=REBUILD_STATE_FILE).rollback()
 
 
 if __name__ == '__main__':
-    do_etl()
+    parser = argparse.ArgumentParser(description="ETL из PostgreSQL в Elasticsearch")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="перестроить индексы без простоя и завершить работу")
+    parser.add_argument('--rollback', action='store_true',
+                        help="вернуть индексы на версии до последней перестройки и завершить работу")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="перестраивать индексы в нескольких процессах, по диапазону id на процесс")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="синхронизировать изменения асинхронным ETL (asyncpg, AsyncElasticsearch)")
+    args = parser.parse_args()
+    if args.rebuild:
+        do_rebuild(args.workers)
+    elif args.rollback:
+        do_rollback()
+    elif args.use_async:
+        do_async_etl()
+    else:
+        do_etl()
@@ -1,157 +1,522 @@
 import logging
+import time
 from datetime import datetime
-from typing import List, Set
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
+from psycopg2 import DatabaseError
+
+from db.cache_notifier import CacheNotifier
 from db.pg_loader import PGLoader
 from db.es_saver import ESSaver
+from db.wal_reader import WalReader
+from pipeline import Pipeline
 from state import State, JsonFileStorage
 
 logger = logging.getLogger(__name__)
 
 
-class PGtoES(PGLoader, ESSaver):
+class PGtoES(PGLoader, ESSaver, CacheNotifier, WalReader):
+
+    # Таблицы, изменения которых затрагивают документы индексов
+    CONTENT_TABLES = ('film_work', 'person', 'genre', 'person_film_work', 'genre_film_work')
+    # Таблица, строкам которой соответствуют документы индекса
+    INDEX_TABLES = {
+        "movies": 'film_work',
+        "persons": 'person',
+        "genres": 'genre',
+    }
 
-    def __init__(self, batch_size: int = 100):
-        self.state = State(JsonFileStorage())
-        self.batch_size = batch_size
+    def __init__(self, batch_size: Optional[int] = None, state_file: Optional[str] = None):
+        self.state = State(JsonFileStorage(state_file))
+        self.batch_size = batch_size or self.get_settings().etl.batch_size
 
     def sync(self):
         logger.debug("Start synchronization round")
+        self.__purge_if_due()
         f_f_ids, f_p_ids, f_g_ids, f_updated_at = self.__get_film_works(self.__get_last_update_time('film_work'))
         p_f_ids, p_p_ids, p_g_ids, p_updated_at = self.__get_persons(self.__get_last_update_time('person'))
         g_f_ids, g_p_ids, g_g_ids, g_updated_at = self.__get_genres(self.__get_last_update_time('genre'))
 
-        all_film_ids = f_f_ids | p_f_ids | g_f_ids
-        if all_film_ids:
-            self.__sync_film_batch(all_film_ids)
+        # Документы, которые не удалось записать в прошлых раундах, повторяются
+        failed = self.failed_ids()
+        all_film_ids = f_f_ids | p_f_ids | g_f_ids | failed.get('movies', set())
+        all_person_ids = f_p_ids | p_p_ids | g_p_ids | failed.get('persons', set())
+        all_genre_ids = f_g_ids | p_g_ids | g_g_ids | failed.get('genres', set())
+        if not (all_film_ids or all_person_ids or all_genre_ids):
+            return
 
-        all_person_ids = f_p_ids | p_p_ids | g_p_ids
-        if all_person_ids:
-            self.__sync_person_batch(all_person_ids)
+        # Прогресс раунда сохраняется после каждой порции. Он действителен,
+        # только пока раунд тот же: если с момента сбоя появились новые
+        # изменения, раунд выполняется заново целиком
+        round_marks = [str(f_updated_at), str(p_updated_at), str(g_updated_at)]
+        progress = self.state.get_state('sync_progress') or {}
+        if progress.get('round') != round_marks:
+            progress = {'round': round_marks}
 
-        all_genre_ids = f_g_ids | p_g_ids | g_g_ids
-        if all_genre_ids:
-            self.__sync_genre_batch(all_genre_ids)
+        self.__sync_documents({'movies': all_film_ids, 'persons': all_person_ids, 'genres': all_genre_ids}, progress)
 
-        if all_film_ids or all_person_ids or all_genre_ids:
-            self.__set_last_update_time('film_work', f_updated_at)
-            self.__set_last_update_time('person', p_updated_at)
-            self.__set_last_update_time('genre', g_updated_at)
+        self.__set_last_update_time('film_work', f_updated_at)
+        self.__set_last_update_time('person', p_updated_at)
+        self.__set_last_update_time('genre', g_updated_at)
+        self.state.set_state('sync_progress', None)
+        self.__finish_bulk_loads()
 
-    def __get_film_works(self, last_updated: datetime):
-        sql = """
-            SELECT DISTINCT
-                fw.id AS film_work_id,
-                pfw.person_id AS person_id,
-                gfw.genre_id AS genre_id,
-                fw.updated_at
-            FROM content.film_work fw
-            LEFT JOIN content.person_film_work pfw ON fw.id = pfw.film_work_id
-            LEFT JOIN content.genre_film_work gfw ON fw.id = gfw.film_work_id
-            WHERE fw.updated_at > '{}'
-            ;""".format(last_updated)
-        return self.__get_entity(last_updated, sql)
+    def listen(self):
+        """
+        Синхронизация по уведомлениям Postgres: триггеры на таблицах
+        content отправляют в канал etl.listen_channel id измененных строк,
+        а ETL ждет их и синхронизирует затронутые документы порциями.
+        Опрос по updated_at выполняется раз в etl.listen_poll_interval
+        секунд и после потери соединения, когда уведомления могли пропасть
+        """
+        etl_settings = self.get_settings().etl
+        next_poll = 0.0
+        while True:
+            try:
+                if next_poll == 0.0:
+                    # Подписка раньше опроса: изменения между ними не потеряются
+                    self.subscribe(etl_settings.listen_channel)
+                if time.monotonic() >= next_poll:
+                    self.sync()
+                    next_poll = time.monotonic() + etl_settings.listen_poll_interval
+                changes = self.wait_notifications(max(next_poll - time.monotonic(), 0),
+                                                  etl_settings.listen_coalesce, self.batch_size)
+                if changes:
+                    self.sync_changes(changes)
+            except DatabaseError as e:
+                logger.exception(f"Потеряно соединение для получения уведомлений: {e}")
+                self.unsubscribe()
+                next_poll = 0.0
 
-    def __get_persons(self, last_updated: datetime):
-        sql = """
-            SELECT DISTINCT
-                pfw.film_work_id AS film_work_id,
-                pfw.person_id AS person_id,
-                gfw.genre_id AS genre_id,
-                p.updated_at
-            FROM content.person p
-            LEFT JOIN content.person_film_work pfw ON p.id = pfw.person_id
-            LEFT JOIN content.film_work fw ON pfw.film_work_id = fw.id
-            LEFT JOIN content.genre_film_work gfw ON fw.id = gfw.film_work_id
-            WHERE p.updated_at > '{}'
-            ;""".format(last_updated)
-        return self.__get_entity(last_updated, sql)
+    def replicate(self):
+        """
+        Синхронизация по журналу Postgres через слот логической репликации
+        etl.cdc_slot. В отличие от опроса по updated_at видит все изменения,
+        в том числе сделанные долгими транзакциями. Позиция в журнале
+        подтверждается после записи порции в Elasticsearch
+        """
+        etl_settings = self.get_settings().etl
+        tables = [f'content.{table}' for table in self.CONTENT_TABLES]
+        started = False
+        while True:
+            try:
+                if not started:
+                    # Изменения до создания слота в журнале не видны, поэтому
+                    # после него выполняется опрос по updated_at. Чтение слота
+                    # начинается после опроса: пока оно не начато, сервер не
+                    # ждет ответов и не разрывает соединение
+                    self.create_slot(etl_settings.cdc_slot)
+                    self.sync()
+                    self.start_replication(etl_settings.cdc_slot, tables)
+                    started = True
+                self.__purge_if_due()
+                changes, lsn = self.read_changes(etl_settings.cdc_keepalive, etl_settings.listen_coalesce,
+                                                 self.batch_size)
+                if changes:
+                    self.sync_changes(changes)
+                self.confirm(lsn)
+            except DatabaseError as e:
+                logger.exception(f"Потеряно соединение репликации: {e}")
+                self.stop_replication()
+                started = False
 
-    def __get_genres(self, last_updated: datetime):
-        sql = """
-            SELECT DISTINCT
-                gfw.film_work_id AS film_work_id,
-                pfw.person_id AS person_id,
-                g.id AS genre_id,
-                g.updated_at
-            FROM content.genre g
-            LEFT JOIN content.genre_film_work gfw ON g.id = gfw.genre_id
-            LEFT JOIN content.film_work fw ON gfw.film_work_id = fw.id
-            LEFT JOIN content.person_film_work pfw ON fw.id = pfw.film_work_id
-            WHERE g.updated_at > '{}'
-            ;""".format(last_updated)
-        return self.__get_entity(last_updated, sql)
-
-    def __get_entity(self, last_updated: datetime, sql: str):
-        records = self.do_query(sql)
-        update_at = max(r['updated_at'] for r in records).strftime('%Y-%m-%d %H:%M:%S.%f') if records else last_updated
-        return (
-            set(r['film_work_id'] for r in records if r['film_work_id']),
-            set(r['person_id'] for r in records if r['person_id']),
-            set(r['genre_id'] for r in records if r['genre_id']),
-            update_at)
-
-    def __sync_film_batch(self, ids: Set[int] or List[int]):
-        sql = """
+    def sync_changes(self, changes: List[dict]):
+        """
+        Синхронизировать документы, затронутые изменениями строк. Каждое
+        изменение содержит имя таблицы и id строки, а для таблиц связей -
+        film_work_id и person_id или genre_id. Изменение строки приходит
+        двумя записями, с прежними и с новыми значениями, поэтому при
+        переносе связи обновляются документы обеих сторон
+        """
+        film_ids, person_ids, genre_ids = set(), set(), set()
+        deleted = {index: set() for index in self.INDEX_TABLES}
+        tables = {table: index for index, table in self.INDEX_TABLES.items()}
+        for change in changes:
+            table = change.get('table')
+            if change.get('op') == 'DELETE' and table in tables:
+                # Документ удаленной строки удаляется сразу; связанные
+                # документы обновятся по изменениям таблиц связей
+                deleted[tables[table]].add(change['id'])
+            elif table == 'film_work':
+                film_ids.add(change['id'])
+            elif table == 'person':
+                person_ids.add(change['id'])
+            elif table == 'genre':
+                genre_ids.add(change['id'])
+            else:
+                film_ids.add(change.get('film_work_id'))
+                person_ids.add(change.get('person_id'))
+                genre_ids.add(change.get('genre_id'))
+        film_ids.discard(None)
+        person_ids.discard(None)
+        genre_ids.discard(None)
+        logger.debug(f"Syncing {len(changes)} changes")
+        for index, ids in deleted.items():
+            if ids:
+                self.__delete_docs(index, sorted(ids))
+
+        # Изменившийся объект затрагивает и связанные документы, как при опросе
+        all_film_ids, all_person_ids, all_genre_ids = set(), set(), set()
+        for sql, column, ids in (
+            (self.FILM_WORK_CHANGES_SQL, 'fw.id', film_ids),
+            (self.PERSON_CHANGES_SQL, 'p.id', person_ids),
+            (self.GENRE_CHANGES_SQL, 'g.id', genre_ids),
+        ):
+            if not ids:
+                continue
+            f_ids, p_ids, g_ids, _ = self.__get_entity(None, sql.format(f"{column} = ANY(%s::uuid[])"), (list(ids),))
+            all_film_ids |= f_ids
+            all_person_ids |= p_ids
+            all_genre_ids |= g_ids
+
+        failed = self.failed_ids()
+        self.__sync_documents({
+            'movies': all_film_ids | failed.get('movies', set()),
+            'persons': all_person_ids | failed.get('persons', set()),
+            'genres': all_genre_ids | failed.get('genres', set()),
+        })
+
+    def rebuild(self):
+        """
+        Перестроить индексы без простоя: загрузить каталог в новые версии
+        индексов в режиме массовой загрузки, пока читатели работают со
+        старыми, затем атомарно перевести на них псевдонимы и догрузить
+        изменения, сделанные за время перестройки. Запускается с отдельным
+        файлом состояния, чтобы не мешать основному процессу ETL
+        """
+        self.start_rebuild()
+        self.sync()
+        self.complete_rebuild()
+
+    def start_rebuild(self) -> Dict[str, str]:
+        """
+        Сбросить отметки синхронизации и создать новые версии индексов в
+        режиме массовой загрузки. Возвращает имена версий по индексам
+        """
+        logger.info("Start full rebuild")
+        for table in ('film_work', 'person', 'genre'):
+            self.state.set_state(table + '_last_update', None)
+        self.state.set_state('sync_progress', None)
+        # В новые версии индексов попадают только существующие строки
+        self.state.set_state('last_purge', time.time())
+        self.index_names = {}
+        for index in self.SCHEMES:
+            name = self.create_index(index, bulk_load=True)
+            self.index_names[index] = name
+            self.state.set_state(f'index_created_{index}', True)
+            self.state.set_state(f'bulk_load_{index}', name)
+        return self.index_names
+
+    def complete_rebuild(self):
+        """
+        Завершить массовую загрузку, перевести псевдонимы на новые версии
+        и догрузить изменения, которые основной ETL записал в старые версии
+        во время перестройки
+        """
+        self.__finish_bulk_loads()
+        for index, name in self.index_names.items():
+            self.swap_alias(index, name)
+            self.notify_replaced(index)
+        self.sync()
+
+    def rollback(self):
+        """
+        Вернуть псевдонимы на версии индексов, которые были до последней
+        перестройки. Изменения, сделанные после нее, в этих версиях
+        отсутствуют, поэтому отметки синхронизации основного ETL нужно
+        сбросить или запустить перестройку заново
+        """
+        for index in self.SCHEMES:
+            if self.rollback_alias(index):
+                self.notify_replaced(index)
+
+    def mark_updated(self):
+        """
+        Запомнить текущие отметки updated_at таблиц: следующий раунд
+        синхронизации возьмет только строки, измененные после них
+        """
+        for table in self.INDEX_TABLES.values():
+            records = self.do_query(f"SELECT MAX(updated_at) AS updated_at FROM content.{table};")
+            updated_at = records[0]['updated_at'] if records else None
+            if updated_at:
+                self.__set_last_update_time(table, updated_at.strftime('%Y-%m-%d %H:%M:%S.%f'))
+
+    def reindex_range(self, lower: Optional[str], upper: Optional[str]):
+        """
+        Загрузить в текущие версии индексов все документы с id из
+        диапазона [lower, upper); None - диапазон не ограничен с этой
+        стороны. Прогресс сохраняется после каждой порции, и повторный
+        запуск продолжает загрузку с места остановки
+        """
+        conditions, params = [], []
+        if lower:
+            conditions.append("id >= %s::uuid")
+            params.append(lower)
+        if upper:
+            conditions.append("id < %s::uuid")
+            params.append(upper)
+        where = " AND ".join(conditions) or "TRUE"
+        ids = {
+            index: {r['id'] for records in self.iter_query(f"SELECT id FROM content.{table} WHERE {where};",
+                                                           tuple(params)) for r in records}
+            for index, table in self.INDEX_TABLES.items()
+        }
+        # Версии индексов уже созданы в режиме массовой загрузки тем, кто
+        # запустил загрузку, он же ее и завершит
+        for index in self.INDEX_TABLES:
+            self.state.set_state(f'index_created_{index}', True)
+            self.state.set_state(f'bulk_load_{index}', self.index_names.get(index))
+        self.__sync_documents(ids, self.state.get_state('sync_progress') or {})
+
+    def purge_deleted(self):
+        """
+        Удалить из индексов документы, строк которых больше нет в Postgres.
+        Id документов и id строк читаются порциями в одном порядке и
+        сравниваются слиянием, поэтому множества целиком в памяти не
+        хранятся
+        """
+        for index, table in self.INDEX_TABLES.items():
+            if not self.index_exists(index):
+                continue
+            stale = []
+            for doc_id in self.__missing_ids(index, table):
+                stale.append(doc_id)
+                if len(stale) >= self.batch_size:
+                    self.__delete_docs(index, stale)
+                    stale = []
+            if stale:
+                self.__delete_docs(index, stale)
+
+    def __purge_if_due(self):
+        interval = self.get_settings().etl.purge_interval
+        if interval and time.time() - (self.state.get_state('last_purge') or 0) >= interval:
+            self.purge_deleted()
+            self.state.set_state('last_purge', time.time())
+
+    def __missing_ids(self, index: str, table: str) -> Iterator[str]:
+        # Порядок uuid в Postgres совпадает с порядком их строк в
+        # нижнем регистре, по которым сортирует Elasticsearch
+        rows = (record['id'] for records in self.iter_query(f"SELECT id FROM content.{table} ORDER BY id;")
+                for record in records)
+        row_id = next(rows, None)
+        for doc_id in self.iter_ids(index):
+            self.keepalive()
+            while row_id is not None and row_id < doc_id:
+                row_id = next(rows, None)
+            if row_id != doc_id:
+                yield doc_id
+
+    def __delete_docs(self, index: str, ids: List[str]):
+        # Строка могла появиться после начала сравнения - такие id
+        # перепроверяются и не удаляются
+        table = self.INDEX_TABLES[index]
+        existing = self.do_query(f"SELECT id FROM content.{table} WHERE id = ANY(%s::uuid[]);", (ids,))
+        if existing is None:
+            # Postgres недоступен - без проверки ничего не удаляем
+            return
+        existing = {record['id'] for record in existing}
+        ids = [doc_id for doc_id in ids if doc_id not in existing]
+        if not ids:
+            return
+        # Теги берутся из удаляемых документов, чтобы сбросить и списки,
+        # в которых они были
+        field = self.TAGS[index][0]
+        tags = self.get_tags(index, self.get_many(ids, index, ['id', field]))
+        logger.info(f"Deleting {len(ids)} {index} removed from Postgres")
+        self.delete_many(ids, index)
+        self.notify(index, ids, tags)
+
+    def __finish_bulk_loads(self):
+        # Во время массовой загрузки кеш по порциям не сбрасывался: документы
+        # становятся видны поиску только сейчас
+        for index in self.finish_bulk_loads():
+            self.notify(index, [])
+
+    def __sync_documents(self, ids: Dict[str, Set[str]], progress: Optional[dict] = None):
+        """
+        Синхронизировать документы индексов порциями по batch_size id в
+        порядке возрастания id. Порции проходят конвейер: чтение из
+        Postgres, сборка действий bulk-запроса и запись в Elasticsearch
+        работают в отдельных потоках, и следующие порции читаются, пока
+        пишутся предыдущие. Если запись отстает, чтение ждет, пока в очереди
+        не освободится место (etl.pipeline_queue_size порций). Если передан
+        прогресс раунда, после записи каждой порции в состоянии запоминается
+        последний записанный id, и после перезапуска раунд продолжается со
+        следующей порции
+        """
+        for index, index_ids in ids.items():
+            if index_ids:
+                self.ensure_index(index)
+        pipeline = Pipeline(self.__extract(ids, progress), [self.__build], self.get_settings().etl.pipeline_queue_size)
+        for index, chunk, records, actions in pipeline:
+            self.__load(index, chunk, records, actions, progress)
+
+    def __extract(self, ids: Dict[str, Set[str]], progress: Optional[dict]) -> Iterator[Tuple[str, List[str], List]]:
+        sql = {"movies": self.FILM_SQL, "persons": self.PERSON_SQL, "genres": self.GENRE_SQL}
+        for index, index_ids in ids.items():
+            last_id = progress.get(index) if progress else None
+            pending = sorted(i for i in index_ids if last_id is None or i > last_id)
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                yield index, chunk, [record for records in self.iter_query(sql[index], (chunk,)) for record in records]
+
+    def __build(self, item: Tuple[str, List[str], List[dict]]) -> Tuple[str, List[str], List[dict], List[dict]]:
+        index, chunk, records = item
+        return index, chunk, records, self.build_actions(records, index)
+
+    def __load(self, index: str, chunk: List[str], records: List[dict], actions: List[dict],
+               progress: Optional[dict]):
+        if records:
+            logger.debug("Syncing batch with {} {}, for example: {}".format(len(records), index, records[0]['id']))
+            bulk_loading = self.bulk_loading(index)
+            if not bulk_loading:
+                # Теги берутся и из прежних версий документов: фильм, убранный
+                # из жанра, должен пропасть и из списка фильмов этого жанра
+                previous = self.get_many([r['id'] for r in records], index, ['id', self.TAGS[index][0]])
+            # Кеш сбрасывается, когда новые документы уже видны поиску: иначе
+            # FastAPI успел бы снова закешировать старые страницы списков
+            errors = self.save_actions(actions, index, refresh=not bulk_loading)
+            failed = self.track_failed(index, chunk, errors)
+            if not bulk_loading:
+                self.notify(index, [r['id'] for r in records if r['id'] not in failed],
+                            self.get_tags(index, previous + records))
+        else:
+            # Строк порции больше нет в Postgres - повторять их запись незачем
+            self.track_failed(index, chunk, [])
+        if progress is not None:
+            progress[index] = chunk[-1]
+            self.state.set_state('sync_progress', progress)
+        self.keepalive()
+
+    # Запросы изменившихся объектов: объект и связанные с ним фильмы, люди
+    # и жанры. Условие отбора подставляется вместо {}. Связи фильма с персонами и с жанрами читаются отдельными ветками
+    # UNION ALL: общий JOIN дал бы по строке на каждую пару персона-жанр.
+    # Документы жанров не содержат персон, а документы персон - жанров,
+    # поэтому изменения персон и жанров затрагивают только их фильмы
+    FILM_WORK_CHANGES_SQL = """
+        WITH changed AS (
+            SELECT fw.id, fw.updated_at
+            FROM content.film_work fw
+            WHERE {}
+        )
+        SELECT c.id AS film_work_id, NULL::uuid AS person_id, NULL::uuid AS genre_id, c.updated_at
+        FROM changed c
+        UNION ALL
+        SELECT c.id, pfw.person_id, NULL, c.updated_at
+        FROM changed c
+        JOIN content.person_film_work pfw ON pfw.film_work_id = c.id
+        UNION ALL
+        SELECT c.id, NULL, gfw.genre_id, c.updated_at
+        FROM changed c
+        JOIN content.genre_film_work gfw ON gfw.film_work_id = c.id
+        ;"""
+    PERSON_CHANGES_SQL = """
+        SELECT
+            pfw.film_work_id AS film_work_id,
+            p.id AS person_id,
+            NULL::uuid AS genre_id,
+            p.updated_at
+        FROM content.person p
+        LEFT JOIN content.person_film_work pfw ON p.id = pfw.person_id
+        WHERE {}
+        ;"""
+    GENRE_CHANGES_SQL = """
+        SELECT
+            gfw.film_work_id AS film_work_id,
+            NULL::uuid AS person_id,
+            g.id AS genre_id,
+            g.updated_at
+        FROM content.genre g
+        LEFT JOIN content.genre_film_work gfw ON g.id = gfw.genre_id
+        WHERE {}
+        ;"""
+
+    # Документы индексов. Жанры и персоны фильма собираются отдельными
+    # подзапросами LATERAL: на фильм читается G + P строк связей, а не G * P
+    FILM_SQL = """
+        SELECT
+            fw.id,
+            fw.rating as imdb_rating,
+            fg.genre,
+            COALESCE(fg.genres, '{}') AS genres,
+            fw.title,
+            fw.description,
+            fp.director,
+            fp.actors_names,
+            fp.writers_names,
+            fp.actors,
+            fp.writers
+        FROM content.film_work fw
+        LEFT JOIN LATERAL (
+            SELECT
+                STRING_AGG(DISTINCT g.name, ' ') AS genre,
+                ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genres
+            FROM content.genre_film_work gfw
+            JOIN content.genre g ON g.id = gfw.genre_id
+            WHERE gfw.film_work_id = fw.id
+        ) fg ON TRUE
+        LEFT JOIN LATERAL (
             SELECT
-                fw.id,
-                fw.rating as imdb_rating,
-                STRING_AGG(DISTINCT g.name, ' ') as genre,
-                ARRAY_AGG(DISTINCT jsonb_build_object('id', g.id, 'name', g.name)) AS genres,
-                fw.title,
-                fw.description,
                 ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'director') AS director,
                 ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'actor') AS actors_names,
                 ARRAY_AGG(DISTINCT p.full_name) FILTER (WHERE pfw.role = 'writer') AS writers_names,
-                ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'actor') AS actors,
-                ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name)) FILTER (WHERE pfw.role = 'writer') AS writers
-            FROM content.film_work fw
-            LEFT JOIN content.genre_film_work gfw ON gfw.film_work_id = fw.id
-            LEFT JOIN content.genre g ON g.id = gfw.genre_id
-            LEFT JOIN content.person_film_work pfw ON pfw.film_work_id = fw.id
-            LEFT JOIN content.person p ON p.id = pfw.person_id
-            WHERE fw.id in ('{}')
-            GROUP BY fw.id;
-            """.format("','".join(ids))
-        self.__sync_batch(sql, 'movies')
-
-    def __sync_person_batch(self, ids: Set[int] or List[int]):
-        sql = """
-            SELECT
-                p.id,
-                p.full_name,
-                p.birth_date,
-                ARRAY_AGG(DISTINCT jsonb_build_object('id', fw.id, 'role', pfw.role, 'title', fw.title)) AS films
-            FROM content.person p
-            LEFT JOIN content.person_film_work pfw ON p.id = pfw.person_id
-            LEFT JOIN content.film_work fw ON pfw.film_work_id = fw.id
-            WHERE p.id in ('{}')
-            GROUP BY p.id;
-            """.format("','".join(ids))
-        self.__sync_batch(sql, 'persons')
-
-    def __sync_genre_batch(self, ids: Set[int] or List[int]):
-        sql = """
-            SELECT
-                g.id,
-                g.name,
-                g.description,
-                ARRAY_AGG(DISTINCT jsonb_build_object('id', fw.id, 'title', fw.title)) AS films
-            FROM content.genre g
-            LEFT JOIN content.genre_film_work gfw ON gfw.genre_id = g.id
-            LEFT JOIN content.film_work fw ON gfw.film_work_id = fw.id
-            WHERE g.id in ('{}')
-            GROUP BY g.id;
-            """.format("','".join(ids))
-        self.__sync_batch(sql, 'genres')
-
-    def __sync_batch(self, sql, index: str):
-        records = self.do_query(sql)
-        logger.debug("Syncing batch with {} {}, for example: {}".format(len(records), index, records[0]['id']))
-        if not self.state.get_state(f'index_created_{index}'):
-            self.create_index(index)
-            self.state.set_state(f'index_created_{index}', True)
-        self.save_many(records, index)
+                ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+                    FILTER (WHERE pfw.role = 'actor') AS actors,
+                ARRAY_AGG(DISTINCT jsonb_build_object('id', p.id, 'name', p.full_name))
+                    FILTER (WHERE pfw.role = 'writer') AS writers
+            FROM content.person_film_work pfw
+            JOIN content.person p ON p.id = pfw.person_id
+            WHERE pfw.film_work_id = fw.id
+        ) fp ON TRUE
+        WHERE fw.id = ANY(%s::uuid[]);
+        """
+    PERSON_SQL = """
+        SELECT
+            p.id,
+            p.full_name,
+            p.birth_date,
+            ARRAY_AGG(DISTINCT jsonb_build_object('id', fw.id, 'role', pfw.role, 'title', fw.title)) AS films
+        FROM content.person p
+        LEFT JOIN content.person_film_work pfw ON p.id = pfw.person_id
+        LEFT JOIN content.film_work fw ON pfw.film_work_id = fw.id
+        WHERE p.id = ANY(%s::uuid[])
+        GROUP BY p.id;
+        """
+    GENRE_SQL = """
+        SELECT
+            g.id,
+            g.name,
+            g.description,
+            ARRAY_AGG(DISTINCT jsonb_build_object('id', fw.id, 'title', fw.title)) AS films
+        FROM content.genre g
+        LEFT JOIN content.genre_film_work gfw ON gfw.genre_id = g.id
+        LEFT JOIN content.film_work fw ON gfw.film_work_id = fw.id
+        WHERE g.id = ANY(%s::uuid[])
+        GROUP BY g.id;
+        """
+
+    def __get_film_works(self, last_updated: datetime):
+        return self.__get_entity(last_updated, self.FILM_WORK_CHANGES_SQL.format("fw.updated_at > %s"))
+
+    def __get_persons(self, last_updated: datetime):
+        return self.__get_entity(last_updated, self.PERSON_CHANGES_SQL.format("p.updated_at > %s"))
+
+    def __get_genres(self, last_updated: datetime):
+        return self.__get_entity(last_updated, self.GENRE_CHANGES_SQL.format("g.updated_at > %s"))
+
+    def __get_entity(self, last_updated: Optional[datetime], sql: str, params: Optional[tuple] = None):
+        # При первой загрузке запрос возвращает все строки связей, поэтому
+        # они читаются порциями и в памяти остаются только множества id
+        film_ids, person_ids, genre_ids = set(), set(), set()
+        max_updated_at = None
+        for records in self.iter_query(sql, params or (last_updated,)):
+            film_ids.update(r['film_work_id'] for r in records if r['film_work_id'])
+            person_ids.update(r['person_id'] for r in records if r['person_id'])
+            genre_ids.update(r['genre_id'] for r in records if r['genre_id'])
+            batch_max = max(r['updated_at'] for r in records)
+            max_updated_at = batch_max if max_updated_at is None else max(max_updated_at, batch_max)
+        update_at = max_updated_at.strftime('%Y-%m-%d %H:%M:%S.%f') if max_updated_at else last_updated
+        return film_ids, person_ids, genre_ids, update_at
 
     def __get_last_update_time(self, table: str):
         last_update_time = self.state.get_state(table + '_last_update')
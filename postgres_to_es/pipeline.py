@@ -0,0 +1,109 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, Iterator, Sequence
+
+# Маркер конца потока элементов
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class Pipeline:
+    """
+    Конвейер обработки. Источник и промежуточные этапы работают в
+    отдельных потоках и передают элементы следующему этапу через очереди
+    не длиннее queue_size, а результаты последнего этапа читаются
+    итерированием конвейера в вызывающем потоке. Когда следующий этап не
+    успевает, очередь перед ним заполняется и предыдущие этапы ждут.
+    Порядок элементов сохраняется. Ошибка этапа останавливает конвейер и
+    выбрасывается в вызывающем потоке. При queue_size = 0 все этапы
+    выполняются по очереди в вызывающем потоке
+    """
+
+    # Как часто ожидающий поток проверяет, не остановлен ли конвейер
+    POLL_SECONDS = 0.1
+
+    def __init__(self, source: Iterable, stages: Sequence[Callable[[Any], Any]], queue_size: int):
+        self.source = source
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def __iter__(self) -> Iterator:
+        if self.queue_size <= 0:
+            for item in self.source:
+                for stage in self.stages:
+                    item = stage(item)
+                yield item
+            return
+
+        stop = threading.Event()
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        threads = [threading.Thread(target=self.__produce, args=(queues[0], stop), daemon=True)]
+        for stage, inbox, outbox in zip(self.stages, queues, queues[1:]):
+            threads.append(threading.Thread(target=self.__process, args=(stage, inbox, outbox, stop), daemon=True))
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _DONE:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+        finally:
+            # Этапы дорабатывают текущий элемент и завершаются, поэтому
+            # после выхода из конвейера их соединения никем не заняты
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def __produce(self, outbox: queue.Queue, stop: threading.Event):
+        try:
+            for item in self.source:
+                if not self.__put(outbox, item, stop):
+                    return
+        except Exception as e:
+            self.__put(outbox, _Failure(e), stop)
+            return
+        finally:
+            # Генератор источника закрывается в своем потоке, а не при сборке мусора
+            close = getattr(self.source, 'close', None)
+            if close:
+                close()
+        self.__put(outbox, _DONE, stop)
+
+    def __process(self, stage: Callable[[Any], Any], inbox: queue.Queue, outbox: queue.Queue,
+                  stop: threading.Event):
+        while True:
+            item = self.__get(inbox, stop)
+            if item is _DONE or isinstance(item, _Failure):
+                self.__put(outbox, item, stop)
+                return
+            try:
+                result = stage(item)
+            except Exception as e:
+                self.__put(outbox, _Failure(e), stop)
+                return
+            if not self.__put(outbox, result, stop):
+                return
+
+    def __put(self, outbox: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                outbox.put(item, timeout=self.POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, inbox: queue.Queue, stop: threading.Event) -> Any:
+        while not stop.is_set():
+            try:
+                return inbox.get(timeout=self.POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
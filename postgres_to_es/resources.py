@@ -1,11 +1,14 @@
+import asyncio
 import logging
 import time
 from functools import wraps
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 
-def backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time: float = 10):
+def backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time: float = 10,
+            max_tries: Optional[int] = None):
     """
     Функция для повторного выполнения функции через некоторое время, если возникла ошибка. Использует наивный
     экспоненциальный рост времени повтора (factor) до граничного времени ожидания (border_sleep_time)
@@ -16,6 +19,7 @@ def backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time:
     :param start_sleep_time: начальное время повтора
     :param factor: во сколько раз нужно увеличить время ожидания
     :param border_sleep_time: граничное время ожидания
+    :param max_tries: сколько всего попыток сделать, после последней ошибка выбрасывается; None - без ограничения
     :return: результат выполнения функции
     """
 
@@ -23,6 +27,7 @@ def backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time:
         @wraps(func)
         def inner(*args, **kwargs):
             t = start_sleep_time
+            tries = 0
             while True:
                 try:
                     res = func(*args, **kwargs)
@@ -30,9 +35,37 @@ def backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time:
                         logger.debug(f"Backoff for {func.__name__} successful!")
                     return res
                 except Exception as e:
+                    tries += 1
+                    if max_tries is not None and tries >= max_tries:
+                        raise
                     logger.exception(f"Backoff exception: {e}")
                 time.sleep(t)
                 t = border_sleep_time if t > border_sleep_time / 2 else t * factor
         return inner
 
     return func_wrapper
+
+
+def async_backoff(start_sleep_time: float = 0.1, factor: float = 2, border_sleep_time: float = 10):
+    """
+    То же, что backoff, для корутин: между попытками ожидание идет через
+    asyncio.sleep и не останавливает остальные задачи цикла событий
+    """
+
+    def func_wrapper(func):
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            t = start_sleep_time
+            while True:
+                try:
+                    res = await func(*args, **kwargs)
+                    if t != start_sleep_time:
+                        logger.debug(f"Backoff for {func.__name__} successful!")
+                    return res
+                except Exception as e:
+                    logger.exception(f"Backoff exception: {e}")
+                await asyncio.sleep(t)
+                t = border_sleep_time if t > border_sleep_time / 2 else t * factor
+        return inner
+
+    return func_wrapper
@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic import BaseModel
 
 
@@ -14,9 +16,60 @@ class ElasticsearchSettings(BaseModel):
     port: int
 
 
+class RedisSettings(BaseModel):
+    host: str
+    port: int
+    password: Optional[str]
+
+
+class EtlSettings(BaseModel):
+    # Читать результаты запросов серверным курсором порциями по itersize строк,
+    # а не загружать их в память целиком
+    stream: bool = True
+    itersize: int = 1000
+    # Сколько документов синхронизируется за одну порцию раунда
+    batch_size: int = 100
+    # Запись в Elasticsearch: streaming - последовательные bulk-запросы,
+    # parallel - bulk-запросы в index_threads потоков. Размер одного
+    # bulk-запроса ограничен числом документов и размером в байтах
+    index_mode: Literal['streaming', 'parallel'] = 'streaming'
+    index_threads: int = 4
+    index_chunk_size: int = 500
+    index_max_chunk_bytes: int = 10 * 1024 * 1024
+    # Сколько раз повторять запись документов, отклоненных Elasticsearch
+    # с временной ошибкой (429 - перегрузка, 5xx - сбой узла)
+    index_retries: int = 3
+    # Сколько порций документов может ждать следующего этапа конвейера
+    # (чтение из Postgres, сборка, запись в Elasticsearch); 0 - выполнять
+    # этапы последовательно в одном потоке
+    pipeline_queue_size: int = 4
+    # poll - искать изменения по updated_at каждые poll_interval секунд;
+    # listen - получать id измененных строк из уведомлений Postgres
+    # (LISTEN/NOTIFY), собирая их в порции в течение listen_coalesce секунд.
+    # В режиме listen опрос по updated_at остается как страховка
+    # и выполняется раз в listen_poll_interval секунд;
+    # cdc - читать изменения из слота логической репликации cdc_slot
+    # (wal2json), отвечая серверу не реже раза в cdc_keepalive секунд
+    mode: Literal['poll', 'listen', 'cdc'] = 'poll'
+    poll_interval: float = 5
+    listen_channel: str = 'content_changes'
+    listen_coalesce: float = 0.2
+    listen_poll_interval: float = 300
+    cdc_slot: str = 'etl_movies'
+    cdc_keepalive: float = 10
+    # Раз в purge_interval секунд документы, строк которых больше нет в
+    # Postgres, удаляются из индексов; 0 - не искать удаленные строки
+    purge_interval: float = 3600
+    # Сколько раз перестройка в несколько процессов (etl.py --rebuild
+    # --workers N) перезапускает сегменты, завершившиеся с ошибкой
+    rebuild_shard_retries: int = 2
+
+
 class AllSettings(BaseModel):
     film_work_pg: PostgresSettings
     film_work_es: ElasticsearchSettings
+    film_work_redis: Optional[RedisSettings]
+    etl: EtlSettings = EtlSettings()
 
 
 class Settings:
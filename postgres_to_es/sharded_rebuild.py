@@ -0,0 +1,116 @@
+import logging
+import multiprocessing
+import os
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+from pg_to_es import PGtoES
+from state import State, JsonFileStorage
+
+logger = logging.getLogger(__name__)
+
+
+def shard_bounds(shards: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Разбить пространство UUID на shards равных диапазонов [lower, upper).
+    Порядок uuid в Postgres совпадает с порядком их 128-битных чисел
+    """
+    bounds = [str(UUID(int=i * 2 ** 128 // shards)) for i in range(1, shards)]
+    return list(zip([None, *bounds], [*bounds, None]))
+
+
+def shard_state_file(state_file: str, shard: int) -> str:
+    return f"{os.path.splitext(state_file)[0]}_shard{shard}.json"
+
+
+def reindex_shard(shard: int, lower: Optional[str], upper: Optional[str], index_names: Dict[str, str],
+                  state_file: str):
+    """Процесс сегмента: свои соединения с Postgres и Elasticsearch и свой файл состояния"""
+    pte = PGtoES(state_file=shard_state_file(state_file, shard))
+    pte.index_names = index_names
+    logger.info(f"Shard {shard}: reindexing ids from {lower} to {upper}")
+    pte.reindex_range(lower, upper)
+    pte.state.set_state('shard_done', True)
+
+
+class ShardedRebuild:
+    """
+    Перестройка индексов несколькими процессами. Как и PGtoES.rebuild,
+    загружает каталог в новые версии индексов и переводит на них
+    псевдонимы, но id фильмов, персон и жанров делятся на shards диапазонов,
+    и каждый диапазон загружает отдельный процесс. План перестройки
+    хранится в файле состояния, а прогресс сегментов - в их собственных
+    файлах, поэтому после сбоя повторный запуск с тем же числом сегментов
+    перезапускает только незавершенные сегменты
+    """
+
+    def __init__(self, shards: int, state_file: str):
+        self.shards = shards
+        self.state_file = state_file
+        self.pte = PGtoES(state_file=state_file)
+
+    def run(self):
+        plan = self.pte.state.get_state('shard_plan')
+        if not plan or plan['shards'] != self.shards:
+            self.__remove_shard_states(max(plan['shards'] if plan else 0, self.shards))
+            index_names = self.pte.start_rebuild()
+            # Изменения, сделанные во время загрузки сегментов, догрузит
+            # синхронизация после перевода псевдонимов
+            self.pte.mark_updated()
+            plan = {'shards': self.shards, 'indices': index_names}
+            self.pte.state.set_state('shard_plan', plan)
+        else:
+            logger.info("Resuming sharded rebuild")
+        self.pte.index_names = plan['indices']
+
+        pending = [shard for shard in range(self.shards) if not self.__shard_state(shard).get_state('shard_done')]
+        for attempt in range(self.pte.get_settings().etl.rebuild_shard_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                logger.warning(f"Retrying failed shards {pending}")
+            pending = self.__run_shards(pending, plan['indices'])
+        if pending:
+            raise RuntimeError(f"Shards {pending} failed, run the rebuild again to retry them")
+
+        self.__collect_failed()
+        self.pte.complete_rebuild()
+        self.pte.state.set_state('shard_plan', None)
+        self.__remove_shard_states(self.shards)
+
+    def __run_shards(self, shards: List[int], index_names: Dict[str, str]) -> List[int]:
+        """Запустить процессы сегментов и вернуть номера сегментов, завершившихся с ошибкой"""
+        # Новые процессы не наследуют соединения родителя
+        context = multiprocessing.get_context('spawn')
+        bounds = shard_bounds(self.shards)
+        processes = {
+            shard: context.Process(target=reindex_shard, name=f'shard-{shard}',
+                                   args=(shard, *bounds[shard], index_names, self.state_file))
+            for shard in shards
+        }
+        for process in processes.values():
+            process.start()
+        for process in processes.values():
+            process.join()
+        return [shard for shard, process in processes.items() if process.exitcode != 0]
+
+    def __collect_failed(self):
+        """
+        Перенести в состояние перестройки id документов, которые сегменты
+        не смогли записать: их повторит синхронизация после перевода
+        псевдонимов, а файлы сегментов будут удалены
+        """
+        failed = self.pte.failed_ids()
+        for shard in range(self.shards):
+            for index, ids in (self.__shard_state(shard).get_state('failed_ids') or {}).items():
+                failed.setdefault(index, set()).update(ids)
+        self.pte.state.set_state('failed_ids', {index: sorted(ids) for index, ids in failed.items() if ids})
+
+    def __shard_state(self, shard: int) -> State:
+        return State(JsonFileStorage(shard_state_file(self.state_file, shard)))
+
+    def __remove_shard_states(self, shards: int):
+        for shard in range(shards):
+            path = shard_state_file(self.state_file, shard)
+            if os.path.exists(path):
+                os.remove(path)
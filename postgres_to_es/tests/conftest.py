@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули ETL импортируются так же, как при запуске из каталога postgres_to_es
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+"""
+Тесты разбора ошибок bulk-запросов и учета незаписанных документов
+"""
+
+import pytest
+
+from db.es_saver import ESSaver
+from state import JsonFileStorage, State
+
+
+def bulk_error(doc_id, status, op='index'):
+    return {op: {'_id': doc_id, 'status': status, 'error': {'type': 'some_error'}}}
+
+
+def action(doc_id):
+    return {'_index': 'movies', '_id': doc_id, 'title': f'Film {doc_id}'}
+
+
+@pytest.fixture()
+def saver(tmp_path):
+    saver = ESSaver()
+    saver.state = State(JsonFileStorage(str(tmp_path / 'state.json')))
+    return saver
+
+
+def test_split_bulk_errors():
+    """429 и 5xx повторяются, остальные ошибки возвращаются как постоянные"""
+    actions = [action(doc_id) for doc_id in ('a', 'b', 'c', 'd')]
+    errors = [bulk_error('a', 429), bulk_error('b', 400), bulk_error('c', 503), bulk_error('d', 404, 'delete')]
+    retry, permanent = ESSaver.split_bulk_errors(actions, errors)
+    assert [item['_id'] for item in retry] == ['a', 'c']
+    assert permanent == [errors[1], errors[3]]
+
+
+def test_split_bulk_errors_matches_ids_as_strings():
+    """Id действий сравниваются с id ошибок как строки"""
+    retry, permanent = ESSaver.split_bulk_errors([{'_id': 1}, {'_id': 2}], [bulk_error('2', 500)])
+    assert retry == [{'_id': 2}]
+    assert permanent == []
+
+
+def test_split_bulk_errors_without_errors():
+    assert ESSaver.split_bulk_errors([action('a')], []) == ([], [])
+
+
+def test_track_failed_remembers_and_forgets(saver):
+    """Незаписанные id запоминаются, а записанные в следующей порции - забываются"""
+    assert saver.track_failed('movies', ['a', 'b', 'c'], [bulk_error('a', 400), bulk_error('b', 429)]) == {'a', 'b'}
+    assert saver.failed_ids() == {'movies': {'a', 'b'}}
+
+    assert saver.track_failed('movies', ['a', 'd'], [bulk_error('d', 400)]) == {'d'}
+    assert saver.failed_ids() == {'movies': {'b', 'd'}}
+
+
+def test_track_failed_keeps_indices_apart(saver):
+    saver.track_failed('movies', ['a'], [bulk_error('a', 400)])
+    saver.track_failed('persons', ['a'], [])
+    assert saver.failed_ids() == {'movies': {'a'}}
+
+    saver.track_failed('movies', ['a'], [])
+    assert saver.failed_ids() == {}
+    assert saver.state.get_state('failed_ids') == {}
@@ -0,0 +1,92 @@
+"""
+Тесты конвейера обработки: порядок элементов и передача ошибок этапов
+"""
+
+import threading
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def double(item):
+    return item * 2
+
+
+def increment(item):
+    return item + 1
+
+
+@pytest.mark.parametrize("queue_size", [0, 1, 3])
+def test_stages_applied_in_order(queue_size):
+    """Этапы применяются по порядку, а порядок элементов сохраняется"""
+    assert list(Pipeline(range(10), [double, increment], queue_size)) == [i * 2 + 1 for i in range(10)]
+
+
+def test_stages_run_in_threads():
+    """При queue_size > 0 этапы выполняются не в вызывающем потоке"""
+    threads = set()
+
+    def remember_thread(item):
+        threads.add(threading.get_ident())
+        return item
+
+    assert list(Pipeline(range(3), [remember_thread], 1)) == [0, 1, 2]
+    assert threads and threading.get_ident() not in threads
+
+
+@pytest.mark.parametrize("queue_size", [0, 2])
+def test_stage_error_raised_in_caller(queue_size):
+    """Ошибка этапа выбрасывается в вызывающем потоке после уже готовых элементов"""
+    def fail_on_three(item):
+        if item == 3:
+            raise ValueError("bad item")
+        return item
+
+    result = []
+    with pytest.raises(ValueError, match="bad item"):
+        for item in Pipeline(range(10), [fail_on_three, increment], queue_size):
+            result.append(item)
+    assert result == [1, 2, 3]
+
+
+def test_source_error_raised_in_caller():
+    """Ошибка источника тоже выбрасывается в вызывающем потоке"""
+    def source():
+        yield 1
+        raise RuntimeError("source failed")
+
+    with pytest.raises(RuntimeError, match="source failed"):
+        list(Pipeline(source(), [increment], 2))
+
+
+def test_stages_stop_after_error():
+    """После ошибки этапы не обрабатывают оставшиеся элементы источника"""
+    processed = []
+
+    def fail_on_first(item):
+        raise ValueError("stop")
+
+    def remember(item):
+        processed.append(item)
+        return item
+
+    with pytest.raises(ValueError):
+        list(Pipeline(range(1000), [fail_on_first, remember], 1))
+    assert processed == []
+
+
+def test_source_closed_on_early_exit():
+    """Если вызывающий прекращает чтение, генератор источника закрывается"""
+    closed = threading.Event()
+
+    def source():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    for item in Pipeline(source(), [increment], 1):
+        break
+    assert closed.is_set()
@@ -0,0 +1,41 @@
+"""
+Тесты разбиения пространства UUID на диапазоны сегментов перестройки
+"""
+
+from uuid import UUID
+
+import pytest
+
+from sharded_rebuild import shard_bounds
+
+
+def test_single_shard_is_unbounded():
+    assert shard_bounds(1) == [(None, None)]
+
+
+@pytest.mark.parametrize("shards", [2, 3, 4, 7, 16])
+def test_bounds_cover_uuid_space(shards):
+    """Диапазоны идут подряд без пропусков и пересечений и покрывают все UUID"""
+    bounds = shard_bounds(shards)
+    assert len(bounds) == shards
+    assert bounds[0][0] is None
+    assert bounds[-1][1] is None
+    for (_, upper), (lower, _) in zip(bounds, bounds[1:]):
+        assert upper == lower
+    inner = [UUID(lower).int for lower, _ in bounds[1:]]
+    assert inner == sorted(set(inner))
+
+
+def test_two_shards_split_in_half():
+    assert shard_bounds(2) == [
+        (None, '80000000-0000-0000-0000-000000000000'),
+        ('80000000-0000-0000-0000-000000000000', None),
+    ]
+
+
+def test_bounds_are_equal_width():
+    """Ширина диапазонов отличается не больше чем на единицу из-за округления"""
+    shards = 3
+    points = [0, *(UUID(lower).int for lower, _ in shard_bounds(shards)[1:]), 2 ** 128]
+    widths = {upper - lower for lower, upper in zip(points, points[1:])}
+    assert max(widths) - min(widths) <= 1
@@ -0,0 +1,53 @@
+"""
+Тесты разбора сообщений wal2json (format-version 2) в изменения строк
+"""
+
+from db.wal_reader import WalReader
+
+FILM_ID = 'bb74a838-584e-11ec-9885-c13c488d29c0'
+OTHER_FILM_ID = '3d825f60-9fff-4dfe-b294-1a45fa1e115d'
+PERSON_ID = '46e70470-592f-11ec-8b39-d99d30aa920b'
+
+
+def to_changes(message):
+    return WalReader()._WalReader__to_changes(message)
+
+
+def columns(**values):
+    return [{'name': name, 'type': 'uuid', 'value': value} for name, value in values.items()]
+
+
+def test_insert():
+    message = {'action': 'I', 'schema': 'content', 'table': 'film_work',
+               'columns': columns(id=FILM_ID) + [{'name': 'title', 'type': 'text', 'value': 'Some film'}]}
+    assert to_changes(message) == [{
+        'id': FILM_ID, 'film_work_id': None, 'person_id': None, 'genre_id': None,
+        'table': 'film_work', 'op': 'INSERT',
+    }]
+
+
+def test_update_of_link_gives_new_and_old_row():
+    """Перенос связи на другой фильм затрагивает и новый, и прежний фильм"""
+    message = {
+        'action': 'U', 'schema': 'content', 'table': 'person_film_work',
+        'columns': columns(id='1', film_work_id=OTHER_FILM_ID, person_id=PERSON_ID),
+        'identity': columns(id='1', film_work_id=FILM_ID, person_id=PERSON_ID),
+    }
+    changes = to_changes(message)
+    assert [change['film_work_id'] for change in changes] == [OTHER_FILM_ID, FILM_ID]
+    assert all(change['op'] == 'UPDATE' and change['person_id'] == PERSON_ID for change in changes)
+
+
+def test_delete_uses_identity():
+    message = {'action': 'D', 'schema': 'content', 'table': 'person', 'identity': columns(id=PERSON_ID)}
+    assert to_changes(message) == [{
+        'id': PERSON_ID, 'film_work_id': None, 'person_id': None, 'genre_id': None,
+        'table': 'person', 'op': 'DELETE',
+    }]
+
+
+def test_transaction_markers_are_skipped():
+    """Сообщения начала и конца транзакции изменений не содержат"""
+    assert to_changes({'action': 'B'}) == []
+    assert to_changes({'action': 'C'}) == []
+    assert to_changes({'action': 'T', 'table': 'film_work'}) == []
@@ -135,3 +135,56 @@ async def test_no_index():
     async with aiohttp.ClientSession() as session:
         async with session.get(f"http://{API_HOST}/api/v1/film") as ans:
             assert ans.status == 500
+
+
+@pytest.mark.asyncio
+async def test_film_batch(some_film):
+    """Проверяем, что пакетный запрос возвращает только существующие фильмы"""
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+            f"http://{API_HOST}/api/v1/film/batch",
+            json=["bb74a838-584e-11ec-9885-c13c488d29c0", "00000000-0000-0000-0000-000000000000"]
+        ) as ans:
+            assert ans.status == 200
+            data = await ans.json()
+            assert isinstance(data, list)
+            assert len(data) == 1
+            assert data[0]["uuid"] == "bb74a838-584e-11ec-9885-c13c488d29c0"
+            assert data[0]["title"] == "Some film"
+
+
+@pytest.mark.asyncio
+async def test_film_search(some_film):
+    """Проверяем, что фильм находится по слову из описания, а совпадение выделено"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://{API_HOST}/api/v1/film/search", params={"query": "testing"}) as ans:
+            assert ans.status == 200
+            data = await ans.json()
+            assert len(data) == 1
+            assert data[0]["uuid"] == "bb74a838-584e-11ec-9885-c13c488d29c0"
+            assert "<em>testing</em>" in data[0]["highlight"]["description"][0]
+        async with session.get(f"http://{API_HOST}/api/v1/film/search", params={"query": "nothing"}) as ans:
+            assert ans.status == 404
+
+
+@pytest.mark.asyncio
+async def test_film_page_params(some_film):
+    """Проверяем, что некорректные курсор и размер страницы отклоняются до запроса к Elasticsearch"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://{API_HOST}/api/v1/film", params={"page[cursor]": "not a cursor"}) as ans:
+            assert ans.status == 400
+        for params in ({"page[size]": "0"}, {"page[size]": "100000"}, {"page[number]": "-1"}):
+            async with session.get(f"http://{API_HOST}/api/v1/film", params=params) as ans:
+                assert ans.status == 422
+
+
+@pytest.mark.asyncio
+async def test_film_export(some_film):
+    """Проверяем, что выгрузка каталога отдает фильмы построчно в формате NDJSON"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://{API_HOST}/api/v1/film/export") as ans:
+            assert ans.status == 200
+            assert ans.headers["Content-Type"].startswith("application/x-ndjson")
+            lines = (await ans.text()).splitlines()
+            assert len(lines) == 1
+            assert json.loads(lines[0])["uuid"] == "bb74a838-584e-11ec-9885-c13c488d29c0"
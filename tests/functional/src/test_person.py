@@ -27,7 +27,7 @@ def some_person(request):
         {
             "id": "23d3d644-5abe-11ec-b50c-5378d698a87b",
             "full_name": "John Smith",
-            "birth_date": "01.01.2001",
+            "birth_date": "2001-01-01",
             "films": [{"id": "6fbe525a-5abe-11ec-b50c-5378d698a87b", "title": "John's film", "role": "actor"}],
         }
     ]
@@ -89,6 +89,19 @@ async def test_some_person(some_person):
             data = await ans.json()
             assert data["uuid"] == "23d3d644-5abe-11ec-b50c-5378d698a87b"
             assert data["full_name"] == "John Smith"
+            assert data["birth_date"] == "2001-01-01"
+
+
+@pytest.mark.asyncio
+async def test_person_search_birth_date(some_person):
+    """Проверяем, что найденный по имени человек возвращается с датой рождения"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://{API_HOST}/api/v1/person", params={"search[name]": "john"}) as ans:
+            assert ans.status == 200
+            data = await ans.json()
+            assert len(data) == 1
+            assert data[0]['uuid'] == "23d3d644-5abe-11ec-b50c-5378d698a87b"
+            assert data[0]["birth_date"] == "2001-01-01"
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,76 @@
+"""
+Тесты подсказок при наборе названий фильмов
+"""
+
+import json
+import os
+
+import aiohttp
+import pytest
+from elasticsearch import Elasticsearch, helpers
+
+# Строка с именем хоста и портом
+ELASTIC_HOST = os.getenv('ELASTIC_HOST')
+API_HOST = os.getenv('API_HOST')
+
+
+@pytest.fixture()
+def suggest_films(request):
+    """
+    Заполнить индексы ElasticSearch фильмом с полем подсказок, как это делает ETL
+    """
+    with open("testdata/schemes.json") as fd:
+        schemes = json.load(fd)
+    docs = [
+        {
+            "id": "5b0e0e3c-6f1c-11ec-90d6-0242ac120003",
+            "imdb_rating": 8.1,
+            "genre": "Sci-Fi",
+            "title": "Star Trek",
+            "title_suggest": {"input": ["Star Trek", "Trek"], "weight": 81},
+            "description": "Space adventure",
+            "genres": [],
+            "director": "Gene Roddenberry",
+            "actors": [],
+            "writers": [],
+            "actors_names": [],
+            "writers_names": [],
+        }
+    ]
+    es = Elasticsearch(f"http://{ELASTIC_HOST}")
+    for index, scheme in (('movies', 'film_scheme'), ('persons', 'person_scheme')):
+        try:
+            es.indices.delete(index)
+        except:
+            pass
+        es.indices.create(index, schemes[scheme])
+    helpers.bulk(es, [{'_index': 'movies', '_id': doc["id"], **doc} for doc in docs], refresh=True)
+
+    def teardown():
+        """Удалить созданные для тестирования временные объекты"""
+        es.indices.delete('movies')
+        es.indices.delete('persons')
+
+    request.addfinalizer(teardown)
+
+
+@pytest.mark.asyncio
+async def test_suggest(suggest_films):
+    """Проверяем, что фильм подсказывается по началу любого слова названия"""
+    async with aiohttp.ClientSession() as session:
+        for prefix in ("sta", "  TRE"):
+            async with session.get(f"http://{API_HOST}/api/v1/suggest", params={"prefix": prefix}) as ans:
+                assert ans.status == 200
+                data = await ans.json()
+                assert [film["uuid"] for film in data["films"]] == ["5b0e0e3c-6f1c-11ec-90d6-0242ac120003"]
+                assert data["films"][0]["text"] == "Star Trek"
+                assert data["persons"] == []
+
+
+@pytest.mark.asyncio
+async def test_suggest_empty_prefix():
+    """Проверяем, что префикс без букв и цифр отклоняется"""
+    async with aiohttp.ClientSession() as session:
+        for prefix in ("   ", "?!"):
+            async with session.get(f"http://{API_HOST}/api/v1/suggest", params={"prefix": prefix}) as ans:
+                assert ans.status == 400